@@ -26,6 +26,60 @@ const MOCK_DATA = [
     },
 ];
 
+// Server items have string ids and get cached thumbnails; mock items use their path
+const hasThumbnail = (item) => typeof item.id === "string";
+const thumbUrl = (item, size = 256) =>
+    hasThumbnail(item) ? `/api/thumb/${item.id}?size=${size}` : item.path;
+
+// --- Chunked Uploads ---
+// Uploads go up in chunks so a dropped connection resumes instead of restarting
+const uploadInChunks = async (file, meta, retries = 3) => {
+    const initRes = await fetch("/api/uploads", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ ...meta, filename: file.name, size: file.size }),
+    });
+    const session = await initRes.json();
+    if (!initRes.ok) throw new Error(session.error || "Upload failed");
+
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        const chunk = file.slice(offset, offset + session.chunk_size);
+        try {
+            const res = await fetch(`/api/uploads/${session.upload_id}?offset=${offset}`, {
+                method: "PUT",
+                body: chunk,
+            });
+            const data = await res.json();
+            if (res.status === 413) throw Object.assign(new Error(data.error), { fatal: true });
+            if (!res.ok) throw Object.assign(new Error(data.error || "Upload failed"), { offset: data.offset });
+            offset = data.offset;
+            failures = 0;
+        } catch (err) {
+            if (err.fatal || ++failures > retries) throw err;
+            // Back off (a 409 means another request still holds the upload), then
+            // carry on from however much the server kept
+            await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** (failures - 1)));
+            if (err.offset !== undefined) {
+                offset = err.offset;
+            } else {
+                const status = await fetch(`/api/uploads/${session.upload_id}`).then(r => r.json());
+                offset = status.offset;
+            }
+        }
+    }
+
+    const res = await fetch("/api/uploads/finalize", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ upload_ids: [session.upload_id] }),
+    });
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.errors?.[session.upload_id]?.error || "Upload failed");
+    return data.items[0];
+};
+
 // --- Icon Component (Lucide via data-lucide) ---
 const ICON_MAP = {
     'library': '📚',
@@ -157,15 +211,20 @@ const Breadcrumbs = ({ path, onNavigate }) => {
     );
 };
 
-const FolderCard = ({ name, items, coverItems, onClick }) => {
+const pickCover = (items, coverItems) => {
     const coverSource = coverItems && coverItems.length > 0 ? coverItems : items;
-    const coverItem =
+    return (
         coverSource.find((i) => i.hidden && (i.tags || []).includes("_cover")) ||
         coverSource.find((i) => (i.tags || []).includes("_cover")) ||
         coverSource.find((i) => i.type === "image") ||
-        coverSource[0];
+        coverSource[0]
+    );
+};
 
-    const visibleCount = items.filter((i) => !i.hidden).length;
+// Folders from /api/tree arrive with their count and cover already resolved
+const FolderCard = ({ name, items, coverItems, count, cover, onClick }) => {
+    const coverItem = cover !== undefined ? cover : pickCover(items, coverItems);
+    const visibleCount = count !== undefined ? count : items.filter((i) => !i.hidden).length;
 
     return (
         <div
@@ -176,7 +235,7 @@ const FolderCard = ({ name, items, coverItems, onClick }) => {
                 {coverItem ? (
                     coverItem.type === "image" ? (
                         <img
-                            src={coverItem.path}
+                            src={thumbUrl(coverItem, 640)}
                             alt={name}
                             className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
                         />
@@ -231,11 +290,20 @@ const FileCard = ({ item, onClick, onEdit, onSetCover, selectionMode, isSelected
             <div className="aspect-square bg-gray-100 dark:bg-gray-700 relative overflow-hidden">
                 {item.type === "video" ? (
                     <div className="w-full h-full relative">
-                        <video
-                            src={item.path}
-                            className="w-full h-full object-cover opacity-80"
-                            preload="metadata"
-                        />
+                        {hasThumbnail(item) ? (
+                            <img
+                                src={thumbUrl(item)}
+                                alt={item.original_name}
+                                className="w-full h-full object-cover opacity-80"
+                                loading="lazy"
+                            />
+                        ) : (
+                            <video
+                                src={item.path}
+                                className="w-full h-full object-cover opacity-80"
+                                preload="metadata"
+                            />
+                        )}
                         <div className="absolute inset-0 flex items-center justify-center">
                             <div className="bg-white/30 backdrop-blur-sm p-3 rounded-full">
                                 <Icon name="play" className="w-6 h-6 text-white fill-current" />
@@ -244,7 +312,7 @@ const FileCard = ({ item, onClick, onEdit, onSetCover, selectionMode, isSelected
                     </div>
                 ) : (
                     <img
-                        src={item.path}
+                        src={thumbUrl(item)}
                         alt={item.original_name}
                         className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
                         loading="lazy"
@@ -341,6 +409,7 @@ const App = () => {
 
     const [searchInput, setSearchInput] = useState(initialUiState?.searchInput || "");
     const [searchQuery, setSearchQuery] = useState(initialUiState?.searchQuery || "");
+    const [searchResults, setSearchResults] = useState(null);
     const [viewMode, setViewMode] = useState(initialUiState?.viewMode || "title"); // "title" or "category"
 
     const [visibleCount, setVisibleCount] = useState(initialUiState?.visibleCount || 48);
@@ -437,11 +506,46 @@ const App = () => {
         localStorage.setItem('theme', newMode ? 'dark' : 'light');
     };
 
+    // Catalog revision of the media list we hold; lets refreshes fetch only deltas
+    const mediaRevision = useRef(null);
+
+    const syncMediaChanges = async () => {
+        const res = await fetch(`/api/media/changes?since=${encodeURIComponent(mediaRevision.current)}`);
+        if (!res.ok) return false;
+        const data = await res.json();
+        if (data.reset) return false;
+        const updates = new Map([...data.added, ...data.changed].map(item => [item.id, item]));
+        const removed = new Set(data.removed);
+        if (updates.size || removed.size) {
+            setMedia(prev => {
+                const pending = new Map(updates);
+                const next = [];
+                for (const item of prev) {
+                    if (removed.has(item.id)) continue;
+                    if (pending.has(item.id)) {
+                        next.push(pending.get(item.id));
+                        pending.delete(item.id);
+                    } else {
+                        next.push(item);
+                    }
+                }
+                return next.concat([...pending.values()]);
+            });
+        }
+        mediaRevision.current = data.revision;
+        return true;
+    };
+
     const fetchMedia = async () => {
         try {
+            if (mediaRevision.current && await syncMediaChanges()) {
+                setServerActive(true);
+                return;
+            }
             const res = await fetch("/api/media");
             if (!res.ok) throw new Error("Server not reachable");
             const data = await res.json();
+            mediaRevision.current = res.headers.get("X-Catalog-Revision");
             setMedia(data);
             setServerActive(true);
         } catch (err) {
@@ -458,6 +562,61 @@ const App = () => {
         fetchMedia();
     }, []);
 
+    // Folder cards for the current location, from the server's materialized tree.
+    // They arrive long before the full library, so the landing page renders first.
+    const [tree, setTree] = useState(null);
+    const treeKey = `${viewMode}|${currentPath.join("/")}`;
+
+    useEffect(() => {
+        let cancelled = false;
+        const params = new URLSearchParams({ by: viewMode });
+        currentPath.forEach((segment) => params.append("path", segment));
+        fetch(`/api/tree?${params}`)
+            .then((res) => (res.ok ? res.json() : null))
+            .then((data) => {
+                if (!cancelled) setTree(data ? { key: treeKey, folders: data.folders } : null);
+            })
+            .catch(() => {
+                if (!cancelled) setTree(null);
+            });
+        return () => {
+            cancelled = true;
+        };
+    }, [treeKey, media]);
+
+    const treeFolders = tree && tree.key === treeKey ? tree.folders : null;
+    const sortFolders = (folders) => [...folders].sort((a, b) => a.name.localeCompare(b.name));
+
+    // Search runs on the server when it is available; preview mode filters locally
+    useEffect(() => {
+        if (!searchQuery || !serverActive) {
+            setSearchResults(null);
+            return;
+        }
+        let cancelled = false;
+        const found = [];
+        // Results arrive a page at a time, so large result sets are not cut off
+        const fetchPage = (offset) =>
+            fetch(`/api/search?q=${encodeURIComponent(searchQuery)}&limit=5000&offset=${offset}`)
+                .then((res) => (res.ok ? res.json() : null))
+                .then((data) => {
+                    if (cancelled) return;
+                    if (!data) {
+                        setSearchResults(found.length ? [...found] : null);
+                        return;
+                    }
+                    found.push(...data.items);
+                    setSearchResults([...found]);
+                    return data.next_offset != null ? fetchPage(data.next_offset) : null;
+                });
+        fetchPage(0).catch(() => {
+            if (!cancelled) setSearchResults(found.length ? [...found] : null);
+        });
+        return () => {
+            cancelled = true;
+        };
+    }, [searchQuery, serverActive, media]);
+
     const categories = [...new Set(media.map((m) => m.category))].filter(Boolean).sort();
     const titles = [...new Set(media.map((m) => m.title))].filter(Boolean).sort();
 
@@ -501,6 +660,10 @@ const App = () => {
     };
 
     const viewContent = useMemo(() => {
+        if (searchQuery && searchResults) {
+            return { mode: "search", folders: [], files: searchResults };
+        }
+
         if (searchQuery) {
             const q = searchQuery.toLowerCase();
             const items = media.filter((item) => {
@@ -523,6 +686,9 @@ const App = () => {
         const groupField = viewMode === "category" ? "category" : "title";
 
         // At root level (no currentPath), show folders grouped by the selected field
+        if (currentPath.length === 0 && treeFolders) {
+            return { mode: "browse", folders: sortFolders(treeFolders), files: [] };
+        }
         if (currentPath.length === 0) {
             const groups = {};
             media.forEach((item) => {
@@ -577,12 +743,12 @@ const App = () => {
 
         return {
             mode: "browse",
-            folders: Object.values(foldersMap).sort((a, b) => a.name.localeCompare(b.name)),
+            folders: sortFolders(treeFolders || Object.values(foldersMap)),
             files: files.sort((a, b) =>
                 getFileSortKey(a).localeCompare(getFileSortKey(b), undefined, { numeric: true })
             ),
         };
-    }, [media, currentPath, searchQuery, viewMode]);
+    }, [media, currentPath, searchQuery, searchResults, viewMode, treeFolders]);
 
     const visibleFiles = useMemo(() => {
         return viewContent.files.slice(0, visibleCount);
@@ -611,13 +777,29 @@ const App = () => {
         setSearchInput("");
     };
 
+    // Resolves with the final job status once a background scan finishes
+    const waitForScan = (jobId) =>
+        new Promise((resolve, reject) => {
+            const events = new EventSource(`/api/scan/${jobId}/events`);
+            events.addEventListener("done", (e) => {
+                events.close();
+                resolve(JSON.parse(e.data));
+            });
+            events.onerror = () => {
+                events.close();
+                reject(new Error("Lost connection to scan"));
+            };
+        });
+
     const handleScan = async () => {
         if (!serverActive) return showToast("Server not active", "error");
         setScanning(true);
         try {
             const res = await fetch("/api/scan", { method: "POST" });
-            const data = await res.json();
-            showToast(data.message, "success");
+            const job = await res.json();
+            const data = await waitForScan(job.job_id);
+            if (data.status === "failed") throw new Error(data.error);
+            showToast(data.result.message, "success");
             fetchMedia();
         } catch (e) {
             showToast("Scan failed", "error");
@@ -678,29 +860,26 @@ const App = () => {
     const handleUploadSubmit = async (e) => {
         e.preventDefault();
         setProcessing(true);
-        const formData = new FormData();
-        formData.append("file", uploadForm.file);
-        formData.append("title", uploadForm.title);
-        formData.append("category", uploadForm.category);
-        formData.append("tags", uploadForm.tags);
-        formData.append("is_hidden", uploadForm.is_hidden);
 
         try {
-            const res = await fetch("/api/upload", { method: "POST", body: formData });
-            if (res.ok) {
-                setIsUploadOpen(false);
-                setUploadForm({
-                    file: null,
-                    title: "",
-                    category: "General",
-                    tags: "",
-                    is_hidden: false,
-                });
-                showToast("File uploaded successfully");
-                fetchMedia();
-            } else showToast("Upload failed", "error");
+            await uploadInChunks(uploadForm.file, {
+                title: uploadForm.title,
+                category: uploadForm.category,
+                tags: uploadForm.tags,
+                is_hidden: uploadForm.is_hidden,
+            });
+            setIsUploadOpen(false);
+            setUploadForm({
+                file: null,
+                title: "",
+                category: "General",
+                tags: "",
+                is_hidden: false,
+            });
+            showToast("File uploaded successfully");
+            fetchMedia();
         } catch (error) {
-            showToast("Error uploading", "error");
+            showToast(error.message || "Error uploading", "error");
         } finally {
             setProcessing(false);
         }
@@ -1309,7 +1488,7 @@ const App = () => {
                     </div>
                 </div>
 
-                {loading ? (
+                {loading && !(currentPath.length === 0 && !searchQuery && treeFolders) ? (
                     <div className="flex justify-center py-20">
                         <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-blue-600"></div>
                     </div>
@@ -1340,6 +1519,8 @@ const App = () => {
                                     name={folder.name}
                                     items={folder.items}
                                     coverItems={folder.coverItems}
+                                    count={folder.count}
+                                    cover={folder.cover}
                                     onClick={() => navigateToFolder(folder.name)}
                                 />
                             ))}
@@ -0,0 +1,388 @@
+"""Benchmark suite for media_server.py.
+
+Generates synthetic libraries of tiny stub media files, then drives the
+Flask test client through the server's hot paths and reports latency
+percentiles, files opened, JSON bytes parsed and serialized, and peak RSS
+as JSON.
+
+Every library size runs in a fresh child process with its own config,
+so peak RSS and startup cost are measured per size. Cold scans need an
+empty database, so each extra cold scan runs in a child of its own.
+Generated libraries are reused across runs with the same parameters.
+
+    python assets/py/benchmark.py --sizes 1000,50000 --output bench.json
+    python assets/py/benchmark.py --compare before.json after.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '../../'))
+
+# --- Synthetic library ---
+
+def _png_stub(width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    pixels = zlib.compress(b'\0\0\0\0' * 1)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', pixels) + chunk(b'IEND', b''))
+
+def _mp4_stub(seconds):
+    def box(kind, payload):
+        return struct.pack('>I4s', 8 + len(payload), kind) + payload
+    mvhd = box(b'mvhd', b'\0\0\0\0' + struct.pack('>IIII', 0, 0, 1000, int(seconds * 1000)) + b'\0' * 80)
+    return box(b'ftyp', b'isom\0\0\0\0') + box(b'moov', mvhd)
+
+def generate_library(root, files, titles, subfolders, video_ratio, seed):
+    """Writes `files` stub media files spread over titles and subfolders.
+
+    Each file gets a few random trailing bytes so contents and sizes vary
+    like a real library. Returns the number of files written.
+    """
+    rng = random.Random(seed)
+    image = _png_stub(640, 480)
+    video = _mp4_stub(12.5)
+    folders = []
+    for t in range(titles):
+        title = f"Title {t:04d}"
+        folders.append(title)
+        folders.extend(f"{title}/Set {s:02d}" for s in range(subfolders))
+    for folder in folders:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    for i in range(files):
+        folder = folders[rng.randrange(len(folders))]
+        is_video = rng.random() < video_ratio
+        name = f"clip_{i:07d}.mp4" if is_video else f"img_{i:07d}.png"
+        with open(os.path.join(root, folder, name), 'wb') as f:
+            f.write(video if is_video else image)
+            f.write(rng.randbytes(rng.randrange(16, 256)))
+    return files
+
+def prepare_workdir(workdir, size, args):
+    """Returns (config path, library root), generating the library if needed."""
+    key = f"n{size}_t{args.titles}_s{args.subfolders}_v{args.video_ratio}_seed{args.seed}"
+    base = os.path.join(workdir, key)
+    library = os.path.join(base, 'media')
+    marker = os.path.join(base, 'complete')
+    if not os.path.exists(marker):
+        shutil.rmtree(base, ignore_errors=True)
+        started = time.time()
+        generate_library(library, size, args.titles, args.subfolders, args.video_ratio, args.seed)
+        open(marker, 'w').close()
+        print(f"Generated {size} files in {time.time() - started:.1f}s: {library}", file=sys.stderr)
+
+    # A fresh database and cache for every run, so cold scans are cold
+    run_dir = os.path.join(base, 'run')
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    config = {
+        'paths': {
+            'media_folder': library,
+            'db_folder': os.path.join(run_dir, 'db'),
+            'cache_folder': os.path.join(run_dir, 'cache')
+        },
+        # Write storage synchronously, so updates are timed with their write
+        'storage': {'backend': args.backend, 'write_behind_ms': 0},
+        # Thumbnail rendering would dominate everything else and is measured separately
+        'thumbnails': {'prewarm_sizes': []},
+        'watch': {'enabled': False}
+    }
+    config_path = os.path.join(run_dir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=4)
+    return config_path, library
+
+# --- Measurement ---
+
+class Probe:
+    """Counts files opened (via an audit hook), JSON bytes parsed and
+    serialized (via the server's metrics) and process I/O (via /proc).
+
+    Set `metrics` to the server's METRICS once media_server is imported.
+    """
+
+    def __init__(self):
+        self.opened = 0
+        self.metrics = None
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        if event == 'open':
+            self.opened += 1
+
+    @staticmethod
+    def io_counters():
+        try:
+            with open('/proc/self/io') as f:
+                values = dict(line.split(': ') for line in f.read().splitlines())
+            return int(values['rchar']), int(values['wchar'])
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+    def json_counters(self):
+        if self.metrics is None:
+            return 0, 0
+        return (self.metrics.total('media_json_parsed_bytes_total'),
+                self.metrics.total('media_json_serialized_bytes_total'))
+
+    def snapshot(self):
+        return (self.opened, *self.json_counters(), *self.io_counters())
+
+    def delta(self, before):
+        opened, parsed, serialized, rchar, wchar = self.snapshot()
+        # Reading /proc/self/io opens a file itself
+        result = {'files_opened': opened - before[0] - 1,
+                  'json_bytes_parsed': parsed - before[1],
+                  'json_bytes_serialized': serialized - before[2]}
+        # Everything the process read or wrote, including media files and the page cache
+        if rchar is not None and before[3] is not None:
+            result['proc_rchar'] = rchar - before[3]
+            result['proc_wchar'] = wchar - before[4]
+        return result
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+SUMMARY_FIELDS = ('count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms')
+
+def summarize(latencies, counters):
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3) if values else None,
+        'p50_ms': round(percentile(values, 50), 3) if values else None,
+        'p90_ms': round(percentile(values, 90), 3) if values else None,
+        'p99_ms': round(percentile(values, 99), 3) if values else None,
+        'max_ms': round(values[-1], 3) if values else None,
+        **counters
+    }
+
+def measure(probe, reps, func):
+    """Calls func() reps times; returns latency stats plus I/O counters for all calls."""
+    latencies = []
+    before = probe.snapshot()
+    for _ in range(reps):
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+    counters = probe.delta(before)
+    counters = {key: value // reps for key, value in counters.items()} if reps > 1 else counters
+    return summarize(latencies, counters)
+
+# --- Scenario (runs in the child process) ---
+
+def run_scenario(config_path, reps, seed, cold_only=False):
+    """Runs every operation against the library; with cold_only, just one cold scan."""
+    probe = Probe()
+    rng = random.Random(seed)
+    os.environ['MEDIA_SERVER_CONFIG'] = config_path
+    sys.path.insert(0, SCRIPT_DIR)
+
+    started = time.perf_counter()
+    import media_server as ms
+    startup_ms = (time.perf_counter() - started) * 1000
+    probe.metrics = ms.METRICS
+    client = ms.app.test_client()
+    ops = {}
+
+    def expect(response, *codes):
+        if response.status_code not in codes:
+            raise RuntimeError(f"{response.request.path}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}")
+        return response
+
+    def scan(mode):
+        job = expect(client.post(f'/api/scan?mode={mode}'), 202).get_json()
+        while True:
+            status = client.get(f"/api/scan/{job['job_id']}").get_json()
+            if status['status'] != 'running':
+                if status['status'] != 'completed':
+                    raise RuntimeError(f"Scan failed: {status['error']}")
+                return status
+            time.sleep(0.005)
+
+    ops['scan_cold'] = measure(probe, 1, lambda: scan('full'))
+    if cold_only:
+        return {'operations': ops}
+    # The journal from the cold scan stays valid, so every warm scan is warm
+    ops['scan_warm'] = measure(probe, reps, lambda: scan('incremental'))
+    ms.STORAGE.flush()
+    items = ms.load_all_media()
+    ids = [item['id'] for item in items]
+
+    ops['load_all_media'] = measure(probe, reps, ms.load_all_media)
+    ops['api_media_full'] = measure(probe, reps, lambda: expect(client.get('/api/media'), 200))
+    etag = client.get('/api/media').headers.get('ETag')
+    ops['api_media_not_modified'] = measure(
+        probe, reps, lambda: expect(client.get('/api/media', headers={'If-None-Match': etag}), 304))
+    ops['api_media_page'] = measure(
+        probe, reps, lambda: expect(client.get('/api/media?limit=200&sort=-date&fields=id,path'), 200))
+    ops['api_search'] = measure(probe, reps, lambda: expect(client.get('/api/search?q=img&limit=50'), 200))
+
+    ops['api_update'] = measure(probe, reps, lambda: expect(
+        client.post(f'/api/update/{rng.choice(ids)}', json={'tags': [f'bench{rng.randrange(1000)}']}), 200))
+
+    batch = max(1, min(len(ids) // 100, 5000))
+    counter = iter(range(10 ** 9))
+    def rename():
+        title = f"Bench Rename {next(counter)}"
+        updates = [{'id': media_id, 'title': title} for media_id in rng.sample(ids, batch)]
+        expect(client.post('/api/batch_update', json={'updates': updates}), 200)
+    ops['api_batch_update_rename'] = measure(probe, max(1, reps // 4), rename)
+    ops['api_batch_update_rename']['batch_size'] = batch
+
+    payload = _png_stub(320, 240) + b'\0' * 4096
+    ops['api_upload'] = measure(probe, reps, lambda: expect(client.post('/api/upload', data={
+        'file': (io.BytesIO(payload), 'bench.png'), 'title': 'Bench Uploads', 'category': 'Bench'
+    }, content_type='multipart/form-data'), 201))
+
+    def chunked_upload():
+        session = expect(client.post('/api/uploads', json={
+            'filename': 'bench.png', 'size': len(payload), 'title': 'Bench Uploads'}), 201).get_json()
+        half = len(payload) // 2
+        for offset, chunk in ((0, payload[:half]), (half, payload[half:])):
+            expect(client.put(f"/api/uploads/{session['upload_id']}?offset={offset}", data=chunk), 200)
+        expect(client.post('/api/uploads/finalize', json={'upload_ids': [session['upload_id']]}), 201)
+    ops['api_chunked_upload'] = measure(probe, reps, chunked_upload)
+
+    flush_before = probe.snapshot()
+    flush_started = time.perf_counter()
+    ms.STORAGE.flush()
+    ops['storage_flush'] = summarize([(time.perf_counter() - flush_started) * 1000], probe.delta(flush_before))
+
+    return {
+        'items': len(ids),
+        'startup_ms': round(startup_ms, 3),
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'storage': ms.STORAGE.name,
+        'operations': ops
+    }
+
+# --- Driver ---
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_child(config_path, size, args, *extra):
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', config_path,
+         '--reps', str(args.reps), '--seed', str(args.seed), *extra],
+        capture_output=True, text=True)
+    if child.returncode != 0:
+        sys.stderr.write(child.stderr)
+        raise SystemExit(f"Benchmark for {size} files failed")
+    # The server prints progress on stdout; the result is the last line
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+def merge_single_runs(runs):
+    """Combines one-call measurements from several processes into one summary."""
+    counters = {}
+    for key in runs[0]:
+        if key not in SUMMARY_FIELDS:
+            counters[key] = sum(run.get(key, 0) for run in runs) // len(runs)
+    return summarize([run['max_ms'] for run in runs], counters)
+
+def run_all(args):
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), 'media_server_bench')
+    results = []
+    for size in args.sizes:
+        print(f"Running {size} files ({args.backend})...", file=sys.stderr)
+        # prepare_workdir starts every child with an empty database and journal
+        cold = []
+        for _ in range(args.scan_reps - 1):
+            config_path, library = prepare_workdir(workdir, size, args)
+            cold.append(run_child(config_path, size, args, '--cold-only')['operations']['scan_cold'])
+        config_path, library = prepare_workdir(workdir, size, args)
+        result = run_child(config_path, size, args)
+        cold.append(result['operations']['scan_cold'])
+        result['operations']['scan_cold'] = merge_single_runs(cold)
+        result['files'] = size
+        results.append(result)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': {'titles': args.titles, 'subfolders': args.subfolders, 'video_ratio': args.video_ratio,
+                       'reps': args.reps, 'scan_reps': args.scan_reps, 'seed': args.seed,
+                       'backend': args.backend}
+        },
+        'runs': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+def compare(before_path, after_path):
+    """Prints p50 latency and I/O changes between two reports."""
+    with open(before_path) as f:
+        before = {run['files']: run for run in json.load(f)['runs']}
+    with open(after_path) as f:
+        after = {run['files']: run for run in json.load(f)['runs']}
+    for files in sorted(set(before) & set(after)):
+        print(f"== {files} files: peak RSS {before[files]['peak_rss_mb']} -> {after[files]['peak_rss_mb']} MB")
+        print(f"{'operation':28} {'p50 before':>11} {'p50 after':>10} {'change':>8} {'opened':>14}")
+        for name, new in after[files]['operations'].items():
+            old = before[files]['operations'].get(name)
+            if not old:
+                continue
+            change = f"{(new['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%" if old['p50_ms'] else 'n/a'
+            opened = f"{old.get('files_opened')} -> {new.get('files_opened')}"
+            print(f"{name:28} {old['p50_ms']:>11} {new['p50_ms']:>10} {change:>8} {opened:>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000', type=lambda v: [int(s) for s in v.split(',')],
+                        help='comma-separated library sizes in files (default 1000)')
+    parser.add_argument('--titles', type=int, default=50, help='number of title folders')
+    parser.add_argument('--subfolders', type=int, default=4, help='subfolders per title')
+    parser.add_argument('--video-ratio', type=float, default=0.2, help='share of stub videos')
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json', help='storage backend')
+    parser.add_argument('--reps', type=int, default=20, help='repetitions per timed operation')
+    parser.add_argument('--scan-reps', type=int, default=3,
+                        help='cold scans per size, each in a fresh process (default 3)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for library layout and requests')
+    parser.add_argument('--workdir', help='where libraries are generated (default: system temp dir)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two reports')
+    parser.add_argument('--child', metavar='CONFIG', help=argparse.SUPPRESS)
+    parser.add_argument('--cold-only', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.child:
+        print(json.dumps(run_scenario(args.child, args.reps, args.seed, args.cold_only)))
+    else:
+        run_all(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Builds the production frontend bundle into assets/dist.
+
+Transpiles and minifies assets/js/app.jsx with esbuild, copies the
+production builds of React and ReactDOM, and compiles the Tailwind
+classes the app uses into a stylesheet. Every file is written under a
+content-hashed name, next to .gz and (when the brotli module is
+installed) .br variants, and manifest.json maps the logical names to the
+hashed files. media_server.py serves the bundle whenever the manifest
+exists (see http.asset_bundle); without it, index.html compiles app.jsx
+in the browser as before.
+
+Tools are taken from node_modules/.bin or PATH, else fetched with npx.
+React comes from node_modules/react*/umd, else from unpkg.
+
+    python assets/py/build_assets.py
+    python assets/py/build_assets.py --no-tailwind   # keep the Tailwind CDN script
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '../../'))
+ASSETS_FOLDER = os.path.join(PROJECT_ROOT, 'assets')
+DIST_FOLDER = os.path.join(ASSETS_FOLDER, 'dist')
+
+REACT_VERSION = '18.3.1'
+ESBUILD_PACKAGE = 'esbuild@0.23'
+TAILWIND_PACKAGE = 'tailwindcss@3.4'
+# Browsers that run the app: optional chaining, async/await, object spread
+JS_TARGET = 'es2019'
+
+TAILWIND_CONFIG = """module.exports = {
+    darkMode: 'class',
+    content: [%s],
+};
+"""
+
+# --- Tools ---
+
+def find_tool(name, package):
+    """Returns the command prefix that runs a node tool."""
+    local = os.path.join(PROJECT_ROOT, 'node_modules', '.bin', name)
+    if os.path.exists(local):
+        return [local]
+    if shutil.which(name):
+        return [name]
+    if shutil.which('npx'):
+        return ['npx', '--yes', package]
+    sys.exit(f"{name} not found: run 'npm install {package}' or install Node.js for npx")
+
+def run(cmd, **kwargs):
+    print('$ ' + ' '.join(cmd), file=sys.stderr)
+    subprocess.run(cmd, check=True, **kwargs)
+
+def read_react(name):
+    """Returns the production UMD build of react or react-dom."""
+    filename = f"{name}.production.min.js"
+    local = os.path.join(PROJECT_ROOT, 'node_modules', name, 'umd', filename)
+    if os.path.exists(local):
+        with open(local, 'rb') as f:
+            return f.read()
+    url = f"https://unpkg.com/{name}@{REACT_VERSION}/umd/{filename}"
+    print(f"Downloading {url}", file=sys.stderr)
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+# --- Build steps ---
+
+def build_app(workdir):
+    """Transpiles app.jsx into one minified script; React stays a global."""
+    out = os.path.join(workdir, 'app.js')
+    run(find_tool('esbuild', ESBUILD_PACKAGE) + [
+        os.path.join(ASSETS_FOLDER, 'js', 'app.jsx'),
+        '--loader:.jsx=jsx', '--jsx-factory=React.createElement', '--jsx-fragment=React.Fragment',
+        '--format=iife', f'--target={JS_TARGET}', '--minify', '--legal-comments=none', f'--outfile={out}'
+    ])
+    with open(out, 'rb') as f:
+        return f.read()
+
+def build_tailwind(workdir):
+    """Compiles only the Tailwind classes index.html and app.jsx use."""
+    content = ', '.join(json.dumps(os.path.join(PROJECT_ROOT, path))
+                        for path in ('index.html', 'assets/js/app.jsx'))
+    config = os.path.join(workdir, 'tailwind.config.js')
+    source = os.path.join(workdir, 'input.css')
+    out = os.path.join(workdir, 'tailwind.css')
+    with open(config, 'w') as f:
+        f.write(TAILWIND_CONFIG % content)
+    with open(source, 'w') as f:
+        f.write('@tailwind base;\n@tailwind components;\n@tailwind utilities;\n')
+    run(find_tool('tailwindcss', TAILWIND_PACKAGE) + ['-c', config, '-i', source, '-o', out, '--minify'])
+    with open(out, 'rb') as f:
+        return f.read()
+
+def write_hashed(logical, data):
+    """Writes data under a content-hashed name with compressed variants; returns the name."""
+    stem, ext = os.path.splitext(logical)
+    name = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+    path = os.path.join(DIST_FOLDER, name)
+    variants = {path: data, path + '.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        variants[path + '.br'] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    for variant, payload in variants.items():
+        with open(variant, 'wb') as f:
+            f.write(payload)
+    sizes = ', '.join(f"{os.path.splitext(v)[1] if v != path else 'raw'} {len(p)}" for v, p in variants.items())
+    print(f"{name}: {sizes} bytes", file=sys.stderr)
+    return name
+
+def prune(keep):
+    """Removes hashed files from earlier builds that the new manifest doesn't list."""
+    removed = 0
+    for name in os.listdir(DIST_FOLDER):
+        base = name[:-3] if name.endswith(('.gz', '.br')) else name
+        if base != 'manifest.json' and base not in keep:
+            os.remove(os.path.join(DIST_FOLDER, name))
+            removed += 1
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--no-tailwind', action='store_true',
+                        help='skip the stylesheet build; the page keeps loading the Tailwind CDN script')
+    parser.add_argument('--keep-old', action='store_true',
+                        help="keep earlier builds' files, for pages still open on the old bundle")
+    args = parser.parse_args()
+
+    started = time.time()
+    os.makedirs(DIST_FOLDER, exist_ok=True)
+    manifest = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        manifest['app.js'] = write_hashed('app.js', build_app(workdir))
+        if not args.no_tailwind:
+            manifest['tailwind.css'] = write_hashed('tailwind.css', build_tailwind(workdir))
+    for name in ('react', 'react-dom'):
+        manifest[f'{name}.js'] = write_hashed(f'{name}.js', read_react(name))
+    with open(os.path.join(ASSETS_FOLDER, 'css', 'styles.css'), 'rb') as f:
+        manifest['styles.css'] = write_hashed('styles.css', f.read())
+
+    # Replaced atomically: the server reloads it as soon as it changes
+    tmp = os.path.join(DIST_FOLDER, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, os.path.join(DIST_FOLDER, 'manifest.json'))
+    removed = 0 if args.keep_old else prune(set(manifest.values()))
+    print(f"Built {len(manifest)} assets in {time.time() - started:.1f}s"
+          + (f", removed {removed} old files" if removed else ''), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
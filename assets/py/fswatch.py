@@ -0,0 +1,208 @@
+"""Directory change detection for media_server.py's watch mode.
+
+Both watchers report which directories below a root changed, as paths
+relative to the root ('' for the root itself). InotifyWatcher uses Linux
+inotify through ctypes; PollingWatcher compares directory mtimes and works
+everywhere. A poll() result of None means events were lost and the caller
+should rescan everything.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+def _join(rel_dir, name):
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+def _subdirs(abs_dir):
+    """Lists the real (non-symlinked) subdirectories of a directory."""
+    try:
+        with os.scandir(abs_dir) as entries:
+            return [entry.name for entry in entries
+                    if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+_libc = None
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+def inotify_available():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_load_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+class InotifyWatcher:
+    """Watches every directory below root with one inotify descriptor.
+
+    Raises OSError at construction if inotify cannot watch the whole tree,
+    for example when fs.inotify.max_user_watches is too low.
+    """
+
+    name = 'inotify'
+
+    def __init__(self, root):
+        self.root = root
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}     # watch descriptor -> relative dir
+        try:
+            self._watch_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, rel_dir):
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(err, f"inotify_add_watch failed for {path}: {os.strerror(err)}")
+        self._dirs[wd] = rel_dir
+        return True
+
+    def _watch_tree(self, rel_dir):
+        """Watches a directory and everything below it; returns the dirs watched."""
+        watched = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            if not self._watch(current):
+                continue
+            watched.append(current)
+            abs_dir = os.path.join(self.root, current) if current else self.root
+            stack.extend(_join(current, name) for name in _subdirs(abs_dir))
+        return watched
+
+    @property
+    def watched_dirs(self):
+        return len(self._dirs)
+
+    def poll(self, timeout):
+        """Waits up to timeout seconds; returns the set of changed dirs, or None on overflow."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + _EVENT.size <= len(data):
+                wd, mask, _cookie, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b'\0')
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                rel_dir = self._dirs.get(wd)
+                if rel_dir is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._dirs[wd]
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    continue
+                changed.add(rel_dir)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # New directories may already hold files by the time they are watched
+                    changed.update(self._watch_tree(_join(rel_dir, os.fsdecode(name))))
+        return None if overflow else changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+class PollingWatcher:
+    """Detects changes by comparing directory mtimes on every poll.
+
+    A directory's mtime changes when entries are created, deleted or
+    renamed in it, so one stat per directory is enough; only changed
+    directories are listed to discover new subdirectories.
+    """
+
+    name = 'polling'
+
+    def __init__(self, root):
+        self.root = root
+        self._mtimes = {}   # relative dir -> mtime_ns
+        self._add_tree('')
+
+    def _stat(self, rel_dir):
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _add_tree(self, rel_dir):
+        added = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            mtime = self._stat(current)
+            if mtime is None:
+                continue
+            self._mtimes[current] = mtime
+            added.append(current)
+            abs_dir = os.path.join(self.root, current) if current else self.root
+            stack.extend(_join(current, name) for name in _subdirs(abs_dir)
+                         if _join(current, name) not in self._mtimes)
+        return added
+
+    @property
+    def watched_dirs(self):
+        return len(self._mtimes)
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        changed = set()
+        for rel_dir, mtime in list(self._mtimes.items()):
+            current = self._stat(rel_dir)
+            if current == mtime:
+                continue
+            changed.add(rel_dir)
+            if current is None:
+                del self._mtimes[rel_dir]
+                continue
+            self._mtimes[rel_dir] = current
+            changed.update(self._add_tree(rel_dir))
+        return changed
+
+    def close(self):
+        pass
@@ -0,0 +1,145 @@
+"""Cross-process coordination for running media_server.py in several worker processes.
+
+FileLock excludes other threads and other processes, using flock() on a
+lock file. GenerationLog is a small mmap'd file that every process shares:
+a generation counter that writers bump, plus a ring buffer naming the
+storage units each generation changed, so readers can tell in one memory
+read whether anything changed and then re-check only those units.
+POSIX only (fcntl); nothing happens at import time.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+class FileLock:
+    """A lock held across threads and processes.
+
+    The lock file is opened on every acquire and closed on release, so no
+    descriptor outlives the hold (or leaks into a forked child) and any
+    number of lock files can be used without running out of descriptors.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BaseException:
+                os.close(fd)
+                raise
+        except BlockingIOError:
+            self._lock.release()
+            return False
+        except BaseException:
+            self._lock.release()
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        os.close(fd)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class GenerationLog:
+    """Shared generation counter with the names of recently changed units.
+
+    Layout: an 8-byte magic and the 8-byte generation, then `slots` entries
+    of ENTRY_SIZE bytes (the entry's generation, name length and UTF-8
+    name). Generation n is stored in slot n % slots. Writers hold an
+    exclusive flock on the file; readers take a shared one only when the
+    generation has moved.
+    """
+
+    MAGIC = b'MSGEN001'
+    HEADER = struct.Struct('<8sQ')
+    ENTRY = struct.Struct('<QH')
+    ENTRY_SIZE = 256
+    MAX_NAME = ENTRY_SIZE - ENTRY.size
+    # Stored instead of a name too long for its slot
+    TOO_LONG = 0xFFFF
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        self._size = self.HEADER.size + slots * self.ENTRY_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != self._size:
+                # New file, or one laid out for a different slot count: start over
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._size)
+            self._map = mmap.mmap(self._fd, self._size)
+            if self._map[:8] != self.MAGIC:
+                self.HEADER.pack_into(self._map, 0, self.MAGIC, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def current(self):
+        return self.HEADER.unpack_from(self._map, 0)[1]
+
+    def publish(self, units):
+        """Records one generation per changed unit; returns the new generation."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            generation = self.current()
+            for unit in units:
+                generation += 1
+                name = unit.encode('utf-8')
+                offset = self.HEADER.size + (generation % self.slots) * self.ENTRY_SIZE
+                if len(name) > self.MAX_NAME:
+                    self.ENTRY.pack_into(self._map, offset, generation, self.TOO_LONG)
+                else:
+                    self.ENTRY.pack_into(self._map, offset, generation, len(name))
+                    self._map[offset + self.ENTRY.size:offset + self.ENTRY.size + len(name)] = name
+            # Entries first, so readers never see a generation without its entry
+            self.HEADER.pack_into(self._map, 0, self.MAGIC, generation)
+            return generation
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def changes_since(self, since):
+        """Returns (generation, units changed after `since`).
+
+        units is None when they can't be named: `since` is None, the ring
+        has wrapped past it, or a name didn't fit its slot. The caller
+        should then check every unit.
+        """
+        generation = self.current()
+        if since is not None and generation == since:
+            return generation, set()
+        if since is None or generation < since or generation - since > self.slots:
+            return generation, None
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            generation = self.current()
+            if generation - since > self.slots:
+                return generation, None
+            units = set()
+            for expected in range(since + 1, generation + 1):
+                offset = self.HEADER.size + (expected % self.slots) * self.ENTRY_SIZE
+                entry_generation, length = self.ENTRY.unpack_from(self._map, offset)
+                if entry_generation != expected or length == self.TOO_LONG:
+                    return generation, None
+                start = offset + self.ENTRY.size
+                units.add(self._map[start:start + length].decode('utf-8'))
+            return generation, units
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
@@ -1,17 +1,49 @@
 import os
+import re
+import atexit
 import json
 import uuid
+import base64
+import bisect
 import shutil
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+import sys
+import time
+import argparse
+import hashlib
+import zlib
+import mimetypes
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import quote
+from flask import (Flask, Response, abort, g, request, jsonify, make_response, redirect, send_file,
+                   render_template_string)
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
+import thumbnails
+import mediainfo
+import fswatch
+import ndjson_stream
+try:
+    import interprocess
+except ImportError:     # fcntl is POSIX only
+    interprocess = None
+
 app = Flask(__name__)
+# Startup phases are timed from here, see StartupState
+IMPORT_STARTED = time.perf_counter()
 
 # --- Configuration ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '../../'))
 ASSETS_FOLDER = os.path.join(PROJECT_ROOT, 'assets')
-CONFIG_FILE = os.path.join(PROJECT_ROOT, 'config.json')
+# MEDIA_SERVER_CONFIG points at another config file, e.g. for benchmarks
+CONFIG_FILE = os.environ.get('MEDIA_SERVER_CONFIG') or os.path.join(PROJECT_ROOT, 'config.json')
 
 # Load configuration from config.json
 def load_config():
@@ -20,18 +52,65 @@ def load_config():
         "server": {
             "host": "127.0.0.1",
             "port": 5000,
-            "debug": True
+            "debug": False
         },
         "paths": {
             "media_folder": "/path/to/your/media/folder",
-            "db_folder": "assets/db"
+            "db_folder": "assets/db",
+            "cache_folder": "assets/cache"
+        },
+        "storage": {
+            "backend": "json",
+            "sqlite_file": "media.sqlite3",
+            "write_behind_ms": 200
         },
         "supported_formats": {
             "images": [".jpg", ".jpeg", ".png", ".gif", ".webp"],
             "videos": [".mp4", ".mov", ".avi", ".webm", ".mkv"]
         },
         "upload": {
-            "max_file_size_mb": 500
+            "max_file_size_mb": 500,
+            "chunk_size_mb": 8,
+            "session_ttl_hours": 24
+        },
+        "scan": {
+            "incremental": True,
+            "missing_action": "flag",
+            "workers": 8
+        },
+        "http": {
+            "media_max_age": 86400,
+            "assets_max_age": 0,
+            "sendfile": "off",
+            "accel_media_prefix": "/protected_media",
+            "accel_assets_prefix": "/protected_assets",
+            "asset_bundle": "auto"
+        },
+        "hashing": {
+            "enabled": True,
+            "workers": 4,
+            "partial_kb": 64
+        },
+        "metadata": {
+            "enabled": True,
+            "workers": 4
+        },
+        "metrics": {
+            "slow_request_ms": 1000
+        },
+        "watch": {
+            "enabled": False,
+            "backend": "auto",
+            "debounce_ms": 1000,
+            "max_delay_ms": 10000,
+            "poll_interval_s": 2.0
+        },
+        "thumbnails": {
+            "sizes": [256, 640],
+            "prewarm_sizes": [256],
+            "max_cache_mb": 1024,
+            "workers": 2,
+            "quality": 80
         },
         "branding": {
             "site_name": "MediaServer",
@@ -43,6 +122,14 @@ def load_config():
         "appearance": {
             "default_theme": "system"
         },
+        "startup": {
+            "snapshot": True,
+            "workers": 4
+        },
+        "transfer": {
+            "import_batch_size": 1000,
+            "max_import_size_mb": 4096
+        },
         "integrity": {
             "auto_fix_title_creator": False
         }
@@ -82,7 +169,23 @@ if not os.path.isabs(db_folder_path):
 else:
     DB_FOLDER = db_folder_path
 
+cache_folder_path = CONFIG['paths']['cache_folder']
+if not os.path.isabs(cache_folder_path):
+    CACHE_FOLDER = os.path.join(PROJECT_ROOT, cache_folder_path)
+else:
+    CACHE_FOLDER = cache_folder_path
+
+# Set by wsgi.py: several worker processes share the database, so title
+# writes are locked across processes and changes are published to the others
+MULTIPROCESS = os.environ.get('MEDIA_SERVER_MULTIPROCESS') == '1'
+if MULTIPROCESS and interprocess is None:
+    print("Multi-process mode needs fcntl, which this platform lacks. Running single-process.")
+    MULTIPROCESS = False
+LOCK_FOLDER = os.path.join(CACHE_FOLDER, 'locks')
+GENERATION_FILE = os.path.join(CACHE_FOLDER, 'generation')
+
 LEGACY_DATA_FILE = os.path.join(PROJECT_ROOT, 'media_db.json')
+SCAN_JOURNAL_FILE = os.path.join(CACHE_FOLDER, 'scan_journal.json')
 INDEX_FILE = os.path.join(PROJECT_ROOT, 'index.html')
 MEDIA_FOLDER = CONFIG['paths']['media_folder']
 
@@ -90,6 +193,17 @@ MEDIA_FOLDER = CONFIG['paths']['media_folder']
 IMG_EXTS = set(CONFIG['supported_formats']['images'])
 VID_EXTS = set(CONFIG['supported_formats']['videos'])
 
+# Not every platform's mimetypes registry knows these, and browsers
+# won't stream a video served as application/octet-stream
+for _ext, _type in (('.mkv', 'video/x-matroska'), ('.webm', 'video/webm'), ('.mov', 'video/quicktime'),
+                    ('.mp4', 'video/mp4'), ('.webp', 'image/webp')):
+    mimetypes.add_type(_type, _ext)
+
+HTTP_CONFIG = CONFIG.get('http', {})
+SENDFILE_MODE = HTTP_CONFIG.get('sendfile', 'off')
+# Flask's own X-Sendfile support: send_file() sends the header instead of the body
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
+
 # --- Common Helpers ---
 
 def get_item_title(item):
@@ -103,11 +217,258 @@ def set_item_title(item, title):
     item['title'] = title
     item['creator'] = title
 
+def atomic_write_json(path, data, **dump_kwargs):
+    """Writes JSON to a temp file and renames it over path.
+
+    Readers see either the old or the new file, never a truncated one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def get_item_real_path(item):
+    """Returns the filesystem path of an item's media file, or None."""
+    if item.get('real_path'):
+        return item['real_path']
+    path = item.get('path') or ''
+    if not path.startswith('/media_content/'):
+        return None
+    return safe_join(MEDIA_FOLDER, path[len('/media_content/'):])
+
+def natural_key(text):
+    """Case-insensitive sort key that orders embedded numbers numerically."""
+    return tuple((0, int(part), '') if part.isdigit() else (1, 0, part)
+                 for part in re.split(r'(\d+)', (text or '').lower()) if part)
+
+def get_item_folder(item):
+    """Returns the item's folder below /media_content/, e.g. 'Title/sub'."""
+    path = item.get('path') or ''
+    if path.startswith('/media_content/'):
+        path = path[len('/media_content/'):]
+    return path.rpartition('/')[0]
+
+def get_item_date(item):
+    """Returns the capture date, or the file's modification date, as ISO text."""
+    return item.get('taken_at') or item.get('modified')
+
+def get_item_resolution(item):
+    if item.get('width') and item.get('height'):
+        return item['width'] * item['height']
+    return None
+
+def _known_first(value, missing):
+    """Sort key part that puts items without a value after all others."""
+    return (1, missing) if value is None else (0, value)
+
+# Sort keys accepted by /api/media?sort=; prefix with '-' for descending
+SORT_KEYS = {
+    'name': lambda item: natural_key(item.get('original_name') or item.get('filename')),
+    'title': lambda item: natural_key(get_item_title(item)),
+    'category': lambda item: natural_key(item.get('category')),
+    'path': lambda item: item.get('path') or '',
+    'date': lambda item: _known_first(get_item_date(item), ''),
+    'size': lambda item: _known_first(item.get('file_size'), 0),
+    'duration': lambda item: _known_first(item.get('duration'), 0),
+    'resolution': lambda item: _known_first(get_item_resolution(item), 0),
+}
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_natural_key(key):
+    return isinstance(key, tuple) and all(
+        isinstance(part, tuple) and len(part) == 3 and part[0] in (0, 1)
+        and _is_number(part[1]) and isinstance(part[2], str) for part in key)
+
+def _is_known_first(check):
+    return lambda key: isinstance(key, tuple) and len(key) == 2 and key[0] in (0, 1) and check(key[1])
+
+# What a decoded /api/media cursor must look like to compare against each sort key
+CURSOR_SHAPES = {
+    'name': _is_natural_key,
+    'title': _is_natural_key,
+    'category': _is_natural_key,
+    'path': lambda key: isinstance(key, str),
+    'date': _is_known_first(lambda value: isinstance(value, str)),
+    'size': _is_known_first(_is_number),
+    'duration': _is_known_first(_is_number),
+    'resolution': _is_known_first(_is_number),
+}
+
+# --- Metrics ---
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Metrics:
+    """Process-wide counters, gauges and histograms in the Prometheus text format.
+
+    Storage and serialization also add their time to a per-request
+    breakdown, which the slow-request log reports.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}        # name -> (type, help)
+        self._values = {}       # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts, sum, count]
+        self._local = threading.local()
+
+    def describe(self, name, kind, text):
+        self._kinds[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def total(self, name):
+        """Returns a counter summed over all its labels."""
+        with self._lock:
+            return sum(value for (key, _), value in self._values.items() if key == name)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def begin_request(self):
+        self._local.breakdown = Counter()
+
+    def end_request(self):
+        breakdown = getattr(self._local, 'breakdown', None)
+        self._local.breakdown = None
+        return breakdown or Counter()
+
+    def spent(self, category, seconds):
+        """Adds time to the current request's breakdown, if there is one."""
+        breakdown = getattr(self._local, 'breakdown', None)
+        if breakdown is not None:
+            breakdown[category] += seconds
+
+    def db_read(self, backend, units, seconds, parsed_bytes):
+        self.inc('media_db_units_read_total', units, backend=backend)
+        self.inc('media_db_read_seconds_total', seconds, backend=backend)
+        self.inc('media_json_parsed_bytes_total', parsed_bytes, source='db')
+        self.spent('db_read', seconds)
+
+    def db_write(self, backend, units, seconds, serialized_bytes):
+        self.inc('media_db_units_written_total', units, backend=backend)
+        self.inc('media_db_write_seconds_total', seconds, backend=backend)
+        self.inc('media_json_serialized_bytes_total', serialized_bytes, target='db')
+        self.spent('db_write', seconds)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), histogram in histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, text = self._kinds.get(name, ('untyped', ''))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name], key=lambda entry: entry[0]):
+                if kind != 'histogram':
+                    lines.append(f"{name}{self._labels(labels)} {value:g}" if isinstance(value, float)
+                                 else f"{name}{self._labels(labels)} {value}")
+                    continue
+                buckets, total, count = value
+                for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', f'{bound:g}')])} {bucket_count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total:g}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+for _name, _kind, _text in (
+    ('media_http_requests_total', 'counter', 'Requests by route, method and status.'),
+    ('media_http_request_duration_seconds', 'histogram', 'Request latency by route.'),
+    ('media_http_slow_requests_total', 'counter', 'Requests slower than metrics.slow_request_ms.'),
+    ('media_db_units_read_total', 'counter', 'Storage units read (title files for JSON, titles for SQLite).'),
+    ('media_db_units_written_total', 'counter', 'Storage units written.'),
+    ('media_db_read_seconds_total', 'counter', 'Time spent reading and parsing storage units.'),
+    ('media_db_write_seconds_total', 'counter', 'Time spent serializing and writing storage units.'),
+    ('media_json_parsed_bytes_total', 'counter', 'JSON bytes parsed.'),
+    ('media_json_serialized_bytes_total', 'counter', 'JSON bytes serialized, for storage or responses.'),
+    ('media_scan_duration_seconds', 'histogram', 'Library scan duration by mode.'),
+    ('media_scan_items_added_total', 'counter', 'Items added by scans.'),
+    ('media_scan_last_files_per_second', 'gauge', 'Files found per second by the last scan.'),
+    ('media_catalog_items', 'gauge', 'Items in the catalog.'),
+    ('media_catalog_revision', 'gauge', 'Current catalog revision.'),
+    ('media_watch_queue_depth', 'gauge', 'Changed folders waiting for the watcher.'),
+    ('media_watch_lag_seconds', 'gauge', 'Age of the oldest change the watcher has not applied.'),
+    ('media_uploads_active', 'gauge', 'Unfinished resumable uploads.'),
+    ('media_thumbnail_cache_bytes', 'gauge', 'Bytes in the thumbnail cache.'),
+    ('media_ready', 'gauge', '1 once the catalog is loaded and the server is ready.'),
+    ('media_startup_phase_seconds', 'gauge', 'Time spent in each startup phase.'),
+):
+    METRICS.describe(_name, _kind, _text)
+
+class InstrumentedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, counting and timing request parsing and response serialization."""
+
+    def loads(self, s, **kwargs):
+        started = time.perf_counter()
+        obj = super().loads(s, **kwargs)
+        METRICS.inc('media_json_parsed_bytes_total', len(s), source='request')
+        METRICS.spent('parse', time.perf_counter() - started)
+        return obj
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        text = super().dumps(obj, **kwargs)
+        elapsed = time.perf_counter() - started
+        METRICS.inc('media_json_serialized_bytes_total', len(text), target='response')
+        METRICS.spent('serialize', elapsed)
+        return text
+
+app.json = InstrumentedJSONProvider(app)
+SLOW_REQUEST_SECONDS = CONFIG.get('metrics', {}).get('slow_request_ms', 1000) / 1000
+
 # --- Initialization & Migration ---
 
 def ensure_directories():
     if not os.path.exists(DB_FOLDER):
         os.makedirs(DB_FOLDER)
+    if not os.path.exists(CACHE_FOLDER):
+        os.makedirs(CACHE_FOLDER)
     if not os.path.exists(MEDIA_FOLDER):
         try:
             os.makedirs(MEDIA_FOLDER)
@@ -140,10 +501,7 @@ def migrate_legacy_db():
 
             # Write individual files
             for title, items in grouped_data.items():
-                safe_name = secure_filename(title) or 'Uncategorized'
-                file_path = os.path.join(DB_FOLDER, f"{safe_name}.json")
-                with open(file_path, 'w') as f:
-                    json.dump(items, f, indent=4)
+                STORAGE.commit({STORAGE.unit_for_title(title): (items, items, [])})
             
             print(f"Migration complete. Split into {len(grouped_data)} files.")
             
@@ -161,409 +519,4341 @@ def get_title_filename(title):
     safe_name = secure_filename(title) or 'Uncategorized'
     return os.path.join(DB_FOLDER, f"{safe_name}.json")
 
-def load_all_media():
-    """Aggregates all JSON files in the DB_FOLDER into one list."""
-    all_media = []
-    if not os.path.exists(DB_FOLDER):
-        return []
-    
-    for filename in os.listdir(DB_FOLDER):
-        if filename.endswith('.json'):
+class MediaStorage:
+    """Interface between the catalog and the on-disk media database.
+
+    Items are stored in units (a title file, or a title in SQLite). Every
+    backend reports a cheap signature per unit so the catalog can tell which
+    units changed, and applies writes through commit(). The higher level
+    operations below are built on those primitives; backends override them
+    where they can answer directly.
+    """
+
+    name = None
+
+    def unit_for_title(self, title):
+        raise NotImplementedError
+
+    def signatures(self):
+        """Returns {unit: signature}; a signature changes whenever the unit does."""
+        raise NotImplementedError
+
+    def unit_signatures(self, units):
+        """Returns {unit: signature or None} for just the given units."""
+        sigs = self.signatures()
+        return {unit: sigs.get(unit) for unit in units}
+
+    def load_unit(self, unit):
+        raise NotImplementedError
+
+    def commit(self, changes):
+        """Applies {unit: (items, changed, removed_ids)} and returns {unit: signature}.
+
+        items is the unit's complete new item list, changed the items that
+        were added or modified and removed_ids the ids that left the unit.
+        A signature of None means the unit no longer exists.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Writes any buffered changes to disk."""
+        return 0
+
+    def identity(self):
+        """Names the database, so a snapshot of one is never applied to another."""
+        raise NotImplementedError
+
+    def durable_signatures(self):
+        """Returns {unit: (signature, durable signature, checksum)} for units fully on disk.
+
+        The durable signature is what signatures() reports for the unit in a
+        fresh process. checksum is set when the signature alone can't be
+        trusted to change with the contents; see unit_checksum().
+        """
+        return {unit: (sig, sig, None) for unit, sig in self.signatures().items()}
+
+    def unit_checksum(self, unit):
+        return None
+
+    def stats(self):
+        return {}
+
+    def load_all(self):
+        return [item for unit in sorted(self.signatures()) for item in self.load_unit(unit)]
+
+    def get(self, media_id):
+        return next((item for item in self.load_all() if item.get('id') == media_id), None)
+
+    def upsert(self, items):
+        """Inserts or replaces items by id in the unit of their current title."""
+        by_unit = {}
+        for item in items:
+            by_unit.setdefault(self.unit_for_title(get_item_title(item)), []).append(item)
+        changes = {}
+        for unit, unit_changes in by_unit.items():
+            current = self.load_unit(unit)
+            positions = {item.get('id'): i for i, item in enumerate(current)}
+            for item in unit_changes:
+                if item.get('id') in positions:
+                    current[positions[item['id']]] = item
+                else:
+                    current.append(item)
+            changes[unit] = (current, unit_changes, [])
+        return self.commit(changes)
+
+    def move(self, media_ids, new_title):
+        """Moves items to another title, keeping every other field."""
+        wanted = set(media_ids)
+        changes = {}
+        moved = []
+        for unit in self.signatures():
+            current = self.load_unit(unit)
+            keep = [item for item in current if item.get('id') not in wanted]
+            if len(keep) != len(current):
+                removed = [item for item in current if item.get('id') in wanted]
+                changes[unit] = (keep, [], [item['id'] for item in removed])
+                moved.extend(removed)
+        target = self.unit_for_title(new_title)
+        items, changed, removed_ids = changes.get(target) or (self.load_unit(target), [], [])
+        for item in moved:
+            set_item_title(item, new_title)
+            items.append(item)
+            changed.append(item)
+        changes[target] = (items, changed, removed_ids)
+        return self.commit(changes)
+
+    def titles(self):
+        return sorted({get_item_title(item) for item in self.load_all()})
+
+    def categories(self):
+        return sorted({item['category'] for item in self.load_all() if item.get('category')})
+
+class JsonTitleStorage(MediaStorage):
+    """One JSON array per title in DB_FOLDER, as written by earlier versions.
+
+    Files are replaced atomically (temp file + rename) and written compact.
+    With a write-behind window, commits only queue the new contents and a
+    flusher thread writes each unit once per window, so a burst of edits
+    to one title costs a single write. Units with queued or self-written
+    contents report a stable token as their signature, so the catalog does
+    not re-read what it just wrote.
+    """
+
+    name = 'json'
+
+    # Files modified this recently could be rewritten within the same mtime
+    # tick at the same size, so durable_signatures() adds a checksum
+    RACY_SECONDS = 2
+
+    def __init__(self, db_folder, write_behind_ms=0):
+        self.db_folder = db_folder
+        self.write_behind = max(write_behind_ms, 0) / 1000.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}      # unit -> (items, token, queued_at)
+        self._written = {}      # unit -> (disk signature, token)
+        self._seq = 0
+        self._flusher = None
+        self._stats = {'commits': 0, 'unit_commits': 0, 'writes': 0, 'coalesced': 0,
+                       'bytes_written': 0, 'pending': 0}
+
+    def unit_for_title(self, title):
+        return os.path.basename(get_title_filename(title))
+
+    def _disk_signatures(self):
+        sigs = {}
+        try:
+            names = [n for n in os.listdir(self.db_folder) if n.endswith('.json')]
+        except FileNotFoundError:
+            return sigs
+        for filename in names:
             try:
-                with open(os.path.join(DB_FOLDER, filename), 'r') as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        all_media.extend(data)
-            except Exception as e:
-                print(f"Error reading {filename}: {e}")
-    return all_media
+                st = os.stat(os.path.join(self.db_folder, filename))
+            except OSError:
+                continue
+            sigs[filename] = (st.st_mtime_ns, st.st_size)
+        return sigs
 
-def save_title_data(title, data):
-    """Saves a list of media items to a specific title's file."""
-    filepath = get_title_filename(title)
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=4)
+    def _live_signatures(self, sigs, units=None):
+        """Replaces disk signatures of self-written and queued units with their tokens."""
+        with self._cond:
+            for unit, (disk_sig, token) in self._written.items():
+                if sigs.get(unit) == disk_sig:
+                    sigs[unit] = token
+            for unit, (_items, token, _queued) in self._pending.items():
+                if units is None or unit in units:
+                    sigs[unit] = token
+        return sigs
 
-def integrity_check_title_creator(auto_fix=False):
-    """Scan DB for missing/mismatched title/creator and optionally fix."""
-    if not os.path.exists(DB_FOLDER):
-        print("Integrity check skipped: DB folder does not exist.")
-        return
+    def signatures(self):
+        return self._live_signatures(self._disk_signatures())
 
-    files_scanned = 0
-    files_modified = 0
-    items_scanned = 0
-    items_fixed = 0
+    def unit_signatures(self, units):
+        sigs = {}
+        for unit in units:
+            try:
+                st = os.stat(os.path.join(self.db_folder, unit))
+                sigs[unit] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                sigs[unit] = None
+        return self._live_signatures(sigs, units)
 
-    for filename in os.listdir(DB_FOLDER):
-        if not filename.endswith('.json'):
-            continue
-        filepath = os.path.join(DB_FOLDER, filename)
+    def identity(self):
+        return f"json:{os.path.abspath(self.db_folder)}"
+
+    def durable_signatures(self):
+        disk = self._disk_signatures()
+        with self._cond:
+            pending = set(self._pending)
+            written = dict(self._written)
+        racy_ns = (time.time() - self.RACY_SECONDS) * 1e9
+        sigs = {}
+        for unit, disk_sig in disk.items():
+            if unit in pending:
+                continue
+            token = written.get(unit)
+            live = token[1] if token and token[0] == disk_sig else disk_sig
+            checksum = None
+            if disk_sig[0] > racy_ns:
+                checksum = self.unit_checksum(unit)
+                try:
+                    st = os.stat(os.path.join(self.db_folder, unit))
+                except OSError:
+                    continue
+                # Replaced while we read it: leave it to the next snapshot
+                if (st.st_mtime_ns, st.st_size) != disk_sig:
+                    continue
+            sigs[unit] = (live, disk_sig, checksum)
+        return sigs
+
+    def unit_checksum(self, unit):
+        try:
+            with open(os.path.join(self.db_folder, unit), 'rb') as f:
+                return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        except OSError:
+            return None
+
+    def load_unit(self, unit):
+        with self._cond:
+            if unit in self._pending:
+                return list(self._pending[unit][0])
+        filepath = os.path.join(self.db_folder, unit)
+        if not os.path.exists(filepath):
+            return []
+        started = time.perf_counter()
         try:
             with open(filepath, 'r') as f:
-                items = json.load(f)
-            if not isinstance(items, list):
-                continue
+                raw = f.read()
+            data = json.loads(raw)
         except Exception as e:
-            print(f"Integrity check error in {filename}: {e}")
-            continue
+            print(f"Error reading {unit}: {e}")
+            return []
+        METRICS.db_read(self.name, 1, time.perf_counter() - started, len(raw))
+        return [item for item in data if isinstance(item, dict)] if isinstance(data, list) else []
 
-        files_scanned += 1
-        changed = False
+    def _write_unit(self, unit, items, token):
+        filepath = os.path.join(self.db_folder, unit)
+        started = time.perf_counter()
+        atomic_write_json(filepath, items, separators=(',', ':'))
+        st = os.stat(filepath)
+        METRICS.db_write(self.name, 1, time.perf_counter() - started, st.st_size)
+        with self._cond:
+            self._written[unit] = ((st.st_mtime_ns, st.st_size), token)
+            if unit in self._pending and self._pending[unit][1] == token:
+                del self._pending[unit]
+            self._stats['writes'] += 1
+            self._stats['bytes_written'] += st.st_size
+
+    def commit(self, changes):
+        sigs = {}
+        with self._cond:
+            self._stats['commits'] += 1
+            for unit, (items, _changed, _removed) in changes.items():
+                self._seq += 1
+                token = ('rev', self._seq)
+                if unit in self._pending:
+                    self._stats['coalesced'] += 1
+                    queued_at = self._pending[unit][2]
+                else:
+                    queued_at = time.time()
+                self._pending[unit] = (list(items), token, queued_at)
+                self._stats['unit_commits'] += 1
+                sigs[unit] = token
+            if self.write_behind:
+                self._start_flusher()
+                self._cond.notify_all()
+        if not self.write_behind:
+            self.flush()
+        return sigs
+
+    def _start_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name='json-write-behind', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                oldest = min(queued for _items, _token, queued in self._pending.values())
+                delay = oldest + self.write_behind - time.time()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+            try:
+                self.flush(due_only=True)
+            except Exception:
+                time.sleep(1)
+
+    def flush(self, due_only=False):
+        """Writes queued units to disk. Returns the number of files written.
+
+        Units stay queued until their file is replaced, so readers never fall
+        back to the old file while a write is in flight.
+        """
+        with self._flush_lock:
+            with self._cond:
+                now = time.time()
+                due = {unit: entry for unit, entry in self._pending.items()
+                       if not due_only or entry[2] + self.write_behind <= now}
+            for unit, (items, token, _queued) in due.items():
+                try:
+                    self._write_unit(unit, items, token)
+                except Exception as e:
+                    print(f"Error writing {unit}: {e}")
+                    raise
+            return len(due)
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, pending=len(self._pending), write_behind_ms=self.write_behind * 1000)
+
+class SqliteStorage(MediaStorage):
+    """Items as rows in a SQLite database in WAL mode.
+
+    Each row keeps the full item as JSON next to indexed id, title,
+    category and path columns, with tags in a side table. Edits touch only
+    the changed rows. Every title carries a version that is bumped on
+    write and serves as the unit signature.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS media (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            category TEXT,
+            path TEXT,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS media_title ON media(title, position);
+        CREATE INDEX IF NOT EXISTS media_category ON media(category);
+        CREATE INDEX IF NOT EXISTS media_path ON media(path);
+        CREATE TABLE IF NOT EXISTS media_tags (
+            tag TEXT NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (tag, id)
+        );
+        CREATE INDEX IF NOT EXISTS media_tags_id ON media_tags(id);
+        CREATE TABLE IF NOT EXISTS titles (
+            title TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._stats = {'commits': 0, 'rows_written': 0, 'rows_deleted': 0}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+        # Title versions restart at 1 in a new database, so tell databases apart
+        if not self.get_meta('instance'):
+            self.set_meta('instance', uuid.uuid4().hex)
+
+    def unit_for_title(self, title):
+        return title or 'Uncategorized'
+
+    def identity(self):
+        return f"sqlite:{os.path.abspath(self.db_path)}:{self.get_meta('instance')}"
 
+    def signatures(self):
+        with self._lock:
+            return dict(self._conn.execute('SELECT title, version FROM titles'))
+
+    def unit_signatures(self, units):
+        units = list(units)
+        sigs = dict.fromkeys(units)
+        with self._lock:
+            for start in range(0, len(units), 500):
+                batch = units[start:start + 500]
+                sigs.update(self._conn.execute(
+                    f"SELECT title, version FROM titles WHERE title IN ({','.join('?' * len(batch))})", batch))
+        return sigs
+
+    def load_unit(self, unit):
+        started = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM media WHERE title = ? ORDER BY position', (unit,)).fetchall()
+        items = [json.loads(data) for (data,) in rows]
+        METRICS.db_read(self.name, 1, time.perf_counter() - started, sum(len(data) for (data,) in rows))
+        return items
+
+    def _titles_of(self, media_ids):
+        """Returns the titles currently holding any of media_ids."""
+        media_ids = list(media_ids)
+        titles = set()
+        # Batched to stay under SQLite's limit on bound parameters
+        for start in range(0, len(media_ids), 500):
+            batch = media_ids[start:start + 500]
+            titles.update(t for (t,) in self._conn.execute(
+                f"SELECT DISTINCT title FROM media WHERE id IN ({','.join('?' * len(batch))})", batch))
+        return titles
+
+    def _delete_rows(self, media_ids):
+        self._stats['rows_deleted'] += len(media_ids)
+        for media_id in media_ids:
+            self._conn.execute('DELETE FROM media WHERE id = ?', (media_id,))
+            self._conn.execute('DELETE FROM media_tags WHERE id = ?', (media_id,))
+
+    def _write_rows(self, items):
+        """Inserts or updates rows; new rows go to the end of their title.
+
+        Returns the number of JSON bytes written.
+        """
+        next_position = {}
+        written = 0
+        self._stats['rows_written'] += len(items)
         for item in items:
-            if not isinstance(item, dict):
+            if not item.get('id'):
+                item['id'] = str(uuid.uuid4())
+            title = self.unit_for_title(get_item_title(item))
+            row = self._conn.execute('SELECT title FROM media WHERE id = ?', (item['id'],)).fetchone()
+            if row and row[0] != title:
+                # Title changed: re-insert at the end of the new title
+                self._delete_rows([item['id']])
+            if title not in next_position:
+                (top,) = self._conn.execute(
+                    'SELECT COALESCE(MAX(position), -1) FROM media WHERE title = ?', (title,)).fetchone()
+                next_position[title] = top + 1
+            data = json.dumps(item)
+            written += len(data)
+            self._conn.execute(
+                """INSERT INTO media (id, title, category, path, position, data) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET title = excluded.title, category = excluded.category,
+                   path = excluded.path, data = excluded.data""",
+                (item['id'], title, item.get('category'), item.get('path'), next_position[title], data))
+            next_position[title] += 1
+            self._conn.execute('DELETE FROM media_tags WHERE id = ?', (item['id'],))
+            self._conn.executemany('INSERT OR IGNORE INTO media_tags (tag, id) VALUES (?, ?)',
+                                   [(tag, item['id']) for tag in (item.get('tags') or []) if isinstance(tag, str)])
+        return written
+
+    def _bump_titles(self, titles):
+        sigs = {}
+        for title in titles:
+            (count,) = self._conn.execute('SELECT COUNT(*) FROM media WHERE title = ?', (title,)).fetchone()
+            if count == 0:
+                self._conn.execute('DELETE FROM titles WHERE title = ?', (title,))
+                sigs[title] = None
                 continue
-            items_scanned += 1
+            self._conn.execute(
+                """INSERT INTO titles (title, version) VALUES (?, 1)
+                   ON CONFLICT(title) DO UPDATE SET version = version + 1""", (title,))
+            (sigs[title],) = self._conn.execute('SELECT version FROM titles WHERE title = ?', (title,)).fetchone()
+        return sigs
 
-            title = item.get('title')
-            creator = item.get('creator')
+    def commit(self, changes):
+        started = time.perf_counter()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Deletes first, so an item moving between titles is re-inserted
+                # at the end of its new title rather than updated in place.
+                for _items, _changed, removed_ids in changes.values():
+                    self._delete_rows(removed_ids)
+                written = sum(self._write_rows(changed) for _items, changed, _removed in changes.values())
+                sigs = self._bump_titles(changes)
+                self._conn.execute('COMMIT')
+                self._stats['commits'] += 1
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        METRICS.db_write(self.name, len(changes), time.perf_counter() - started, written)
+        return sigs
 
-            # Determine canonical title using the shared helper
-            canonical = get_item_title(item)
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM media ORDER BY title, position')
+            return [json.loads(data) for (data,) in rows]
 
-            if title != canonical or creator != canonical:
-                if auto_fix:
-                    set_item_title(item, canonical)
-                    items_fixed += 1
-                    changed = True
-                else:
-                    print(f"Integrity warning in {filename}: id={item.get('id')} title={title} creator={creator}")
+    def get(self, media_id):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM media WHERE id = ?', (media_id,)).fetchone()
+        return json.loads(row[0]) if row else None
 
-        if changed:
-            with open(filepath, 'w') as f:
-                json.dump(items, f, indent=4)
-            files_modified += 1
+    def upsert(self, items):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                old_titles = self._titles_of(item['id'] for item in items if item.get('id'))
+                self._write_rows(items)
+                touched = old_titles | {self.unit_for_title(get_item_title(item)) for item in items}
+                sigs = self._bump_titles(touched)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return sigs
 
-    print("Integrity check summary:")
-    print(f"  files_scanned={files_scanned}")
-    print(f"  files_modified={files_modified}")
-    print(f"  items_scanned={items_scanned}")
-    print(f"  items_fixed={items_fixed}")
+    def move(self, media_ids, new_title):
+        items = [item for item in (self.get(media_id) for media_id in media_ids) if item]
+        for item in items:
+            set_item_title(item, new_title)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                old_titles = self._titles_of(item['id'] for item in items)
+                self._delete_rows([item['id'] for item in items])
+                self._write_rows(items)
+                sigs = self._bump_titles(old_titles | {self.unit_for_title(new_title)})
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return sigs
 
-# Run setup
-ensure_directories()
-migrate_legacy_db()
-integrity_check_title_creator(CONFIG.get('integrity', {}).get('auto_fix_title_creator', False))
+    def titles(self):
+        with self._lock:
+            return [t for (t,) in self._conn.execute('SELECT title FROM titles ORDER BY title')]
 
-# --- Routes ---
+    def categories(self):
+        with self._lock:
+            return [c for (c,) in self._conn.execute(
+                "SELECT DISTINCT category FROM media WHERE category IS NOT NULL AND category != '' ORDER BY category")]
 
-@app.route('/')
-def index():
-    try:
-        with open(INDEX_FILE, 'r') as f:
-            return render_template_string(f.read())
-    except FileNotFoundError:
-        return f"Error: index.html not found at {INDEX_FILE}."
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
 
-@app.route('/api/media', methods=['GET'])
-def get_media():
-    return jsonify(load_all_media())
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
 
-@app.route('/api/scan', methods=['POST'])
-def scan_media():
-    """Scans directory and adds new files to correct title DBs."""
-    try:
-        existing_items = load_all_media()
-        existing_paths = {item['path'] for item in existing_items}
-        
-        # We need to buffer new items by title to minimize writes
-        new_items_by_title = {}
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
 
-        print(f"Scanning: {MEDIA_FOLDER}")
-
-        for root, dirs, files in os.walk(MEDIA_FOLDER):
-            for file in files:
-                file_ext = os.path.splitext(file)[1].lower()
-                if file_ext in IMG_EXTS or file_ext in VID_EXTS:
-                    rel_path = os.path.relpath(root, MEDIA_FOLDER)
-                    rel_path_web = rel_path.replace('\\', '/')
-                    
-                    if rel_path == '.':
-                        title = "Uncategorized"
-                        web_path = f"/media_content/{file}"
-                    else:
-                        title = rel_path.split(os.sep)[0]
-                        web_path = f"/media_content/{rel_path_web}/{file}"
-                    
-                    if web_path not in existing_paths:
-                        if title not in new_items_by_title:
-                            new_items_by_title[title] = []
-
-                        media_type = 'image' if file_ext in IMG_EXTS else 'video'
-                        new_entry = {
-                            'id': str(uuid.uuid4()),
-                            'filename': file,
-                            'original_name': file,
-                            'custom_title': "", 
-                            'title': title,
-                            'creator': title,
-                            'category': 'Imported',
-                            'tags': [],
-                            'hidden': False,
-                            'type': media_type,
-                            'path': web_path,
-                            'real_path': os.path.join(root, file)
-                        }
-                        new_items_by_title[title].append(new_entry)
-                        existing_paths.add(web_path) # Prevent duplicates in same scan run
+def create_storage():
+    """Builds the storage backend selected by storage.backend in config.json."""
+    storage_config = CONFIG.get('storage', {})
+    backend = storage_config.get('backend', 'json')
+    if backend == 'sqlite':
+        db_path = storage_config.get('sqlite_file', 'media.sqlite3')
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(DB_FOLDER, db_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        return SqliteStorage(db_path)
+    if backend != 'json':
+        print(f"Unknown storage backend '{backend}'. Using json.")
+    write_behind_ms = storage_config.get('write_behind_ms', 200)
+    if MULTIPROCESS:
+        # Edits buffered in one process would be invisible to, and overwritten by, the others
+        write_behind_ms = 0
+    return JsonTitleStorage(DB_FOLDER, write_behind_ms=write_behind_ms)
 
-        # Save updates
-        total_added = 0
-        for title, new_items in new_items_by_title.items():
-            filepath = get_title_filename(title)
-            current_data = []
-            if os.path.exists(filepath):
-                with open(filepath, 'r') as f:
-                    current_data = json.load(f)
-            
-            current_data.extend(new_items)
-            save_title_data(title, current_data)
-            total_added += len(new_items)
+# Field weights used to rank search hits
+SEARCH_FIELDS = {
+    'custom_title': 3.0,
+    'filename': 2.0,
+    'original_name': 2.0,
+    'tags': 2.0,
+    'title': 1.5,
+    'category': 1.0,
+}
 
-        return jsonify({'message': f'Scan complete. Added {total_added} new items.', 'added_count': total_added})
-    except Exception as e:
-        print(f"Scan error: {e}")
-        return jsonify({'error': str(e)}), 500
+def tokenize(text):
+    """Splits text into lowercase alphanumeric search tokens."""
+    return re.findall(r'[a-z0-9]+', (text or '').lower())
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    title = request.form.get('title', 'Unknown')
-    category = request.form.get('category', 'Uncategorized')
-    tags = request.form.get('tags', '')
-    is_hidden = request.form.get('is_hidden') == 'true'
-    
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+def search_fields(item):
+    """The values SearchIndex reads from an item; if they are equal, so are its postings."""
+    return tuple(get_item_title(item) if field == 'title' else item.get(field) for field in SEARCH_FIELDS)
 
-    if file:
-        filename = secure_filename(file.filename)
-        file_ext = os.path.splitext(filename)[1].lower()
-        media_type = 'image' if file_ext in IMG_EXTS else 'video' if file_ext in VID_EXTS else 'image'
+class SearchIndex:
+    """Token and prefix inverted index over item names, tags, title and category.
 
-        title_safe = secure_filename(title)
-        # Save physically
-        save_path = os.path.join(MEDIA_FOLDER, title_safe)
-        if not os.path.exists(save_path): os.makedirs(save_path)
-        
-        final_filename = f"{uuid.uuid4().hex[:8]}_{filename}"
-        file.save(os.path.join(save_path, final_filename))
-
-        tags_list = [t.strip() for t in tags.split(',') if t.strip()]
-        if is_hidden and '_cover' not in tags_list: tags_list.append('_cover')
-
-        new_entry = {
-            'id': str(uuid.uuid4()),
-            'filename': final_filename,
-            'original_name': filename,
-            'custom_title': "",
-            'title': title,
-            'creator': title,
-            'category': category,
-            'tags': tags_list,
-            'hidden': is_hidden,
-            'type': media_type,
-            'path': f"/media_content/{title_safe}/{final_filename}"
-        }
+    Items are added and removed one at a time as the catalog re-indexes a DB
+    file, so the index never needs a full rebuild. Query cost depends on the
+    number of matching postings, not on the size of the library.
+    """
 
-        # Load ONLY specific title file
-        filepath = get_title_filename(title)
-        data = []
-        if os.path.exists(filepath):
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-        
-        data.append(new_entry)
-        save_title_data(title, data)
+    def __init__(self):
+        self._postings = {}     # token -> {id: score}
+        self._docs = {}         # id -> {token: score}
+        self._vocab = []        # sorted tokens, for prefix lookups
 
-        return jsonify(new_entry), 201
+    def add(self, item):
+        media_id = item.get('id')
+        if not media_id:
+            return
+        self.remove(media_id)
+        doc = {}
+        for field, weight in SEARCH_FIELDS.items():
+            value = item.get(field)
+            if field == 'title':
+                value = get_item_title(item)
+            values = value if isinstance(value, list) else [value]
+            for text in values:
+                if not isinstance(text, str) or text == '_cover':
+                    continue
+                for token in tokenize(text):
+                    doc[token] = max(doc.get(token, 0.0), weight)
+        self._docs[media_id] = doc
+        for token, score in doc.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                bisect.insort(self._vocab, token)
+            posting[media_id] = score
 
-@app.route('/api/update/<media_id>', methods=['POST'])
-def update_media(media_id):
-    """Updates an item. Scans files to find it. Handles title moves."""
-    data = request.json
-    
-    # We iterate all JSON files to find the item
-    for filename in os.listdir(DB_FOLDER):
-        if not filename.endswith('.json'): continue
-        
-        filepath = os.path.join(DB_FOLDER, filename)
-        try:
-            with open(filepath, 'r') as f:
-                items = json.load(f)
-            
-            item_index = next((i for i, item in enumerate(items) if item['id'] == media_id), -1)
-            
-            if item_index != -1:
-                item = items[item_index]
-                
-                # Check if Creator Changed (requires moving between files)
-                new_title = data.get('title') or data.get('creator')
-                old_title = get_item_title(item)
-                
-                if new_title and new_title != old_title:
-                    # Remove from this list
-                    item = items.pop(item_index)
-                    # Update fields
-                    item.update({k: v for k, v in data.items() if k in item})
-                    set_item_title(item, new_title)
-                    # Save current file (deletion)
-                    save_title_data(old_title, items)
-                    
-                    # Add to new file
-                    new_filepath = get_title_filename(new_title)
-                    new_items = []
-                    if os.path.exists(new_filepath):
-                        with open(new_filepath, 'r') as nf:
-                            new_items = json.load(nf)
-                    new_items.append(item)
-                    save_title_data(new_title, new_items)
-                    
-                    return jsonify({'message': 'Updated and moved successfully'})
-                
-                else:
-                    # Simple update in place
-                    # Process tags carefully
-                    if 'tags' in data:
-                        tags_input = data['tags']
-                        if isinstance(tags_input, str):
-                            item['tags'] = [t.strip() for t in tags_input.split(',') if t.strip()]
-                        else:
-                            item['tags'] = tags_input
-                    
-                    # Update other scalar fields
-                    for field in ['custom_title', 'hidden', 'category']:
-                        if field in data:
-                            item[field] = data[field]
-                    if 'title' in data or 'creator' in data:
-                        set_item_title(item, new_title)
-                            
-                    save_title_data(old_title, items)
-                    return jsonify({'message': 'Updated successfully'})
-                    
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
-            continue
+    def remove(self, media_id):
+        doc = self._docs.pop(media_id, None)
+        if not doc:
+            return
+        for token in doc:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(media_id, None)
+            if not posting:
+                del self._postings[token]
+                pos = bisect.bisect_left(self._vocab, token)
+                if pos < len(self._vocab) and self._vocab[pos] == token:
+                    del self._vocab[pos]
 
-    return jsonify({'error': 'Item not found'}), 404
+    def _expand(self, prefix):
+        """Yields (token, is_exact) for every indexed token starting with prefix."""
+        pos = bisect.bisect_left(self._vocab, prefix)
+        while pos < len(self._vocab) and self._vocab[pos].startswith(prefix):
+            yield self._vocab[pos], self._vocab[pos] == prefix
+            pos += 1
 
-@app.route('/api/batch_update', methods=['POST'])
-def batch_update():
-    """Handles renaming collections efficiently by rewriting specific files."""
-    data = request.json
-    updates = data.get('updates', [])
-    if not updates: return jsonify({'message': 'No updates'}), 400
+    def query(self, text):
+        """Returns {id: score} for items matching every query token as a prefix."""
+        terms = tokenize(text)
+        if not terms:
+            return {}
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for token, exact in self._expand(term):
+                factor = 1.0 if exact else 0.5
+                for media_id, score in self._postings[token].items():
+                    if scores is not None and media_id not in scores:
+                        continue
+                    value = score * factor
+                    if value > term_scores.get(media_id, 0.0):
+                        term_scores[media_id] = value
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {media_id: scores[media_id] + value for media_id, value in term_scores.items()}
+            if not scores:
+                break
+        return scores or {}
 
-    # Group updates by ID for fast lookup
-    updates_by_id = {u['id']: u for u in updates}
-    
-    # Track which files need saving
-    modified_titles = set()
-    
-    # We essentially need to do a pass over the DB.
-    # Since batch updates (renaming collection) usually happens within one title,
-    # we can optimize. But let's be safe and scan.
-    
-    # Optimization: If all updates have the same 'title' change, 
-    # we are likely moving a whole file content to another.
-    
-    # Simplified generic approach:
-    for filename in os.listdir(DB_FOLDER):
-        if not filename.endswith('.json'): continue
-        filepath = os.path.join(DB_FOLDER, filename)
-        
-        try:
-            with open(filepath, 'r') as f:
-                items = json.load(f)
-            
-            file_modified = False
-            items_to_move = [] # (new_title, item)
-            
-            # Iterate backwards to allow safe removal
-            for i in range(len(items) - 1, -1, -1):
-                item = items[i]
-                if item['id'] in updates_by_id:
-                    change = updates_by_id[item['id']]
-                    
-                    # Handle Creator Change (Move)
-                    new_title = change.get('title') or change.get('creator')
-                    old_title = get_item_title(item)
-                    if new_title and new_title != old_title:
-                        set_item_title(item, new_title) # Update object
-                        items_to_move.append((new_title, item))
-                        items.pop(i) # Remove from current
-                        file_modified = True
-                    else:
-                        # In-place update
-                        item.update({k: v for k, v in change.items() if k in item})
-                        if 'title' in change or 'creator' in change:
-                            set_item_title(item, new_title)
-                        file_modified = True
-            
-            # Save if modified (items removed or updated in place)
-            if file_modified:
-                # Determine original title from filename is risky if sanitization collides
-                # But mostly fine. Better: rely on `save_title_data` logic
-                # We can overwrite the file we just read.
-                with open(filepath, 'w') as f:
-                    json.dump(items, f, indent=4)
-            
-            # Handle Moves
-            for new_title, item in items_to_move:
-                # This is inefficient if moving 1000 items (opens file 1000 times)
-                # But acceptable for now or needs buffering.
-                # BUFFERING LOGIC:
-                tgt_path = get_title_filename(new_title)
-                tgt_data = []
-                if os.path.exists(tgt_path):
-                    with open(tgt_path, 'r') as tf:
-                        tgt_data = json.load(tf)
-                tgt_data.append(item)
-                save_title_data(new_title, tgt_data)
+# Folder cover preference; lower wins, ties go to the earlier item
+def cover_rank(item):
+    tags = item.get('tags') or []
+    if '_cover' in tags:
+        return 0 if item.get('hidden') else 1
+    return 2 if item.get('type') == 'image' else 3
 
-        except Exception as e:
-            print(f"Batch error in {filename}: {e}")
+def item_folder_segments(item):
+    """Returns the folders of an item's path, as the browse view splits it."""
+    path = item.get('path')
+    if not isinstance(path, str):
+        return []
+    marker = '/media_content/'
+    idx = path.find(marker)
+    sub = path[idx + len(marker):] if idx >= 0 else path.lstrip('/')
+    return [segment for segment in sub.split('/') if segment][:-1]
 
-    return jsonify({'message': 'Batch update complete'})
+class FolderTree:
+    """Materialized browse tree: group -> subfolder -> ... with aggregates.
 
-@app.route('/media_content/<path:subpath>')
-def serve_media(subpath):
-    return send_from_directory(MEDIA_FOLDER, subpath)
+    One tree per grouping field ('title', 'category'). Top-level nodes are
+    the group names and the nodes below them are the item's folders, with
+    the group's own folder dropped, exactly as the browse view nests them.
+    Every node keeps visible, hidden, image and video counts for its whole
+    subtree plus the keys of the items stored directly in it, so an item is
+    added or removed by walking one path. Covers are resolved lazily and
+    cached per node until an item on that path is added or removed.
 
-@app.route('/api/titles', methods=['GET'])
-def get_titles():
-    """Returns list of all unique titles."""
-    data = load_all_media()
-    titles = list(set(get_item_title(item) for item in data if get_item_title(item)))
-    return jsonify(sorted(titles))
+    Items are keyed by (unit, ordinal), with ordinals increasing in the
+    order the unit stores its items, which is also the order the library is
+    served in, so cover ties resolve to the same item the frontend would
+    pick. An edit that leaves placement() unchanged only swaps the stored
+    item with replace().
+    """
 
-@app.route('/api/categories', methods=['GET'])
-def get_categories():
-    """Returns list of all unique categories."""
-    data = load_all_media()
-    categories = list(set(item['category'] for item in data if item.get('category')))
-    return jsonify(sorted(categories))
+    GROUPINGS = ('title', 'category')
 
-@app.route('/api/config', methods=['GET'])
-def get_public_config():
-    """Returns branding and other frontend-safe configuration."""
-    return jsonify({
-        'branding': CONFIG.get('branding', {}),
-        'appearance': CONFIG.get('appearance', {}),
-        'supported_formats': CONFIG.get('supported_formats', {})
-    })
+    def __init__(self):
+        self._roots = {grouping: self._node() for grouping in self.GROUPINGS}
+        self._items = {}    # key -> item
 
-@app.route('/assets/<path:filename>')
-def serve_assets(filename):
-    """Serve CSS, JS, and other static assets from the assets folder."""
-    return send_from_directory(ASSETS_FOLDER, filename)
+    @staticmethod
+    def _node():
+        return {'children': {}, 'items': set(), 'visible': 0, 'hidden': 0,
+                'images': 0, 'videos': 0, 'cover': None, 'cover_valid': False}
 
+    @staticmethod
+    def _path(item, grouping):
+        group = item.get(grouping) or 'Uncategorized'
+        folders = item_folder_segments(item)
+        if folders and folders[0] == group:
+            folders = folders[1:]
+        return [group] + folders
+
+    @classmethod
+    def placement(cls, item):
+        """Everything the tree reads from an item: its paths, counters and cover rank."""
+        return (tuple(tuple(cls._path(item, grouping)) for grouping in cls.GROUPINGS),
+                bool(item.get('hidden')), item.get('type'), cover_rank(item))
+
+    def _update(self, key, item, delta):
+        hidden = bool(item.get('hidden'))
+        for grouping, root in self._roots.items():
+            path = self._path(item, grouping)
+            nodes = [root]
+            for name in path:
+                parent = nodes[-1]
+                child = parent['children'].get(name)
+                if child is None:
+                    if delta < 0:
+                        break
+                    child = parent['children'][name] = self._node()
+                nodes.append(child)
+            else:
+                leaf = nodes[-1]
+                if delta > 0:
+                    leaf['items'].add(key)
+                elif key in leaf['items']:
+                    leaf['items'].discard(key)
+                else:
+                    continue
+                for node in nodes:
+                    node['hidden' if hidden else 'visible'] += delta
+                    if not hidden and item.get('type') == 'image':
+                        node['images'] += delta
+                    elif not hidden and item.get('type') == 'video':
+                        node['videos'] += delta
+                    node['cover_valid'] = False
+                if delta < 0:
+                    # Prune folders that no longer hold anything
+                    for name, parent, node in zip(reversed(path), reversed(nodes[:-1]), reversed(nodes[1:])):
+                        if node['visible'] or node['hidden']:
+                            break
+                        del parent['children'][name]
+
+    def add(self, key, item):
+        self._items[key] = item
+        self._update(key, item, 1)
+
+    def remove(self, key, item):
+        self._update(key, item, -1)
+        self._items.pop(key, None)
+
+    def replace(self, key, item):
+        """Stores a new version of an item whose placement() is unchanged."""
+        self._items[key] = item
+
+    def _cover(self, node, top_level):
+        """The folder's cover: its own items first, else anything below it."""
+        if not node['cover_valid']:
+            best = self._best(node['items'], top_level)
+            if best is None:
+                best = self._best(self._walk(node), top_level)
+            node['cover'] = best
+            node['cover_valid'] = True
+        return self._items.get(node['cover'])
+
+    def _best(self, keys, include_hidden):
+        best = None
+        for key in keys:
+            item = self._items[key]
+            if item.get('hidden') and not include_hidden:
+                continue
+            rank = (cover_rank(item), key)
+            if best is None or rank < best:
+                best = rank
+        return best[1] if best else None
+
+    @staticmethod
+    def _walk(node):
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            yield from current['items']
+            stack.extend(current['children'].values())
+
+    def find(self, grouping, path):
+        """Returns the node at path, or None."""
+        node = self._roots[grouping]
+        for name in path:
+            node = node['children'].get(name)
+            if node is None:
+                return None
+        return node
+
+    def folders(self, grouping, path, depth, project):
+        """Lists the subfolders of the node at path, `depth` levels deep.
+
+        Top-level groups are listed even if all their items are hidden and
+        their covers may be hidden items; below that, as in the browse view,
+        only visible items count.
+        """
+        node = self.find(grouping, path)
+        if node is None:
+            return None
+        return self._list(node, not path, depth, project)
+
+    def _list(self, node, top_level, depth, project):
+        folders = []
+        for name in sorted(node['children']):
+            child = node['children'][name]
+            if not top_level and not child['visible']:
+                continue
+            cover = self._cover(child, top_level)
+            entry = {
+                'name': name,
+                'count': child['visible'],
+                'hidden': child['hidden'],
+                'images': child['images'],
+                'videos': child['videos'],
+                'cover': project(cover) if cover else None,
+            }
+            if depth > 1:
+                entry['folders'] = self._list(child, False, depth - 1, project)
+            folders.append(entry)
+        return folders
+
+class TitleLocks:
+    """One lock per storage unit, with wait statistics.
+
+    Several units are always acquired in sorted order so writers touching
+    overlapping titles cannot deadlock. With a lock_folder, each lock is
+    also a lock file there and excludes writers in other processes.
+    """
+
+    def __init__(self, lock_folder=None):
+        self.lock_folder = lock_folder
+        self._guard = threading.Lock()
+        self._locks = {}
+        self._stats = {'acquired': 0, 'contended': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+
+    def _lock_for(self, unit):
+        with self._guard:
+            lock = self._locks.get(unit)
+            if lock is None:
+                if self.lock_folder:
+                    # Unit names may hold any character, so lock files are named by hash
+                    name = hashlib.sha1(unit.encode('utf-8')).hexdigest()[:20]
+                    lock = interprocess.FileLock(os.path.join(self.lock_folder, f"{name}.lock"))
+                else:
+                    lock = threading.Lock()
+                self._locks[unit] = lock
+            return lock
+
+    @contextmanager
+    def hold(self, units):
+        acquired = []
+        try:
+            for unit in sorted(units):
+                lock = self._lock_for(unit)
+                if lock.acquire(blocking=False):
+                    waited = 0.0
+                else:
+                    started = time.perf_counter()
+                    lock.acquire()
+                    waited = (time.perf_counter() - started) * 1000
+                acquired.append(lock)
+                with self._guard:
+                    self._stats['acquired'] += 1
+                    if waited:
+                        self._stats['contended'] += 1
+                        self._stats['wait_ms_total'] += waited
+                        self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], waited)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def stats(self):
+        with self._guard:
+            return dict(self._stats, wait_ms_total=round(self._stats['wait_ms_total'], 3),
+                        wait_ms_max=round(self._stats['wait_ms_max'], 3))
+
+# Number of item changes kept for /api/media/changes; older clients resync
+CHANGE_LOG_SIZE = 20000
+# With worker processes, how often every unit's signature is still checked
+SHARED_FULL_REFRESH_SECONDS = 30
+
+class MediaCatalog:
+    """Process-resident view of the media database.
+
+    Each storage unit is loaded once and only re-read when its signature
+    changes (file mtime/size for JSON, title version for SQLite). Items are
+    indexed by id, path and title so reads are served from memory and an
+    item's unit can be found without walking the database. Writes go
+    through upsert() or modify(), which hold the locks of every unit they
+    touch, group changes by unit and commit each unit once.
+
+    self.lock only guards the in-memory indexes and is never held during
+    storage I/O; the per-unit title locks serialize writers.
+
+    Every change to the indexed items bumps `revision` and is recorded in a
+    bounded change log, so clients can fetch deltas instead of the library.
+
+    When worker processes share the database, `shared` is their
+    GenerationLog: every commit publishes the units it wrote, and refresh()
+    re-checks only the units other processes published since the last
+    look, instead of every unit's signature. A full check still runs every
+    SHARED_FULL_REFRESH_SECONDS, for edits made outside the server.
+    """
+
+    def __init__(self, storage, shared=None, lock_folder=None):
+        self.storage = storage
+        self.shared = shared
+        self.lock = threading.RLock()
+        self.title_locks = TitleLocks(lock_folder)
+        self._files = {}        # unit -> {'sig': signature, 'items': [...], 'keys': [tree key per item]}
+        self._by_id = {}        # id -> item
+        self._id_file = {}      # id -> unit
+        self._by_path = {}      # web path -> item
+        self._by_folder = {}    # folder below /media_content/ -> {id: item}
+        self._folders = []      # sorted keys of _by_folder, for subtree lookups
+        self._titles = Counter()
+        self._categories = Counter()
+        self._all = None        # flattened item list, rebuilt lazily
+        self._sorted = {}       # sort key -> (keys, items), rebuilt lazily
+        self.search = SearchIndex()
+        self.tree = FolderTree()
+        self.revision = 0
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)   # (revision, id, 'added'|'changed'|'removed')
+        self._log_floor = 0     # oldest revision the change log can answer from
+        self._loaded = False
+        self.generation = None  # last shared generation applied
+        self._full_refresh_at = 0.0
+
+    def _invalidate(self):
+        self._all = None
+        self._sorted = {}
+
+    def _log(self, ops):
+        """Records [(id, op)] under a new revision."""
+        if not ops:
+            return
+        self.revision += 1
+        if not self._loaded:
+            self._log_floor = self.revision
+            return
+        self._changes.extend((self.revision, media_id, op) for media_id, op in ops)
+        if len(self._changes) == self._changes.maxlen:
+            # The oldest retained revision may have lost entries to eviction
+            self._log_floor = self._changes[0][0]
+
+    def _remove_unit(self, filename):
+        """Drops a unit that disappeared from storage and logs its removals."""
+        entry = self._files.get(filename)
+        self._drop_file(filename)
+        if entry:
+            self._log([(item.get('id'), 'removed') for item in entry['items']
+                       if item.get('id') and item.get('id') not in self._by_id])
+
+    def _drop_file(self, filename):
+        entry = self._files.pop(filename, None)
+        if not entry:
+            return
+        for key, item in zip(entry['keys'], entry['items']):
+            self.tree.remove(key, item)
+            self._unindex_item(filename, item)
+        self._titles += Counter()
+        self._categories += Counter()
+        self._invalidate()
+
+    def _folder_add(self, item):
+        folder = get_item_folder(item)
+        members = self._by_folder.get(folder)
+        if members is None:
+            members = self._by_folder[folder] = {}
+            bisect.insort(self._folders, folder)
+        members[item['id']] = item
+
+    def _folder_remove(self, item):
+        folder = get_item_folder(item)
+        members = self._by_folder.get(folder)
+        if members is None or members.get(item['id']) is not item:
+            return
+        del members[item['id']]
+        if not members:
+            del self._by_folder[folder]
+            del self._folders[bisect.bisect_left(self._folders, folder)]
+
+    def _unindex_item(self, filename, item):
+        media_id = item.get('id')
+        if self._id_file.get(media_id) == filename:
+            del self._id_file[media_id]
+            self._folder_remove(self._by_id.pop(media_id))
+            self.search.remove(media_id)
+        path = item.get('path')
+        if path and self._by_path.get(path) is item:
+            del self._by_path[path]
+        self._titles[get_item_title(item)] -= 1
+        if item.get('category'):
+            self._categories[item['category']] -= 1
+
+    def _index_item(self, filename, item):
+        media_id = item.get('id')
+        if media_id:
+            if media_id in self._by_id:
+                self._folder_remove(self._by_id[media_id])
+            self._by_id[media_id] = item
+            self._id_file[media_id] = filename
+            self._folder_add(item)
+            self.search.add(item)
+        if item.get('path'):
+            self._by_path[item['path']] = item
+        self._titles[get_item_title(item)] += 1
+        if item.get('category'):
+            self._categories[item['category']] += 1
+
+    def _reindex_item(self, filename, key, old, item):
+        """Swaps in a new version of an item, touching only the indexes whose fields changed."""
+        if FolderTree.placement(old) == FolderTree.placement(item):
+            self.tree.replace(key, item)
+        else:
+            self.tree.remove(key, old)
+            self.tree.add(key, item)
+        media_id = item['id']
+        moved_here = self._id_file.get(media_id) != filename
+        if media_id in self._by_id:
+            self._folder_remove(self._by_id[media_id])
+        self._by_id[media_id] = item
+        self._id_file[media_id] = filename
+        self._folder_add(item)
+        if moved_here or search_fields(old) != search_fields(item):
+            self.search.add(item)
+        if old.get('path') != item.get('path') and self._by_path.get(old.get('path')) is old:
+            del self._by_path[old['path']]
+        if item.get('path'):
+            self._by_path[item['path']] = item
+        if get_item_title(old) != get_item_title(item):
+            self._titles[get_item_title(old)] -= 1
+            self._titles[get_item_title(item)] += 1
+        if old.get('category') != item.get('category'):
+            if old.get('category'):
+                self._categories[old['category']] -= 1
+            if item.get('category'):
+                self._categories[item['category']] += 1
+
+    @staticmethod
+    def _match(filename, old_entry, items):
+        """Pairs the items of a unit's old and new versions by id.
+
+        Returns ({id: (tree key, old item)}, tree keys for items). Kept items
+        keep their key and new ones get ordinals past the old ones. Returns
+        None when that can't preserve the unit's order (an item was inserted
+        before a kept one, or items were reordered) or when an item has no
+        id or an id repeats; the unit is then re-indexed from scratch.
+        """
+        old = {}
+        for key, item in zip(old_entry['keys'], old_entry['items']):
+            media_id = item.get('id')
+            if not media_id or media_id in old:
+                return None
+            old[media_id] = (key, item)
+        keys = []
+        seen = set()
+        ordinal = old_entry['keys'][-1][1] + 1 if old_entry['keys'] else 0
+        for item in items:
+            media_id = item.get('id')
+            if not media_id or media_id in seen:
+                return None
+            seen.add(media_id)
+            if media_id in old:
+                key = old[media_id][0]
+            else:
+                key = (filename, ordinal)
+                ordinal += 1
+            if keys and key[1] <= keys[-1][1]:
+                return None
+            keys.append(key)
+        return old, keys
+
+    def _index_file(self, filename, items, sig):
+        if sig is None:
+            self._remove_unit(filename)
+            return
+        items = [item for item in items if isinstance(item, dict)]
+
+        # Diff against what the catalog currently knows, before re-indexing
+        ops = []
+        for item in items:
+            previous = self._by_id.get(item.get('id'))
+            if previous is None:
+                ops.append((item.get('id'), 'added'))
+            elif previous is not item and previous != item:
+                ops.append((item['id'], 'changed'))
+        old_entry = self._files.get(filename)
+        old_items = old_entry['items'] if old_entry else []
+        matched = self._match(filename, old_entry, items) if old_entry else None
+
+        if matched is None:
+            self._drop_file(filename)
+            keys = [(filename, ordinal) for ordinal in range(len(items))]
+            for key, item in zip(keys, items):
+                self.tree.add(key, item)
+                self._index_item(filename, item)
+        else:
+            # Only items that were added, removed or edited are re-indexed
+            old, keys = matched
+            current = {item['id'] for item in items}
+            for media_id, (key, item) in old.items():
+                if media_id not in current:
+                    self.tree.remove(key, item)
+                    self._unindex_item(filename, item)
+            for key, item in zip(keys, items):
+                previous = old.get(item['id'])
+                if previous is None:
+                    self.tree.add(key, item)
+                    self._index_item(filename, item)
+                elif previous[1] is not item:
+                    self._reindex_item(filename, key, previous[1], item)
+            self._titles += Counter()
+            self._categories += Counter()
+        self._files[filename] = {'sig': sig, 'items': items, 'keys': keys}
+        self._invalidate()
+
+        # Items that left this unit and are not indexed anywhere else are gone
+        ops.extend((item['id'], 'removed') for item in old_items
+                   if item.get('id') and item['id'] not in self._by_id)
+        self._log([(media_id, op) for media_id, op in ops if media_id])
+
+    def _refresh_units(self, units):
+        """Re-checks the signatures of just these units."""
+        sigs = self.storage.unit_signatures(units)
+        for unit, sig in sigs.items():
+            entry = self._files.get(unit)
+            if sig is None:
+                if entry:
+                    self._remove_unit(unit)
+            elif not entry or entry['sig'] != sig:
+                self._index_file(unit, self.storage.load_unit(unit), sig)
+
+    def refresh(self):
+        """Re-reads only the units that were added or changed in storage."""
+        with self.lock:
+            if self.shared is not None:
+                generation, units = self.shared.changes_since(self.generation)
+                if (self._loaded and units is not None
+                        and time.monotonic() - self._full_refresh_at < SHARED_FULL_REFRESH_SECONDS):
+                    if units:
+                        self._refresh_units(units)
+                    self.generation = generation
+                    return
+                # Taken before listing, so changes published meanwhile are re-checked next time
+                self.generation = generation
+                self._full_refresh_at = time.monotonic()
+            sigs = self.storage.signatures()
+            for gone in set(self._files) - set(sigs):
+                self._remove_unit(gone)
+            for unit, sig in sigs.items():
+                entry = self._files.get(unit)
+                if entry and entry['sig'] == sig:
+                    continue
+                self._index_file(unit, self.storage.load_unit(unit), sig)
+            # The initial load is not a change anyone needs to replay
+            self._loaded = True
+
+    def warm(self, snapshot, workers=4):
+        """Initial load: reuses snapshot units whose signature still matches
+        and reads the rest from storage in parallel.
+
+        snapshot is {unit: {'sig', 'items', 'checked'}}. Returns
+        (units reused, units read).
+        """
+        with self.lock:
+            if self.shared is not None:
+                self.generation = self.shared.current()
+                self._full_refresh_at = time.monotonic()
+            sigs = self.storage.signatures()
+            for gone in set(self._files) - set(sigs):
+                self._remove_unit(gone)
+            reused = 0
+            stale = []
+            for unit, sig in sigs.items():
+                current = self._files.get(unit)
+                if current and current['sig'] == sig:
+                    continue
+                entry = snapshot.get(unit)
+                if entry and entry['sig'] == sig:
+                    self._index_file(unit, entry['items'], sig)
+                    self._files[unit]['checked'] = entry['checked']
+                    reused += 1
+                else:
+                    stale.append(unit)
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+                for unit, items in zip(stale, pool.map(self.storage.load_unit, stale)):
+                    self._index_file(unit, items, sigs[unit])
+            self._loaded = True
+            return reused, len(stale)
+
+    def snapshot_units(self):
+        """Returns {unit: (signature, items, checked)} for every loaded unit."""
+        with self.lock:
+            return {unit: (entry['sig'], entry['items'], entry.get('checked', False))
+                    for unit, entry in self._files.items()}
+
+    def mark_checked(self, unit, sig):
+        """Records that a unit passed the integrity check at this signature."""
+        with self.lock:
+            entry = self._files.get(unit)
+            if entry and entry['sig'] == sig:
+                entry['checked'] = True
+
+    def iter_items(self):
+        """Yields every item a unit at a time, without copying the library.
+
+        Each unit is consistent; writes that land between units may or may
+        not be included.
+        """
+        with self.lock:
+            self.refresh()
+            units = sorted(self._files)
+        for unit in units:
+            with self.lock:
+                entry = self._files.get(unit)
+                items = list(entry['items']) if entry else []
+            yield from items
+
+    def current_revision(self):
+        """Refreshes from storage and returns the catalog revision."""
+        with self.lock:
+            self.refresh()
+            return self.revision
+
+    def load_all(self):
+        """Returns every item across all units."""
+        with self.lock:
+            self.refresh()
+            if self._all is None:
+                self._all = [item for name in sorted(self._files) for item in self._files[name]['items']]
+            return list(self._all)
+
+    def sorted_items(self, sort_key):
+        """Returns (keys, items) ordered by SORT_KEYS[sort_key], then id."""
+        with self.lock:
+            self.refresh()
+            cached = self._sorted.get(sort_key)
+            if cached is None:
+                key_func = SORT_KEYS[sort_key]
+                decorated = sorted(((key_func(item), item.get('id') or ''), item) for item in self.load_all())
+                cached = ([k for k, _ in decorated], [item for _, item in decorated])
+                self._sorted[sort_key] = cached
+            return cached
+
+    def search_items(self, text):
+        """Returns [(score, item)] for a free-text query, best match first."""
+        with self.lock:
+            self.refresh()
+            hits = [(score, self._by_id[media_id]) for media_id, score in self.search.query(text).items()
+                    if media_id in self._by_id]
+        hits.sort(key=lambda hit: (-hit[0], SORT_KEYS['name'](hit[1])))
+        return hits
+
+    def changes_since(self, since):
+        """Returns (revision, added, changed, removed_ids) after revision `since`.
+
+        Returns None if `since` is older than the change log reaches, in
+        which case the client has to reload the whole library.
+        """
+        with self.lock:
+            self.refresh()
+            if since > self.revision or since < self._log_floor:
+                return None
+            first_op = {}
+            for revision, media_id, op in reversed(self._changes):
+                if revision <= since:
+                    break
+                first_op[media_id] = op
+            added, changed, removed = [], [], []
+            for media_id, op in first_op.items():
+                item = self._by_id.get(media_id)
+                if item is None:
+                    if op != 'added':
+                        removed.append(media_id)
+                elif op == 'added':
+                    added.append(item)
+                else:
+                    changed.append(item)
+            return self.revision, added, changed, removed
+
+    def get(self, media_id):
+        with self.lock:
+            self.refresh()
+            return self._by_id.get(media_id)
+
+    def get_by_path(self, path):
+        with self.lock:
+            self.refresh()
+            return self._by_path.get(path)
+
+    def unit_for(self, media_id):
+        """Returns the storage unit holding media_id, or None."""
+        with self.lock:
+            self.refresh()
+            return self._id_file.get(media_id)
+
+    def unit_items(self, unit):
+        """Returns a copy of the item list stored in one unit."""
+        with self.lock:
+            self.refresh()
+            entry = self._files.get(unit)
+            return list(entry['items']) if entry else []
+
+    def lookup(self, ids, paths):
+        """Returns (ids that exist, {path: id} for paths that exist) in one refresh."""
+        with self.lock:
+            self.refresh()
+            return ({media_id for media_id in ids if media_id in self._by_id},
+                    {path: self._by_path[path].get('id') for path in paths if path in self._by_path})
+
+    def get_many(self, media_ids):
+        """Returns {id: item} for the ids that exist, in one refresh."""
+        with self.lock:
+            self.refresh()
+            return {media_id: self._by_id[media_id] for media_id in media_ids if media_id in self._by_id}
+
+    def has_path(self, path):
+        with self.lock:
+            return path in self._by_path
+
+    def folder_items(self, folder):
+        """Returns the items stored directly in a folder below /media_content/.
+
+        Like has_path(), reads the indexes as they are; callers refresh() first.
+        """
+        with self.lock:
+            return list(self._by_folder.get(folder, {}).values())
+
+    def subfolders(self, folder):
+        """Returns every folder below folder ('' for all) that holds items, sorted."""
+        prefix = folder + '/' if folder else ''
+        with self.lock:
+            found = []
+            pos = bisect.bisect_left(self._folders, prefix)
+            while pos < len(self._folders) and self._folders[pos].startswith(prefix):
+                if self._folders[pos] != folder:
+                    found.append(self._folders[pos])
+                pos += 1
+            return found
+
+    def titles(self):
+        with self.lock:
+            self.refresh()
+            return sorted(t for t, n in self._titles.items() if n > 0 and t)
+
+    def categories(self):
+        with self.lock:
+            self.refresh()
+            return sorted(c for c, n in self._categories.items() if n > 0)
+
+    def count_items(self, title=None, category=None):
+        """Returns the number of items with this title or category from the kept counters."""
+        with self.lock:
+            self.refresh()
+            if title is not None:
+                return max(self._titles[title], 0)
+            return max(self._categories[category], 0)
+
+    def folder_tree(self, grouping, path, depth, project):
+        """Returns (revision, folders) below path in the materialized tree.
+
+        folders is None when no folder exists at path.
+        """
+        with self.lock:
+            self.refresh()
+            return self.revision, self.tree.folders(grouping, path, depth, project)
+
+    def _locked_write(self, media_ids, build, remove_ids=()):
+        """Runs build() under the locks of every unit it reads or writes.
+
+        build() returns the new item dicts; it is called with the source
+        units locked. If the items turn out to live in, or move to, a unit
+        that was not locked, all locks are released and the write retries
+        with the larger set, keeping acquisition in sorted order. Items in
+        remove_ids (a subset of media_ids) are deleted in the same commit.
+        """
+        needed = set()
+        while True:
+            with self.lock:
+                self.refresh()
+                needed |= {self._id_file[i] for i in media_ids if i in self._id_file}
+            with self.title_locks.hold(needed):
+                with self.lock:
+                    self.refresh()
+                    sources = {self._id_file[i] for i in media_ids if i in self._id_file}
+                    if not sources <= needed:
+                        continue
+                    items = build()
+                    targets = {self.storage.unit_for_title(get_item_title(item)) for item in items}
+                if not targets <= needed:
+                    needed |= targets
+                    continue
+                return self._apply(items, remove_ids)
+
+    def upsert(self, items):
+        """Inserts or replaces items by id, moving them if their title changed.
+
+        Callers pass new dicts rather than mutating the cached ones. Returns
+        {unit: item count} for every unit that was committed.
+        """
+        items = list(items)
+        for item in items:
+            if not item.get('id'):
+                item['id'] = str(uuid.uuid4())
+        return self._locked_write([item['id'] for item in items], lambda: items)
+
+    def remove(self, media_ids):
+        """Deletes items by id, writing each affected unit once. Returns {unit: item count}."""
+        media_ids = list(media_ids)
+        return self._locked_write(media_ids, lambda: [], media_ids)
+
+    def modify(self, media_ids, apply, remove_ids=()):
+        """Read-modify-write of existing items under their title locks.
+
+        apply(item) receives a copy of each current item and returns the new
+        item, or None to leave it unchanged. Items in remove_ids are deleted
+        in the same commit, so each unit is still written once. Returns
+        (items, {unit: count}).
+        """
+        result = []
+        remove_ids = list(remove_ids)
+
+        def build():
+            result.clear()
+            for media_id in media_ids:
+                current = self._by_id.get(media_id)
+                if current is None:
+                    continue
+                item = apply(dict(current))
+                if item is not None:
+                    result.append(item)
+            return list(result)
+
+        units = self._locked_write(list(media_ids) + remove_ids, build, remove_ids)
+        return list(result), units
+
+    def _apply(self, items, remove_ids=()):
+        """Commits items and removals; the caller holds the title locks of every unit involved."""
+        with self.lock:
+            states = {}
+            location = {}       # id -> unit it ends up in within this batch
+
+            def state(unit):
+                if unit not in states:
+                    base = self.unit_items(unit)
+                    states[unit] = {
+                        'base': base,
+                        'pos': {item.get('id'): i for i, item in enumerate(base)},
+                        'removed': set(),
+                        'appended': {},     # id -> item, in arrival order
+                        'changed': {}
+                    }
+                return states[unit]
+
+            # One pass over the items; each unit is materialized at most once
+            for item in items:
+                media_id = item['id']
+                new_unit = self.storage.unit_for_title(get_item_title(item))
+                old_unit = location.get(media_id, self._id_file.get(media_id))
+                if old_unit is not None and old_unit != new_unit:
+                    st = state(old_unit)
+                    st['appended'].pop(media_id, None)
+                    if media_id in st['pos']:
+                        st['removed'].add(media_id)
+                    st['changed'].pop(media_id, None)
+
+                st = state(new_unit)
+                if media_id in st['pos'] and media_id not in st['removed']:
+                    st['base'][st['pos'][media_id]] = item
+                else:
+                    st['appended'].pop(media_id, None)
+                    st['appended'][media_id] = item
+                st['changed'][media_id] = item
+                location[media_id] = new_unit
+
+            for media_id in remove_ids:
+                unit = self._id_file.get(media_id)
+                if unit is not None:
+                    st = state(unit)
+                    if media_id in st['pos']:
+                        st['removed'].add(media_id)
+
+            changes = {}
+            for unit, st in states.items():
+                removed = st['removed']
+                unit_items = [i for i in st['base'] if i.get('id') not in removed]
+                unit_items.extend(st['appended'].values())
+                changes[unit] = (unit_items, list(st['changed'].values()), sorted(removed))
+
+        if not changes:
+            return {}
+        sigs = self.storage.commit(changes)
+        if self.shared is not None:
+            # Still under the title locks, so the next writer of these units sees the change
+            self.shared.publish(sorted(changes))
+        with self.lock:
+            for unit, (unit_items, _changed, _removed) in changes.items():
+                self._index_file(unit, unit_items, sigs.get(unit))
+        return {unit: len(unit_items) for unit, (unit_items, _c, _r) in changes.items()}
+
+    def move(self, media_ids, new_title):
+        """Moves items to another title, keeping every other field."""
+        def retitle(item):
+            set_item_title(item, new_title)
+            return item
+        return self.modify(media_ids, retitle)[1]
+
+def create_catalog(storage):
+    """Builds the catalog, sharing locks and changes with other workers in multi-process mode."""
+    if not MULTIPROCESS:
+        return MediaCatalog(storage)
+    os.makedirs(LOCK_FOLDER, exist_ok=True)
+    return MediaCatalog(storage, shared=interprocess.GenerationLog(GENERATION_FILE), lock_folder=LOCK_FOLDER)
+
+STORAGE = create_storage()
+CATALOG = create_catalog(STORAGE)
+# Don't lose edits still inside the write-behind window on shutdown
+atexit.register(STORAGE.flush)
+
+def load_all_media():
+    """Returns all items from the in-memory catalog."""
+    return CATALOG.load_all()
+
+def migrate_json_to_sqlite():
+    """Copies the per-title JSON files into the SQLite database, once.
+
+    The JSON files are left in place as a backup; a marker in the SQLite
+    meta table prevents the copy from running again.
+    """
+    if not isinstance(STORAGE, SqliteStorage) or STORAGE.get_meta('json_migrated'):
+        return
+    source = JsonTitleStorage(DB_FOLDER)
+    units = source.signatures()
+    if units:
+        print(f"JSON database found in {DB_FOLDER}. Copying into {STORAGE.db_path}...")
+        try:
+            copied = 0
+            for unit in sorted(units):
+                items = source.load_unit(unit)
+                if items:
+                    STORAGE.upsert(items)
+                    copied += len(items)
+            print(f"Migration complete. Copied {copied} items from {len(units)} files.")
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            return
+    STORAGE.set_meta('json_migrated', str(time.time()))
+
+def integrity_check_title_creator(auto_fix=False):
+    """Scan the catalog for missing/mismatched title/creator and optionally fix.
+
+    Units that passed at their current signature, including those restored
+    from the startup snapshot, are skipped. Returns the summary counts.
+    """
+    files_scanned = 0
+    files_skipped = 0
+    files_modified = 0
+    items_scanned = 0
+    items_fixed = 0
+
+    for unit, (sig, items, checked) in sorted(CATALOG.snapshot_units().items()):
+        if checked:
+            files_skipped += 1
+            continue
+        files_scanned += 1
+        fixed = []
+        clean = True
+
+        for item in items:
+            items_scanned += 1
+
+            title = item.get('title')
+            creator = item.get('creator')
+
+            # Determine canonical title using the shared helper
+            canonical = get_item_title(item)
+
+            if title != canonical or creator != canonical:
+                clean = False
+                if auto_fix and item.get('id'):
+                    fixed.append(item['id'])
+                else:
+                    print(f"Integrity warning in {unit}: id={item.get('id')} title={title} creator={creator}")
+
+        if fixed:
+            def fix(item):
+                set_item_title(item, get_item_title(item))
+                return item
+            items_fixed += len(CATALOG.modify(fixed, fix)[0])
+            files_modified += 1
+        elif clean:
+            CATALOG.mark_checked(unit, sig)
+
+    print("Integrity check summary:")
+    print(f"  files_scanned={files_scanned}")
+    print(f"  files_skipped={files_skipped}")
+    print(f"  files_modified={files_modified}")
+    print(f"  items_scanned={items_scanned}")
+    print(f"  items_fixed={items_fixed}")
+    return {'files_scanned': files_scanned, 'files_skipped': files_skipped, 'files_modified': files_modified,
+            'items_scanned': items_scanned, 'items_fixed': items_fixed}
+
+# --- HTTP File Serving ---
+
+def file_etag(st):
+    """Strong validator from inode, size and mtime; stable across restarts."""
+    return hashlib.sha1(f"{st.st_ino}-{st.st_size}-{st.st_mtime_ns}".encode()).hexdigest()[:24]
+
+# Precompressed variants written next to a file, in order of preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+def serve_file(root, subpath, max_age, accel_prefix, precompressed=False, immutable=False):
+    """Sends a file with a strong ETag, Last-Modified and Cache-Control.
+
+    Handles If-None-Match / If-Modified-Since (304), If-Range and byte
+    ranges of any size. With http.sendfile set, the body is left to the
+    front proxy via X-Sendfile or X-Accel-Redirect. With precompressed,
+    a .br or .gz file next to it is sent instead when the client accepts
+    that encoding.
+    """
+    path = safe_join(root, subpath)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = None
+    if precompressed:
+        for name, suffix in PRECOMPRESSED:
+            if request.accept_encodings.quality(name) > 0 and os.path.isfile(path + suffix):
+                path, subpath, encoding = path + suffix, subpath + suffix, name
+                break
+    st = os.stat(path)
+    etag = file_etag(st)
+
+    if SENDFILE_MODE == 'x-accel-redirect':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(subpath)}"
+        response.set_etag(etag)
+        response.last_modified = st.st_mtime
+        # nginx serves the body and the byte ranges; we only answer 304s
+        response = response.make_conditional(request)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=etag, last_modified=st.st_mtime, conditional=True)
+
+    if precompressed:
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+    if immutable:
+        # Content-hashed names never change content: skip revalidation entirely
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    elif max_age > 0:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+ASSET_DIST_FOLDER = os.path.join(ASSETS_FOLDER, 'dist')
+ASSET_MANIFEST_FILE = os.path.join(ASSET_DIST_FOLDER, 'manifest.json')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+BUNDLE_ENTRIES = ('app.js', 'react.js', 'react-dom.js', 'styles.css')
+_asset_manifest = (None, None)     # (manifest mtime, manifest or None)
+
+def asset_bundle():
+    """Returns the built bundle's manifest, or None to compile app.jsx in the browser.
+
+    The manifest is re-read when build_assets.py replaces it, so a rebuild
+    needs no restart. http.asset_bundle 'off' always uses the dev path.
+    """
+    global _asset_manifest
+    if HTTP_CONFIG.get('asset_bundle', 'auto') == 'off':
+        return None
+    try:
+        mtime = os.stat(ASSET_MANIFEST_FILE).st_mtime_ns
+    except OSError:
+        return None
+    cached_mtime, manifest = _asset_manifest
+    if cached_mtime != mtime:
+        try:
+            with open(ASSET_MANIFEST_FILE, 'r') as f:
+                manifest = json.load(f)
+            missing = [entry for entry in BUNDLE_ENTRIES
+                       if not os.path.isfile(os.path.join(ASSET_DIST_FOLDER, manifest.get(entry) or ''))]
+            if missing:
+                print(f"Asset bundle incomplete ({', '.join(missing)} missing); compiling app.jsx in the browser")
+                manifest = None
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Could not read {ASSET_MANIFEST_FILE}: {e}")
+            manifest = None
+        _asset_manifest = (mtime, manifest)
+    return manifest
+
+# --- Thumbnails ---
+
+class ThumbnailCache:
+    """On-disk thumbnail store evicted least-recently-used first by total bytes.
+
+    Hits touch the file's mtime (at most hourly) so the LRU order survives
+    restarts.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # path -> bytes, least recently used first
+        self._bytes = 0
+        self._loaded = False
+        self.evicted = 0
+
+    def _load(self):
+        if self._loaded:
+            return
+        found = []
+        for root, _dirs, files in os.walk(self.folder):
+            for name in files:
+                if not name.endswith('.jpg'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        for _mtime, path, nbytes in sorted(found):
+            self._entries[path] = nbytes
+            self._bytes += nbytes
+        self._loaded = True
+        self._evict()
+
+    def path_for(self, key, size):
+        return os.path.join(self.folder, str(size), key[:2], f"{key}.jpg")
+
+    def touch(self, path):
+        with self._lock:
+            self._load()
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        try:
+            if time.time() - os.stat(path).st_mtime > 3600:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def add(self, path, nbytes):
+        with self._lock:
+            self._load()
+            self._bytes += nbytes - self._entries.pop(path, 0)
+            self._entries[path] = nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            path, nbytes = self._entries.popitem(last=False)
+            self._bytes -= nbytes
+            self.evicted += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {'files': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'evicted': self.evicted}
+
+class ThumbnailService:
+    """Renders thumbnails in a process pool and serves them from the disk cache.
+
+    Cache keys cover the source path, size and mtime plus the thumbnail
+    size, so an edited file gets a fresh thumbnail. Concurrent requests
+    for the same thumbnail share one render.
+    """
+
+    def __init__(self, config):
+        self.sizes = sorted(int(size) for size in config.get('sizes', [256, 640])) or [256]
+        self.prewarm_sizes = [int(size) for size in config.get('prewarm_sizes', self.sizes[:1])]
+        self.workers = max(1, int(config.get('workers', 2)))
+        self.quality = int(config.get('quality', 80))
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.cache = ThumbnailCache(os.path.join(CACHE_FOLDER, 'thumbs'),
+                                    int(config.get('max_cache_mb', 1024)) * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._inflight = {}     # cache path -> future
+        self._failed = set()    # cache paths whose source could not be rendered
+        self._stats = {'hits': 0, 'generated': 0, 'failed': 0, 'queued': 0}
+
+    def pick_size(self, requested):
+        """Returns the smallest configured size that covers the requested one."""
+        if not requested:
+            return self.sizes[0]
+        return next((size for size in self.sizes if size >= requested), self.sizes[-1])
+
+    def can_render(self, item):
+        if item.get('type') == 'video':
+            return self.ffmpeg is not None
+        return thumbnails.can_render_images()
+
+    def _source(self, item, size):
+        src = get_item_real_path(item)
+        if not src:
+            raise FileNotFoundError(item.get('path'))
+        st = os.stat(src)
+        key = hashlib.sha1(f"{src}|{st.st_size}|{st.st_mtime_ns}|{size}".encode()).hexdigest()
+        return src, self.cache.path_for(key, size)
+
+    def _submit(self, src, dest, size, kind):
+        with self._lock:
+            future = self._inflight.get(dest)
+            if future is not None:
+                return future
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._pool.submit(thumbnails.render, src, dest, size, kind, self.quality, self.ffmpeg)
+            self._inflight[dest] = future
+            self._stats['queued'] += 1
+        future.add_done_callback(lambda f: self._finished(dest, f))
+        return future
+
+    def _finished(self, dest, future):
+        with self._lock:
+            self._inflight.pop(dest, None)
+            # Cancelled at shutdown: not a failure, and exception() would raise
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                self._failed.add(dest)
+                self._stats['failed'] += 1
+                print(f"Thumbnail error for {dest}: {error}")
+                return
+            self._stats['generated'] += 1
+        self.cache.add(dest, future.result())
+
+    def ensure(self, item, size, timeout=60):
+        """Returns the cached thumbnail path, rendering it first if needed.
+
+        Returns None when the item type cannot be rendered here.
+        """
+        src, dest = self._source(item, size)
+        if os.path.exists(dest):
+            with self._lock:
+                self._stats['hits'] += 1
+            self.cache.touch(dest)
+            return dest
+        if not self.can_render(item) or dest in self._failed:
+            return None
+        self._submit(src, dest, size, item.get('type')).result(timeout=timeout)
+        return dest
+
+    def prewarm(self, items):
+        """Queues thumbnails for freshly added items without waiting. Returns the count."""
+        queued = 0
+        for item in items:
+            if not self.can_render(item):
+                continue
+            for size in self.prewarm_sizes:
+                try:
+                    src, dest = self._source(item, size)
+                except OSError:
+                    break
+                if not os.path.exists(dest) and dest not in self._failed:
+                    self._submit(src, dest, size, item.get('type'))
+                    queued += 1
+        return queued
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, inflight=len(self._inflight))
+        stats['cache'] = self.cache.stats()
+        stats['images_enabled'] = thumbnails.can_render_images()
+        stats['videos_enabled'] = self.ffmpeg is not None
+        return stats
+
+THUMBNAILS = ThumbnailService(CONFIG.get('thumbnails', {}))
+
+# --- Metadata Extraction ---
+
+# Fields filled in from file headers; absent when a file does not provide them
+METADATA_FIELDS = ('width', 'height', 'duration', 'taken_at')
+
+class MetadataExtractor:
+    """Reads dimensions, durations and capture dates from file headers.
+
+    Each item remembers the mtime and size its metadata was read at
+    (`probed_mtime_ns`, `file_size`), so only new or modified files are
+    opened again. Files are probed on a bounded thread pool.
+    """
+
+    def __init__(self, config):
+        self.enabled = config.get('enabled', True)
+        self.workers = max(1, int(config.get('workers', 4)))
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'files_checked': 0, 'files_probed': 0, 'errors': 0,
+                       'bytes_read': 0, 'probe_seconds': 0.0, 'last_run_ms': 0.0}
+
+    def probe(self, item):
+        """Returns the item's metadata fields, or None if they are up to date."""
+        path = get_item_real_path(item)
+        if not path:
+            return None
+        started = time.perf_counter()
+        try:
+            st = os.stat(path)
+            if item.get('probed_mtime_ns') == st.st_mtime_ns and item.get('file_size') == st.st_size:
+                return None
+            info, bytes_read = mediainfo.probe(path)
+        except Exception as e:
+            # A parser bug on one file must not fail the whole scan
+            with self._lock:
+                self._stats['errors'] += 1
+            print(f"Metadata error for {path}: {e}")
+            return None
+        with self._lock:
+            self._stats['files_probed'] += 1
+            self._stats['bytes_read'] += bytes_read
+            self._stats['probe_seconds'] += time.perf_counter() - started
+
+        fields = {key: info[key] for key in METADATA_FIELDS if info.get(key) is not None}
+        fields['file_size'] = st.st_size
+        fields['modified'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(st.st_mtime))
+        fields['probed_mtime_ns'] = st.st_mtime_ns
+        return fields
+
+    @staticmethod
+    def apply(item, fields):
+        for key in METADATA_FIELDS:
+            item.pop(key, None)
+        item.update(fields)
+        return item
+
+    def fill(self, item):
+        """Adds metadata to a new item in place, before it is first stored."""
+        fields = self.probe(item)
+        if fields:
+            self.apply(item, fields)
+        return item
+
+    def run(self, items, job=None):
+        """Probes the given items in parallel. Returns {id: fields} for the changed ones."""
+        started = time.time()
+        items = [item for item in items if item.get('id')]
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for item, fields in zip(items, pool.map(self.probe, items)):
+                if fields is not None:
+                    results[item['id']] = fields
+        if job:
+            job.advance(files_probed=len(results))
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['files_checked'] += len(items)
+            self._stats['last_run_ms'] = round((time.time() - started) * 1000, 1)
+        return results
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, enabled=self.enabled)
+        seconds = stats.pop('probe_seconds')
+        stats['probe_ms_total'] = round(seconds * 1000, 1)
+        # Per-thread throughput; the pool multiplies it by up to `workers`
+        stats['files_per_second'] = round(stats['files_probed'] / seconds, 1) if seconds else 0.0
+        stats['mb_per_second'] = round(stats['bytes_read'] / seconds / 1e6, 2) if seconds else 0.0
+        return stats
+
+METADATA = MetadataExtractor(CONFIG.get('metadata', {}))
+
+def update_item_metadata(items, job=None):
+    """Runs the metadata stage over items, writing each changed title once.
+
+    Returns the number of items updated.
+    """
+    results = METADATA.run(items, job)
+    if not results:
+        return 0
+    updated, _ = CATALOG.modify(list(results), lambda item: METADATA.apply(item, results[item['id']]))
+    return len(updated)
+
+# --- Content Hashing ---
+
+class ContentHasher:
+    """Fingerprints media files so copies of the same content can be found.
+
+    Files are grouped by size first; only files sharing a size get a
+    partial hash (first and last block), and only files that still collide
+    get a full hash. Results are cached on disk by (device, inode, size,
+    mtime), so unchanged files are never read twice. The cache also holds
+    the file index (id -> path, size, key) of the last run, so a scan can
+    re-stat just the files it listed and still compare them against the
+    whole library.
+    """
+
+    def __init__(self, config):
+        self.enabled = config.get('enabled', True)
+        self.workers = max(1, int(config.get('workers', 4)))
+        self.partial_bytes = int(config.get('partial_kb', 64)) * 1024
+        self.path = os.path.join(CACHE_FOLDER, 'hash_cache.json')
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._cache_sig = None
+        self._stats = {'runs': 0, 'files_checked': 0, 'partial_hashed': 0, 'full_hashed': 0,
+                       'cache_hits': 0, 'bytes_read': 0, 'cache_writes': 0, 'last_run_ms': 0.0}
+
+    def _load_cache(self):
+        """Returns {'files', 'hashes'}, re-reading the file only if it changed on disk."""
+        try:
+            st = os.stat(self.path)
+            sig = (st.st_mtime_ns, st.st_size)
+            if sig != self._cache_sig:
+                with open(self.path) as f:
+                    self._cache = json.load(f)
+                self._cache_sig = sig
+        except (OSError, ValueError):
+            self._cache, self._cache_sig = {}, None
+        if 'files' not in self._cache:
+            # Written before the file index was kept: hashes only
+            return {'files': None, 'hashes': self._cache}
+        return self._cache
+
+    def _save_cache(self, cache):
+        try:
+            atomic_write_json(self.path, cache)
+            st = os.stat(self.path)
+        except OSError as e:
+            print(f"Could not save hash cache: {e}")
+            return
+        self._cache, self._cache_sig = cache, (st.st_mtime_ns, st.st_size)
+        self._count(cache_writes=1)
+
+    def _count(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def _partial_hash(self, path, size):
+        digest = hashlib.blake2b(str(size).encode(), digest_size=20)
+        with open(path, 'rb') as f:
+            head = f.read(self.partial_bytes)
+            digest.update(head)
+            read = len(head)
+            if size > 2 * self.partial_bytes:
+                f.seek(-self.partial_bytes, os.SEEK_END)
+                tail = f.read(self.partial_bytes)
+                digest.update(tail)
+                read += len(tail)
+        self._count(partial_hashed=1, bytes_read=read)
+        return digest.hexdigest()
+
+    def _full_hash(self, path):
+        digest = hashlib.blake2b(digest_size=32)
+        read = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+                read += len(block)
+        self._count(full_hashed=1, bytes_read=read)
+        return digest.hexdigest()
+
+    def _stat(self, item):
+        path = get_item_real_path(item)
+        if not path:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [path, st.st_size, f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"]
+
+    def _hash_stage(self, pool, files, cache, field, compute):
+        """Fills cache[key][field] for files missing it; files are (path, size, key)."""
+        todo = {}
+        for path, size, key in files:
+            if cache[key].get(field):
+                self._count(cache_hits=1)
+            else:
+                todo.setdefault(key, (path, size))
+        keys = list(todo)
+        for key, value in zip(keys, pool.map(lambda k: self._try(compute, *todo[k]), keys)):
+            cache[key][field] = value
+
+    def _try(self, compute, path, size):
+        try:
+            return compute(path, size)
+        except OSError as e:
+            print(f"Hashing error for {path}: {e}")
+            return None
+
+    def run(self, items, job=None, keep=None):
+        """Hashes the given items' files. Returns {id: (file_size, content_hash or None)}.
+
+        With keep=None, items are the whole library. Otherwise they are the
+        items whose files may have changed: the rest of the cached file index
+        is reused without a stat for the ids keep(ids) reports as still in
+        the library, and only ids sharing a size with a changed file are
+        returned; if the cache has no file index yet, returns None so the
+        caller can run over the whole library. The cache is written only if
+        something in it changed.
+        """
+        with self._run_lock:
+            started = time.time()
+            old = self._load_cache()
+            if keep is not None and old['files'] is None:
+                return None
+            files = {}      # id -> [path, size, key]
+            changed_sizes = set()
+            if keep is not None:
+                kept = keep(list(old['files']))
+                for media_id, entry in old['files'].items():
+                    if media_id in kept:
+                        files[media_id] = entry
+                    else:
+                        changed_sizes.add(entry[1])
+            items = [item for item in items if item.get('id')]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                checked = 0
+                for item, stat in zip(items, pool.map(self._stat, items)):
+                    previous = files.pop(item['id'], None)
+                    if stat is not None:
+                        files[item['id']] = stat
+                        checked += 1
+                    if previous != stat:
+                        changed_sizes.update(entry[1] for entry in (previous, stat) if entry)
+                self._count(files_checked=checked)
+
+                # Carry cached hashes of files that are still present and unchanged
+                hashes = {}
+                for _path, _size, key in files.values():
+                    hashes.setdefault(key, dict(old['hashes'].get(key) or {}))
+
+                by_size = {}
+                for entry in files.values():
+                    if keep is None or entry[1] in changed_sizes:
+                        by_size.setdefault(entry[1], []).append(entry)
+                # Distinct inodes of one size; hard links of a file are not copies
+                candidates = [stats for stats in by_size.values() if len({s[2] for s in stats}) > 1]
+                self._hash_stage(pool, [s for stats in candidates for s in stats], hashes,
+                                 'partial', self._partial_hash)
+
+                by_partial = {}
+                for stats in candidates:
+                    for stat in stats:
+                        if hashes[stat[2]].get('partial'):
+                            by_partial.setdefault(hashes[stat[2]]['partial'], []).append(stat)
+                collisions = [s for stats in by_partial.values()
+                              if len({s[2] for s in stats}) > 1 for s in stats]
+                self._hash_stage(pool, collisions, hashes, 'full', lambda path, size: self._full_hash(path))
+
+            if job:
+                job.advance(files_hashed=checked)
+            # Entries for files that are gone or changed are dropped here
+            cache = {'files': files, 'hashes': hashes}
+            if cache != old:
+                self._save_cache(cache)
+            self._count(runs=1)
+            with self._lock:
+                self._stats['last_run_ms'] = round((time.time() - started) * 1000, 1)
+            changed_ids = {item['id'] for item in items}
+            return {media_id: (size, hashes[key].get('full')) for media_id, (path, size, key) in files.items()
+                    if keep is None or media_id in changed_ids or size in changed_sizes}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled)
+
+HASHER = ContentHasher(CONFIG.get('hashing', {}))
+
+def update_content_hashes(items, job=None, full=False):
+    """Runs the hashing stage and stores the results on items.
+
+    items are the items a scan listed; with full=True (or before the hash
+    cache has a file index) the whole library is hashed instead. Items get
+    `file_size` and, where a full hash was needed to tell them apart from
+    another file, `content_hash`. Only changed items are written, each title
+    once. Returns the number of items updated.
+    """
+    results = None
+    if not full:
+        results = HASHER.run(items, job, keep=lambda ids: CATALOG.lookup(ids, ())[0])
+    if results is None:
+        results = HASHER.run(CATALOG.load_all(), job)
+
+    def apply(item):
+        size, content_hash = results[item['id']]
+        if item.get('file_size') == size and item.get('content_hash') == content_hash:
+            return None
+        item['file_size'] = size
+        if content_hash:
+            item['content_hash'] = content_hash
+        else:
+            item.pop('content_hash', None)
+        return item
+
+    stale = [media_id for media_id, item in CATALOG.get_many(results).items()
+             if (item.get('file_size'), item.get('content_hash')) != results[media_id]]
+    if not stale:
+        return 0
+    updated, _ = CATALOG.modify(stale, apply)
+    return len(updated)
+
+# --- Library Scanning ---
+
+# Directories modified this recently are not trusted in the journal, since
+# coarse filesystem timestamps (NAS, FAT) could hide a change made in the
+# same tick as the scan.
+JOURNAL_RACY_SECONDS = 2
+
+# Held while checking for and adding newly found files, so a scan and the
+# watcher never both add the same path, in this process or another worker
+LIBRARY_ADD_LOCK = (interprocess.FileLock(os.path.join(LOCK_FOLDER, 'library-add.lock'))
+                    if MULTIPROCESS else threading.Lock())
+
+def load_scan_journal():
+    """Returns the per-directory journal from the last scan of MEDIA_FOLDER."""
+    try:
+        with open(SCAN_JOURNAL_FILE, 'r') as f:
+            journal = json.load(f)
+        if journal.get('media_folder') == MEDIA_FOLDER:
+            return journal.get('dirs', {})
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {}
+
+def save_scan_journal(dirs):
+    atomic_write_json(SCAN_JOURNAL_FILE, {'media_folder': MEDIA_FOLDER, 'dirs': dirs})
+
+def scan_directory(abs_dir, rel_dir, journal, incremental, now):
+    """Lists one directory, or reuses its journal entry if it is unchanged.
+
+    Returns (media_files, subdirs, journal_entry, skipped) where media_files
+    is a list of (rel_dir, filename, ext, real_path).
+    """
+    st = os.stat(abs_dir)
+    previous = journal.get(rel_dir)
+    if incremental and previous and previous.get('mtime') == st.st_mtime_ns:
+        return [], previous.get('dirs', []), previous, True
+
+    media_files = []
+    subdirs = []
+    with os.scandir(abs_dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    # Like os.walk, list symlinked directories but don't descend
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                    continue
+            except OSError:
+                continue
+            ext = os.path.splitext(entry.name)[1].lower()
+            if ext in IMG_EXTS or ext in VID_EXTS:
+                media_files.append((rel_dir, entry.name, ext, entry.path))
+
+    trusted = now - st.st_mtime > JOURNAL_RACY_SECONDS
+    journal_entry = {
+        'mtime': st.st_mtime_ns if trusted else None,
+        'dirs': sorted(subdirs)
+    }
+    return media_files, subdirs, journal_entry, False
+
+def scan_tree(abs_top, rel_top, journal, incremental, now, job=None):
+    """Walks one top-level title folder. Runs inside the scan thread pool."""
+    media_files = []
+    new_journal = {}
+    skipped = rescanned = 0
+    stack = [(abs_top, rel_top)]
+    while stack:
+        abs_dir, rel_dir = stack.pop()
+        try:
+            files, subdirs, entry, was_skipped = scan_directory(abs_dir, rel_dir, journal, incremental, now)
+        except OSError as e:
+            print(f"Scan could not read {abs_dir}: {e}")
+            continue
+        media_files.extend(files)
+        new_journal[rel_dir] = entry
+        if job:
+            job.advance(dirs_visited=1, files_found=len(files))
+        if was_skipped:
+            skipped += 1
+        else:
+            rescanned += 1
+        for name in subdirs:
+            stack.append((os.path.join(abs_dir, name), f"{rel_dir}/{name}"))
+    return media_files, new_journal, skipped, rescanned
+
+def scanned_web_path(rel_dir, filename):
+    if rel_dir:
+        return f"/media_content/{rel_dir}/{filename}"
+    return f"/media_content/{filename}"
+
+def build_scanned_entry(rel_dir, filename, ext, real_path):
+    """Builds a catalog item for a file discovered by a scan."""
+    title = rel_dir.split('/', 1)[0] if rel_dir else "Uncategorized"
+    web_path = scanned_web_path(rel_dir, filename)
+    return {
+        'id': str(uuid.uuid4()),
+        'filename': filename,
+        'original_name': filename,
+        'custom_title': "",
+        'title': title,
+        'creator': title,
+        'category': 'Imported',
+        'tags': [],
+        'hidden': False,
+        'type': 'image' if ext in IMG_EXTS else 'video',
+        'path': web_path,
+        'real_path': real_path
+    }
+
+def run_scan(incremental=True, job=None):
+    """Scans MEDIA_FOLDER and adds new files to the correct title DBs.
+
+    Incremental scans reuse the directory journal to skip folders whose
+    mtime has not changed. Top-level title folders are walked concurrently.
+    """
+    started = time.time()
+    scan_config = CONFIG.get('scan', {})
+    journal = load_scan_journal() if incremental else {}
+    incremental = incremental and bool(journal)
+    mode = 'incremental' if incremental else 'full'
+    print(f"Scanning ({mode}): {MEDIA_FOLDER}")
+
+    root_files, top_dirs, root_entry, root_skipped = scan_directory(MEDIA_FOLDER, '', journal, incremental, started)
+    if job:
+        job.advance(dirs_visited=1, files_found=len(root_files))
+    media_files = list(root_files)
+    new_journal = {'': root_entry}
+    skipped = 1 if root_skipped else 0
+    rescanned = 0 if root_skipped else 1
+
+    workers = max(1, int(scan_config.get('workers', 8)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_tree, os.path.join(MEDIA_FOLDER, name), name, journal, incremental, started, job)
+                   for name in top_dirs]
+        for future in futures:
+            files, tree_journal, tree_skipped, tree_rescanned = future.result()
+            media_files.extend(files)
+            new_journal.update(tree_journal)
+            skipped += tree_skipped
+            rescanned += tree_rescanned
+
+    # We need to buffer new items by title to minimize writes
+    with LIBRARY_ADD_LOCK:
+        CATALOG.refresh()
+        seen_paths = set()
+        new_items_by_title = {}
+        for rel_dir, filename, ext, real_path in media_files:
+            web_path = scanned_web_path(rel_dir, filename)
+            if web_path in seen_paths or CATALOG.has_path(web_path):
+                continue
+            seen_paths.add(web_path) # Prevent duplicates in same scan run
+            new_entry = build_scanned_entry(rel_dir, filename, ext, real_path)
+            new_items_by_title.setdefault(new_entry['title'], []).append(new_entry)
+
+        # Save updates
+        total_added = 0
+        for title, new_items in new_items_by_title.items():
+            CATALOG.upsert(new_items)
+            total_added += len(new_items)
+            if job:
+                job.advance(items_added=len(new_items))
+
+    # Later stages only look at files in the folders this scan listed; a full scan lists them all
+    if incremental:
+        listed = {scanned_web_path(rel_dir, filename) for rel_dir, filename, _ext, _path in media_files}
+        scanned_items = [item for rel_dir in sorted({entry[0] for entry in media_files})
+                         for item in CATALOG.folder_items(rel_dir) if item.get('path') in listed]
+    else:
+        scanned_items = CATALOG.load_all()
+
+    # Metadata stage: dimensions, durations and dates of new or modified files
+    metadata_updated = update_item_metadata(scanned_items, job) if METADATA.enabled else 0
+
+    # Hashing stage: fingerprint files so duplicate content can be reported
+    hashes_updated = update_content_hashes(scanned_items, job, full=not incremental) if HASHER.enabled else 0
+
+    # Pre-warm stage: queue thumbnails for the new items in the background
+    thumbnails_queued = THUMBNAILS.prewarm(item for items in new_items_by_title.values() for item in items)
+
+    save_scan_journal(new_journal)
+    return {
+        'message': f'Scan complete. Added {total_added} new items.',
+        'added_count': total_added,
+        'mode': mode,
+        'dirs_skipped': skipped,
+        'dirs_rescanned': rescanned,
+        'thumbnails_queued': thumbnails_queued,
+        'metadata_updated': metadata_updated,
+        'hashes_updated': hashes_updated,
+        'duration_ms': round((time.time() - started) * 1000, 1)
+    }
+
+SCAN_MODES = ('incremental', 'full', 'reconcile')
+MISSING_ACTIONS = ('flag', 'prune')
+
+def list_media_dir(abs_dir):
+    """Returns the media file names in one directory, or an empty set if it can't be read."""
+    try:
+        with os.scandir(abs_dir) as entries:
+            return {entry.name for entry in entries
+                    if os.path.splitext(entry.name)[1].lower() in IMG_EXTS | VID_EXTS}
+    except OSError:
+        return set()
+
+def file_size_or_none(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return None
+
+def run_reconcile(action='flag', job=None):
+    """Checks every catalog item against the filesystem.
+
+    MEDIA_FOLDER is listed one directory at a time, each top-level title
+    folder on its own thread, instead of stat()ing every item. Items whose
+    file is gone are re-linked to an uncatalogued file with the same name
+    and size when exactly one exists, else flagged with missing=true or,
+    with action='prune', removed. Flags of items whose file is back are
+    cleared. Everything is applied in one catalog write, so each affected
+    title is written once.
+    """
+    started = time.time()
+    workers = max(1, int(CONFIG.get('scan', {}).get('workers', 8)))
+    print(f"Reconciling catalog with {MEDIA_FOLDER} ({action})")
+
+    # Taken before the walk: items added while it runs have files it may not have seen
+    items = CATALOG.load_all()
+
+    root_files, top_dirs, _entry, _skipped = scan_directory(MEDIA_FOLDER, '', {}, False, started)
+    if job:
+        job.advance(dirs_visited=1, files_found=len(root_files))
+    media_files = list(root_files)
+    listed = {os.path.normpath(MEDIA_FOLDER)}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_tree, os.path.join(MEDIA_FOLDER, name), name, {}, False, started, job)
+                   for name in top_dirs]
+        for future in futures:
+            files, tree_journal, _skipped, _rescanned = future.result()
+            media_files.extend(files)
+            listed.update(os.path.normpath(os.path.join(MEDIA_FOLDER, rel_dir)) for rel_dir in tree_journal)
+    present = {os.path.normpath(real_path) for _rel, _name, _ext, real_path in media_files}
+
+    # Items outside the walked tree (symlinked folders, other roots): list their folders too
+    outside = sorted({os.path.dirname(os.path.normpath(path)) for path in map(get_item_real_path, items)
+                      if path and os.path.dirname(os.path.normpath(path)) not in listed})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for abs_dir, names in zip(outside, pool.map(list_media_dir, outside)):
+            present.update(os.path.join(abs_dir, name) for name in names)
+
+    missing, cleared = [], []
+    for item in items:
+        path = get_item_real_path(item)
+        if path and os.path.normpath(path) in present:
+            if item.get('missing'):
+                cleared.append(item['id'])
+        # The listing only holds known media extensions; confirm before giving up on a file
+        elif not (path and os.path.exists(path)):
+            missing.append(item)
+    if job:
+        job.advance(items_missing=len(missing))
+
+    relinks = {}
+    with LIBRARY_ADD_LOCK:
+        if missing:
+            # Files no item points at, by name, as candidates for moved items
+            orphans = {}
+            for rel_dir, filename, _ext, real_path in media_files:
+                if not CATALOG.has_path(scanned_web_path(rel_dir, filename)):
+                    orphans.setdefault(filename, []).append((rel_dir, real_path))
+            for item in missing:
+                name = os.path.basename(get_item_real_path(item) or item.get('path') or '')
+                candidates = orphans.get(name, [])
+                if item.get('file_size') is not None:
+                    candidates = [c for c in candidates if file_size_or_none(c[1]) == item['file_size']]
+                if len(candidates) == 1:
+                    relinks[item['id']] = candidates[0]
+                    orphans[name].remove(candidates[0])
+
+        removed = [item['id'] for item in missing if item['id'] not in relinks] if action == 'prune' else []
+        flagged = {item['id'] for item in missing if item['id'] not in relinks} if action == 'flag' else set()
+        cleared = set(cleared)
+
+        def apply(item):
+            if item['id'] in relinks:
+                rel_dir, real_path = relinks[item['id']]
+                item['path'] = scanned_web_path(rel_dir, os.path.basename(real_path))
+                item['real_path'] = real_path
+                item.pop('missing', None)
+            elif item['id'] in flagged:
+                if item.get('missing'):
+                    return None
+                item['missing'] = True
+            elif item['id'] in cleared:
+                item.pop('missing', None)
+            return item
+
+        units = {}
+        if relinks or flagged or cleared or removed:
+            _items, units = CATALOG.modify(list(relinks) + sorted(flagged) + sorted(cleared), apply, removed)
+    if job:
+        job.advance(items_relinked=len(relinks))
+
+    return {
+        'message': f'Reconcile complete. {len(missing)} missing, {len(relinks)} re-linked.',
+        'mode': 'reconcile',
+        'action': action,
+        'items_checked': len(items),
+        'missing_count': len(missing),
+        'relinked_count': len(relinks),
+        'flagged_count': len(flagged),
+        'removed_count': len(removed),
+        'cleared_count': len(cleared),
+        'units_written': len(units),
+        'duration_ms': round((time.time() - started) * 1000, 1)
+    }
+
+class ScanJob:
+    """A scan running on a background thread, with progress counters.
+
+    Progress changes notify `changed` so event streams can wake up instead
+    of polling. With worker processes, the status is also written to
+    SCAN_JOB_FOLDER a few times a second, since status requests may reach
+    another worker.
+    """
+
+    def __init__(self, mode):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.status = 'running'
+        self.started = time.time()
+        self.finished = None
+        self.progress = {'dirs_visited': 0, 'files_found': 0, 'items_added': 0,
+                         'files_probed': 0, 'files_hashed': 0, 'items_missing': 0, 'items_relinked': 0}
+        self.result = None
+        self.error = None
+        self.version = 0
+        self.changed = threading.Condition()
+        self._published = 0.0
+
+    @property
+    def status_path(self):
+        return os.path.join(SCAN_JOB_FOLDER, f"{self.id}.json")
+
+    def publish(self, force=False):
+        if not MULTIPROCESS or (not force and time.time() - self._published < SCAN_JOB_PUBLISH_SECONDS):
+            return
+        self._published = time.time()
+        try:
+            atomic_write_json(self.status_path, self.to_dict())
+        except OSError as e:
+            print(f"Could not publish scan status: {e}")
+
+    def advance(self, **counts):
+        with self.changed:
+            for key, value in counts.items():
+                self.progress[key] += value
+            self.version += 1
+            self.changed.notify_all()
+        self.publish()
+
+    def finish(self, result=None, error=None):
+        with self.changed:
+            self.result = result
+            self.error = error
+            self.status = 'failed' if error else 'completed'
+            self.finished = time.time()
+            self.version += 1
+            self.changed.notify_all()
+        self.publish(force=True)
+
+    def to_dict(self):
+        with self.changed:
+            end = self.finished or time.time()
+            return {
+                'job_id': self.id,
+                'mode': self.mode,
+                'status': self.status,
+                'elapsed_ms': round((end - self.started) * 1000, 1),
+                **self.progress,
+                'result': self.result,
+                'error': self.error
+            }
+
+# Finished jobs kept around for status lookups
+SCAN_JOB_HISTORY = 20
+SCAN_JOBS = {}
+SCAN_JOBS_LOCK = threading.Lock()
+ACTIVE_SCAN = None
+SCAN_JOB_FOLDER = os.path.join(CACHE_FOLDER, 'scan_jobs')
+SCAN_JOB_PUBLISH_SECONDS = 0.5
+
+def find_scan_job(job_id):
+    """Returns the status of a job run by this process or, with worker processes, any other."""
+    job = SCAN_JOBS.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    if not MULTIPROCESS or not re.fullmatch(r'[0-9a-f]{12}', job_id):
+        return None
+    try:
+        with open(os.path.join(SCAN_JOB_FOLDER, f"{job_id}.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def start_scan_job(incremental=True, reconcile=None):
+    """Starts a background scan, or returns the running one. Returns (job, joined).
+
+    reconcile is a MISSING_ACTIONS value to run a reconciliation pass
+    instead of a scan.
+    """
+    global ACTIVE_SCAN
+    with SCAN_JOBS_LOCK:
+        if ACTIVE_SCAN is not None and ACTIVE_SCAN.status == 'running':
+            return ACTIVE_SCAN, True
+
+        job = ScanJob('reconcile' if reconcile else 'incremental' if incremental else 'full')
+        SCAN_JOBS[job.id] = job
+        while len(SCAN_JOBS) > SCAN_JOB_HISTORY:
+            old = SCAN_JOBS.pop(next(iter(SCAN_JOBS)))
+            if MULTIPROCESS:
+                try:
+                    os.remove(old.status_path)
+                except OSError:
+                    pass
+        ACTIVE_SCAN = job
+    if MULTIPROCESS:
+        os.makedirs(SCAN_JOB_FOLDER, exist_ok=True)
+        job.publish(force=True)
+
+    def work():
+        try:
+            if reconcile:
+                result = run_reconcile(reconcile, job=job)
+                job.finish(result=result)
+                METRICS.observe('media_scan_duration_seconds', result['duration_ms'] / 1000, mode='reconcile')
+                return
+            result = run_scan(incremental=incremental, job=job)
+            job.mode = result['mode']
+            job.finish(result=result)
+            seconds = result['duration_ms'] / 1000
+            METRICS.observe('media_scan_duration_seconds', seconds, mode=result['mode'])
+            METRICS.inc('media_scan_items_added_total', result['added_count'])
+            METRICS.set('media_scan_last_files_per_second',
+                        round(job.progress['files_found'] / seconds, 1) if seconds else 0.0)
+        except Exception as e:
+            print(f"Scan error: {e}")
+            job.finish(error=str(e))
+
+    threading.Thread(target=work, name=f"scan-{job.id}", daemon=True).start()
+    return job, False
+
+# --- Watch Mode ---
+
+class LibraryWatcher:
+    """Keeps the catalog in step with MEDIA_FOLDER without manual scans.
+
+    A backend from fswatch reports changed directories. They are queued
+    until the library has been quiet for debounce_ms (or max_delay_ms has
+    passed since the first queued change), then relisted in one batch:
+    new files are inserted and vanished ones removed, each title written
+    once per batch.
+    """
+
+    def __init__(self, config, leader_lock=None):
+        self.enabled = bool(config.get('enabled', False))
+        # Worker processes take turns: only the holder of leader_lock watches
+        self.leader_lock = leader_lock
+        self.backend_name = config.get('backend', 'auto')
+        self.debounce = float(config.get('debounce_ms', 1000)) / 1000
+        self.max_delay = float(config.get('max_delay_ms', 10000)) / 1000
+        self.poll_interval = float(config.get('poll_interval_s', 2.0))
+        self.backend = None
+        self._lock = threading.Lock()
+        self._pending = set()       # relative dirs waiting for the next batch
+        self._first_event = None    # when the oldest pending change arrived
+        self._last_event = None
+        self._stats = {'dir_changes': 0, 'overflows': 0, 'batches': 0, 'items_added': 0,
+                       'items_removed': 0, 'items_relinked': 0, 'last_batch_ms': 0.0, 'last_lag_ms': 0.0}
+
+    def _create_backend(self):
+        if self.backend_name in ('auto', 'inotify') and fswatch.inotify_available():
+            try:
+                return fswatch.InotifyWatcher(MEDIA_FOLDER)
+            except OSError as e:
+                print(f"inotify unavailable ({e}); falling back to polling")
+        return fswatch.PollingWatcher(MEDIA_FOLDER)
+
+    def start(self):
+        if not os.path.isdir(MEDIA_FOLDER):
+            print(f"Watch mode disabled: {MEDIA_FOLDER} is not a directory")
+            return
+        threading.Thread(target=self._run, name='library-watcher', daemon=True).start()
+
+    def _run(self):
+        if self.leader_lock is not None:
+            # Held until this process exits; another worker takes over then
+            self.leader_lock.acquire()
+        self.backend = self._create_backend()
+        print(f"Watching {MEDIA_FOLDER} ({self.backend.name}, {self.backend.watched_dirs} folders)")
+        while True:
+            # Inotify wakes up on events; polling sleeps for its interval
+            timeout = self.debounce / 2 if self.backend.name == 'inotify' else self.poll_interval
+            try:
+                changed = self.backend.poll(timeout)
+            except OSError as e:
+                print(f"Watcher error: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            now = time.time()
+            if changed is None:
+                # Events were lost; let an incremental scan catch up
+                with self._lock:
+                    self._stats['overflows'] += 1
+                start_scan_job(incremental=True)
+            elif changed:
+                with self._lock:
+                    self._pending |= changed
+                    self._stats['dir_changes'] += len(changed)
+                    self._first_event = self._first_event or now
+                    self._last_event = now
+            with self._lock:
+                due = self._pending and (now - self._last_event >= self.debounce
+                                         or now - self._first_event >= self.max_delay)
+                if not due:
+                    continue
+                batch, first = self._pending, self._first_event
+                self._pending, self._first_event, self._last_event = set(), None, None
+            try:
+                self.apply_batch(batch, first)
+            except Exception as e:
+                print(f"Watcher batch error: {e}")
+
+    def apply_batch(self, dirs, first_event=None):
+        """Relists the given relative dirs and syncs the catalog. Returns (added, removed).
+
+        Files that moved within the batch (a renamed folder, say) are
+        re-linked by name and size as run_reconcile does, so they keep
+        their tags and edits. Moved and new items then go through the
+        metadata, hashing and thumbnail stages of a scan.
+        """
+        started = time.time()
+        with LIBRARY_ADD_LOCK:
+            # One refresh per batch; the folder index answers the rest
+            CATALOG.refresh()
+            new_entries, vanished = [], []
+            seen = set()
+            stack = sorted(dirs)
+            while stack:
+                rel_dir = stack.pop()
+                if rel_dir in seen:
+                    continue
+                seen.add(rel_dir)
+                abs_dir = os.path.join(MEDIA_FOLDER, rel_dir) if rel_dir else MEDIA_FOLDER
+                prefix = rel_dir + '/' if rel_dir else ''
+                try:
+                    with os.scandir(abs_dir) as entries:
+                        listing = list(entries)
+                except (FileNotFoundError, NotADirectoryError):
+                    # The folder is gone, and with it everything below it
+                    vanished.extend(item for folder in [rel_dir] + CATALOG.subfolders(rel_dir)
+                                    for item in CATALOG.folder_items(folder)
+                                    if not os.path.exists(get_item_real_path(item) or ''))
+                    continue
+
+                known = {(item.get('path') or '').rpartition('/')[2]: item
+                         for item in CATALOG.folder_items(rel_dir)}
+                known_children = {folder[len(prefix):].split('/', 1)[0]
+                                  for folder in CATALOG.subfolders(rel_dir)}
+                present, subdirs = set(), set()
+                for entry in listing:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.add(entry.name)
+                            continue
+                    except OSError:
+                        continue
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext not in IMG_EXTS and ext not in VID_EXTS:
+                        continue
+                    present.add(entry.name)
+                    if entry.name not in known and not CATALOG.has_path(scanned_web_path(rel_dir, entry.name)):
+                        new_entries.append(build_scanned_entry(rel_dir, entry.name, ext, entry.path))
+
+                for name, item in known.items():
+                    if name not in present and not os.path.exists(get_item_real_path(item) or ''):
+                        vanished.append(item)
+                # New folders are walked now; vanished ones are removed on their turn
+                stack.extend(prefix + name for name in subdirs - known_children)
+                stack.extend(prefix + name for name in known_children - subdirs)
+
+            # The new file of a moved item, by name and size
+            relinks = {}
+            if vanished and new_entries:
+                arrivals = {}
+                for entry in new_entries:
+                    arrivals.setdefault(entry['filename'], []).append(entry)
+                for item in vanished:
+                    name = os.path.basename(get_item_real_path(item) or item.get('path') or '')
+                    candidates = arrivals.get(name, [])
+                    if item.get('file_size') is not None:
+                        candidates = [entry for entry in candidates
+                                      if file_size_or_none(entry['real_path']) == item['file_size']]
+                    if len(candidates) == 1:
+                        relinks[item['id']] = candidates[0]
+                        arrivals[name].remove(candidates[0])
+            moved = {id(entry) for entry in relinks.values()}
+            new_entries = [entry for entry in new_entries if id(entry) not in moved]
+            removed_ids = [item['id'] for item in vanished if item['id'] not in relinks]
+
+            def relink(item):
+                entry = relinks[item['id']]
+                item['path'] = entry['path']
+                item['real_path'] = entry['real_path']
+                item.pop('missing', None)
+                return item
+
+            if METADATA.enabled:
+                for entry in new_entries:
+                    METADATA.fill(entry)
+            if new_entries:
+                CATALOG.upsert(new_entries)
+            if relinks:
+                CATALOG.modify(list(relinks), relink)
+            if removed_ids:
+                CATALOG.remove(removed_ids)
+
+        # The post-add stages of run_scan; new entries were probed before they were stored
+        changed = list(CATALOG.get_many([entry['id'] for entry in new_entries] + list(relinks)).values())
+        if changed:
+            if METADATA.enabled:
+                update_item_metadata(changed)
+            if HASHER.enabled:
+                update_content_hashes(changed)
+        THUMBNAILS.prewarm(changed)
+
+        finished = time.time()
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['items_added'] += len(new_entries)
+            self._stats['items_removed'] += len(removed_ids)
+            self._stats['items_relinked'] += len(relinks)
+            self._stats['last_batch_ms'] = round((finished - started) * 1000, 1)
+            if first_event:
+                self._stats['last_lag_ms'] = round((finished - first_event) * 1000, 1)
+        return len(new_entries), len(removed_ids)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, enabled=self.enabled,
+                         role=('leader' if self.backend else 'standby') if self.leader_lock else None,
+                         backend=self.backend.name if self.backend else None,
+                         watched_dirs=self.backend.watched_dirs if self.backend else 0,
+                         queue_depth=len(self._pending))
+            # Age of the oldest change not yet applied
+            stats['lag_ms'] = round((time.time() - self._first_event) * 1000, 1) if self._first_event else 0.0
+        return stats
+
+WATCHER = LibraryWatcher(CONFIG.get('watch', {}),
+                         interprocess.FileLock(os.path.join(LOCK_FOLDER, 'watcher.lock')) if MULTIPROCESS else None)
+
+# --- Uploads ---
+
+UPLOAD_CONFIG = CONFIG.get('upload', {})
+MAX_UPLOAD_BYTES = int(UPLOAD_CONFIG.get('max_file_size_mb', 500) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = int(UPLOAD_CONFIG.get('chunk_size_mb', 8) * 1024 * 1024)
+UPLOAD_SESSION_FOLDER = os.path.join(CACHE_FOLDER, 'uploads')
+# Lets Werkzeug reject oversized single-request uploads before reading them
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
+
+def build_upload_entry(filename, title, category, tags, is_hidden):
+    """Returns (save_dir, entry) for a new upload; the file is not written yet."""
+    filename = secure_filename(filename)
+    file_ext = os.path.splitext(filename)[1].lower()
+    media_type = 'image' if file_ext in IMG_EXTS else 'video' if file_ext in VID_EXTS else 'image'
+    title_safe = secure_filename(title)
+    final_filename = f"{uuid.uuid4().hex[:8]}_{filename}"
+
+    tags_list = [t.strip() for t in tags.split(',') if t.strip()]
+    if is_hidden and '_cover' not in tags_list: tags_list.append('_cover')
+
+    entry = {
+        'id': str(uuid.uuid4()),
+        'filename': final_filename,
+        'original_name': filename,
+        'custom_title': "",
+        'title': title,
+        'creator': title,
+        'category': category,
+        'tags': tags_list,
+        'hidden': is_hidden,
+        'type': media_type,
+        'path': f"/media_content/{title_safe}/{final_filename}"
+    }
+    return os.path.join(MEDIA_FOLDER, title_safe), entry
+
+class UploadError(Exception):
+    """A chunked upload request that cannot be applied; carries the HTTP status."""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+class UploadSession:
+    """One resumable upload, streamed into a hidden part file in its title folder.
+
+    The session record (declared size, confirmed offset and per-chunk
+    hashes) is persisted after every chunk, so an upload survives both
+    client disconnects and server restarts. Bytes past the confirmed offset
+    are never trusted: a partly received chunk is truncated away.
+
+    With worker processes, chunks of one upload may reach different
+    workers, so the lock is a lock file and the record is re-read from disk
+    whenever it is taken.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.lock = (interprocess.FileLock(self.lock_path) if MULTIPROCESS else threading.Lock())
+        self._hasher = None     # running sha256 of the confirmed bytes, rebuilt lazily
+
+    @property
+    def id(self):
+        return self.record['upload_id']
+
+    @property
+    def part_path(self):
+        return os.path.join(self.record['save_dir'], f".{self.id}.part")
+
+    @property
+    def record_path(self):
+        return os.path.join(UPLOAD_SESSION_FOLDER, f"{self.id}.json")
+
+    @property
+    def lock_path(self):
+        return os.path.join(UPLOAD_SESSION_FOLDER, f"{self.id}.lock")
+
+    def _read_record(self):
+        try:
+            with open(self.record_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('Unknown upload', 404)
+
+    def acquire(self):
+        """Takes self.lock without waiting and brings the record up to date, or raises UploadError."""
+        if not self.lock.acquire(blocking=False):
+            raise UploadError('Another request for this upload is in progress', 409,
+                              offset=self.record['offset'])
+        if not MULTIPROCESS:
+            return
+        try:
+            record = self._read_record()
+        except BaseException:
+            self.lock.release()
+            raise
+        if record['offset'] != self.record['offset']:
+            # Another worker wrote chunks since; the running hash is stale
+            self._hasher = None
+        self.record = record
+
+    def save(self):
+        self.record['updated'] = time.time()
+        atomic_write_json(self.record_path, self.record)
+
+    def status(self):
+        # Another worker may have confirmed more chunks
+        record = self._read_record() if MULTIPROCESS else self.record
+        return {
+            'upload_id': self.id,
+            'filename': record['entry']['original_name'],
+            'size': record['size'],
+            'offset': record['offset'],
+            'chunks': len(record['chunks']),
+            'chunk_size': UPLOAD_CHUNK_BYTES,
+            'complete': record['offset'] == record['size']
+        }
+
+    def _file_hasher(self):
+        if self._hasher is None:
+            hasher = hashlib.sha256()
+            with open(self.part_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+            self._hasher = hasher
+        return self._hasher
+
+    def write_chunk(self, offset, stream, length=None, expected_sha256=None):
+        """Appends a chunk at `offset` from a byte stream; returns the new offset."""
+        self.acquire()
+        try:
+            start = self.record['offset']
+            if offset != start:
+                raise UploadError('Chunk does not start at the current offset', 409, offset=start)
+
+            limit = self.record['size'] - start
+            if length is not None and length > limit:
+                raise UploadError('Chunk runs past the declared file size', 413, offset=start)
+            chunk_hash = hashlib.sha256()
+            # The whole-file hash is only kept when the client asked for it to be checked
+            file_hash = None
+            if self.record['sha256'] and (self._hasher or start == 0):
+                file_hash = self._file_hasher().copy()
+            written = 0
+            with open(self.part_path, 'r+b') as f:
+                f.truncate(start)
+                f.seek(start)
+                try:
+                    for block in iter(lambda: stream.read(256 * 1024), b''):
+                        written += len(block)
+                        if written > limit:
+                            raise UploadError('Chunk runs past the declared file size', 413, offset=start)
+                        chunk_hash.update(block)
+                        if file_hash:
+                            file_hash.update(block)
+                        f.write(block)
+                    digest = chunk_hash.hexdigest()
+                    if expected_sha256 and expected_sha256.lower() != digest:
+                        raise UploadError('Chunk checksum mismatch', 422, offset=start)
+                    f.flush()
+                    os.fsync(f.fileno())
+                except BaseException:
+                    f.truncate(start)
+                    raise
+
+            if written:
+                self.record['chunks'].append({'offset': start, 'size': written, 'sha256': digest})
+                self.record['offset'] = start + written
+                self.save()
+                self._hasher = file_hash
+            return self.record['offset']
+        finally:
+            self.lock.release()
+
+    def verify(self):
+        """Raises UploadError unless the upload is complete and intact. Caller holds self.lock."""
+        record = self.record
+        if record['offset'] != record['size']:
+            raise UploadError('Upload is incomplete', 409, offset=record['offset'])
+        if record['sha256'] and self._file_hasher().hexdigest() != record['sha256']:
+            raise UploadError('File checksum mismatch', 422)
+
+class UploadManager:
+    """Tracks resumable upload sessions and turns finished ones into items."""
+
+    def __init__(self, ttl_hours):
+        self.ttl = ttl_hours * 3600
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self._loaded = False
+
+    def _load(self):
+        """Picks up sessions left by an earlier run and drops expired ones."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            names = os.listdir(UPLOAD_SESSION_FOLDER)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(UPLOAD_SESSION_FOLDER, name)) as f:
+                    session = UploadSession(json.load(f))
+                # Drop any bytes the previous run wrote but never confirmed,
+                # unless another worker is writing a chunk right now
+                if session.lock.acquire(blocking=False):
+                    try:
+                        with open(session.part_path, 'r+b') as f:
+                            f.truncate(session.record['offset'])
+                    finally:
+                        session.lock.release()
+                self.sessions[session.id] = session
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Discarding upload session {name}: {e}")
+                self._remove_files(os.path.join(UPLOAD_SESSION_FOLDER, name))
+
+    def _remove_files(self, *paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for session in [s for s in self.sessions.values() if s.record['updated'] < cutoff]:
+            self.discard(session.id)
+
+    def create(self, data):
+        """Starts a session for {filename, size, title, category, tags, is_hidden, sha256}."""
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            raise UploadError('size is required')
+        if size < 0:
+            raise UploadError('size must not be negative')
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadError(f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit",
+                              413, max_size=MAX_UPLOAD_BYTES)
+        if not secure_filename(data.get('filename') or ''):
+            raise UploadError('No selected file')
+
+        title = data.get('title') or 'Unknown'
+        save_dir, entry = build_upload_entry(
+            data['filename'], title, data.get('category') or 'Uncategorized',
+            data.get('tags') or '', bool(data.get('is_hidden')))
+        session = UploadSession({
+            'upload_id': uuid.uuid4().hex,
+            'save_dir': save_dir,
+            'entry': entry,
+            'size': size,
+            'offset': 0,
+            'sha256': (data.get('sha256') or '').lower() or None,
+            'chunks': [],
+            'created': time.time()
+        })
+        os.makedirs(save_dir, exist_ok=True)
+        os.makedirs(UPLOAD_SESSION_FOLDER, exist_ok=True)
+        open(session.part_path, 'wb').close()
+        session.save()
+        with self.lock:
+            self._load()
+            self._expire()
+            self.sessions[session.id] = session
+        return session
+
+    def _load_one(self, upload_id):
+        """Picks up a session another worker created. Caller holds self.lock."""
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            return None
+        try:
+            with open(os.path.join(UPLOAD_SESSION_FOLDER, f"{upload_id}.json")) as f:
+                session = UploadSession(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, upload_id):
+        with self.lock:
+            self._load()
+            session = self.sessions.get(upload_id)
+            if session is None and MULTIPROCESS:
+                session = self._load_one(upload_id)
+        if session is None:
+            raise UploadError('Unknown upload', 404)
+        return session
+
+    def discard(self, upload_id):
+        """Removes a session and its partial file. Caller holds self.lock."""
+        session = self.sessions.pop(upload_id, None)
+        if session:
+            self._remove_files(session.part_path, session.record_path)
+            if MULTIPROCESS:
+                self._remove_files(session.lock_path)
+        return session is not None
+
+    def cancel(self, upload_id):
+        with self.lock:
+            self._load()
+            if MULTIPROCESS and upload_id not in self.sessions:
+                self._load_one(upload_id)
+            return self.discard(upload_id)
+
+    def finalize(self, upload_ids):
+        """Moves completed uploads into place and adds them to the catalog.
+
+        All entries go to the catalog in one upsert, so each title is written
+        once however many files were uploaded to it. Returns (items, errors).
+        """
+        ready, errors = [], {}
+        try:
+            for upload_id in dict.fromkeys(upload_ids):
+                try:
+                    session = self.get(upload_id)
+                    # Held until the session is gone, so chunks and a second finalize are refused
+                    session.acquire()
+                    try:
+                        session.verify()
+                    except BaseException:
+                        session.lock.release()
+                        raise
+                    ready.append(session)
+                except UploadError as e:
+                    errors[upload_id] = {'error': str(e), **e.details}
+
+            entries, moved = [], []
+            try:
+                for session in ready:
+                    entry = session.record['entry']
+                    dest = os.path.join(session.record['save_dir'], entry['filename'])
+                    os.replace(session.part_path, dest)
+                    moved.append((session, dest))
+                    entries.append(METADATA.fill(entry) if METADATA.enabled else entry)
+                if entries:
+                    CATALOG.upsert(entries)
+            except BaseException:
+                # Put the files back, so no file is left without an item and the uploads can be finalized again
+                for session, dest in reversed(moved):
+                    try:
+                        os.replace(dest, session.part_path)
+                    except OSError as e:
+                        print(f"Could not restore upload {session.id} from {dest}: {e}")
+                raise
+            with self.lock:
+                for session in ready:
+                    self.discard(session.id)
+            return entries, errors
+        finally:
+            for session in ready:
+                session.lock.release()
+
+    def stats(self):
+        with self.lock:
+            self._load()
+            return {
+                'active': len(self.sessions),
+                'bytes_pending': sum(s.record['offset'] for s in self.sessions.values())
+            }
+
+UPLOADS = UploadManager(UPLOAD_CONFIG.get('session_ttl_hours', 24))
+
+# --- Export & Import ---
+
+TRANSFER_CONFIG = CONFIG.get('transfer', {})
+IMPORT_BATCH_SIZE = max(int(TRANSFER_CONFIG.get('import_batch_size', 1000)), 1)
+MAX_IMPORT_BYTES = int(TRANSFER_CONFIG.get('max_import_size_mb', 4096) * 1024 * 1024)
+IMPORT_MAX_LINE_BYTES = 1024 * 1024
+# Errors listed in an import summary; the rest are only counted
+IMPORT_ERROR_LIMIT = 50
+
+def export_lines(matches=None, compress=False):
+    """Yields the catalog as NDJSON bytes, optionally gzipped."""
+    items = CATALOG.iter_items()
+    if matches is not None:
+        items = (item for item in items if matches(item))
+    return ndjson_stream.encode_lines(items, compress)
+
+def new_import_summary():
+    return {'added': 0, 'updated': 0, 'batches': 0, 'committed': [], 'error_count': 0, 'errors': []}
+
+def import_records(records, batch_size=IMPORT_BATCH_SIZE, summary=None):
+    """Upserts (line, record, error) tuples from ndjson_stream.read_records().
+
+    A record replaces the item with its id, else the item at its path, else
+    it is added. Records are committed IMPORT_BATCH_SIZE at a time, sorted
+    by title so each batch writes as few units as possible, so memory
+    stays flat however long the input is. Returns the summary counts;
+    `committed` lists the [first, last] input lines of each committed batch.
+
+    If summary (from new_import_summary()) is given it is filled in place,
+    so a caller whose input fails partway still knows which batches went in.
+    """
+    if summary is None:
+        summary = new_import_summary()
+    pending = []
+    lines = []
+
+    def commit():
+        known_ids, path_ids = CATALOG.lookup([r['id'] for r in pending if r.get('id')],
+                                             [r['path'] for r in pending])
+        existing = known_ids | set(path_ids.values())
+        batch = {}          # id -> record; later lines win
+        batch_paths = {}    # path -> id within this batch
+        for record in pending:
+            if record.get('id') not in known_ids:
+                path = record['path']
+                record['id'] = (batch_paths.get(path) or path_ids.get(path)
+                                or record.get('id') or str(uuid.uuid4()))
+            set_item_title(record, get_item_title(record))
+            batch[record['id']] = record
+            batch_paths[record['path']] = record['id']
+        items = sorted(batch.values(), key=get_item_title)
+        CATALOG.upsert(items)
+        for item in items:
+            summary['updated' if item['id'] in existing else 'added'] += 1
+        summary['batches'] += 1
+        summary['committed'].append([lines[0], lines[-1]])
+        pending.clear()
+        lines.clear()
+
+    for number, record, error in records:
+        if error is None and not (isinstance(record.get('path'), str) and record['path']):
+            error = 'Missing path'
+        if error is not None:
+            summary['error_count'] += 1
+            if len(summary['errors']) < IMPORT_ERROR_LIMIT:
+                summary['errors'].append({'line': number, 'error': error})
+            continue
+        pending.append(record)
+        lines.append(number)
+        if len(pending) >= batch_size:
+            commit()
+    if pending:
+        commit()
+    return summary
+
+def run_cli(argv):
+    """Command line mode: export or import the catalog without starting the server."""
+    parser = argparse.ArgumentParser(prog='media_server.py',
+                                     description='Runs the media server, or exports/imports the catalog as NDJSON.')
+    commands = parser.add_subparsers(dest='command')
+    export = commands.add_parser('export', help='write every item as one JSON object per line')
+    export.add_argument('file', help="output file, '-' for stdout; names ending in .gz are gzipped")
+    export.add_argument('--gzip', action='store_true', help='gzip the output')
+    imports = commands.add_parser('import', help='upsert items from an NDJSON file, gzipped or not')
+    imports.add_argument('file', help="input file, '-' for stdin")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.command == 'export':
+        compress = args.gzip or args.file.endswith('.gz')
+        out = sys.stdout.buffer if args.file == '-' else open(args.file, 'wb')
+        try:
+            for chunk in export_lines(compress=compress):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        print(f"Exported the catalog to {args.file} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    else:
+        source = sys.stdin.buffer if args.file == '-' else open(args.file, 'rb')
+        summary = new_import_summary()
+        try:
+            import_records(ndjson_stream.read_records(source, IMPORT_MAX_LINE_BYTES), summary=summary)
+        except (OSError, EOFError, zlib.error) as e:
+            summary['error'] = f'Could not read import: {e}'
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        STORAGE.flush()
+        summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        print(json.dumps(summary, indent=2), file=sys.stderr)
+        return 1 if summary['error_count'] or 'error' in summary else 0
+    return 0
+
+# --- Startup ---
+
+STARTUP_CONFIG = CONFIG.get('startup', {})
+CATALOG_SNAPSHOT_FILE = os.path.join(CACHE_FOLDER, 'catalog_snapshot.json')
+SNAPSHOT_VERSION = 1
+
+class StartupState:
+    """Readiness and the time spent in each startup phase.
+
+    Phases run in order; a failed phase is logged and recorded, and startup
+    carries on, since the catalog also loads lazily on the first request.
+    If the catalog phase itself failed, the server is marked degraded
+    instead of ready and the readiness probe keeps failing.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.lock = threading.Lock()
+        self.phases = OrderedDict()     # name -> {'status', 'seconds', ...details}
+        self.ready_after = None
+        self.degraded = False
+        METRICS.set('media_ready', 0)
+
+    def record(self, name, seconds, status='done', **details):
+        with self.lock:
+            self.phases[name] = dict(details, status=status, seconds=round(seconds, 4))
+        METRICS.set('media_startup_phase_seconds', round(seconds, 4), phase=name)
+
+    @contextmanager
+    def phase(self, name):
+        """Times a phase; the body may add details to the yielded dict."""
+        details = {}
+        with self.lock:
+            self.phases[name] = {'status': 'running', 'seconds': None}
+        started = time.perf_counter()
+        try:
+            yield details
+        except Exception as e:
+            print(f"Startup phase '{name}' failed: {e}")
+            self.record(name, time.perf_counter() - started, status='failed', error=str(e), **details)
+        else:
+            self.record(name, time.perf_counter() - started, **details)
+
+    def failed(self, name):
+        with self.lock:
+            return self.phases.get(name, {}).get('status') == 'failed'
+
+    @property
+    def ready(self):
+        return self.ready_after is not None
+
+    def mark_ready(self):
+        self.ready_after = time.perf_counter() - self.started
+        METRICS.set('media_ready', 1)
+        print(f"Ready after {self.ready_after:.2f}s")
+
+    def mark_degraded(self):
+        self.degraded = True
+        print("Startup degraded: the catalog failed to load; /api/ready keeps answering 503")
+
+    def to_dict(self):
+        with self.lock:
+            phases = {name: dict(phase) for name, phase in self.phases.items()}
+        running = next((name for name, phase in phases.items() if phase['status'] == 'running'), None)
+        return {
+            'ready': self.ready,
+            'status': 'ready' if self.ready else 'degraded' if self.degraded else 'starting',
+            'ready_after_s': round(self.ready_after, 4) if self.ready else None,
+            'running': running,
+            'phases': phases
+        }
+
+class CatalogSnapshot:
+    """The loaded catalog and its integrity state, saved to one file.
+
+    Each unit is stored with the signature it had on disk, plus a checksum
+    when that signature is too recent to trust, so the next start only
+    reads and checks units that changed since. A snapshot taken of another
+    database, or of a unit that was rewritten since, is ignored.
+    """
+
+    def __init__(self, path, enabled):
+        self.path = path
+        self.enabled = enabled
+        self.saved_revision = None
+
+    def load(self):
+        """Returns {unit: {'sig', 'items', 'checked'}} for units whose checksum, if any, still matches."""
+        if not self.enabled:
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if (not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION
+                or data.get('storage') != STORAGE.identity()):
+            return {}
+        units = {}
+        for unit, entry in data.get('units', {}).items():
+            if entry.get('checksum') and STORAGE.unit_checksum(unit) != entry['checksum']:
+                continue
+            sig = entry.get('sig')
+            units[unit] = {
+                'sig': tuple(sig) if isinstance(sig, list) else sig,
+                'items': [item for item in entry.get('items', []) if isinstance(item, dict)],
+                'checked': bool(entry.get('checked'))
+            }
+        return units
+
+    def save(self):
+        """Writes the snapshot unless nothing changed since the last one; returns the units written."""
+        if not self.enabled or not STARTUP.ready:
+            return 0
+        STORAGE.flush()
+        revision = CATALOG.revision
+        durable = STORAGE.durable_signatures()
+        units = {}
+        for unit, (sig, items, checked) in CATALOG.snapshot_units().items():
+            entry = durable.get(unit)
+            # Skip units with edits still buffered or not yet seen by the catalog
+            if entry is None or entry[0] != sig:
+                continue
+            units[unit] = {'sig': entry[1], 'checksum': entry[2], 'checked': checked, 'items': items}
+        atomic_write_json(self.path, {'version': SNAPSHOT_VERSION, 'storage': STORAGE.identity(),
+                                      'saved_at': time.time(), 'units': units}, separators=(',', ':'))
+        self.saved_revision = revision
+        return len(units)
+
+    def save_if_changed(self):
+        if CATALOG.revision != self.saved_revision:
+            self.save()
+
+STARTUP = StartupState(IMPORT_STARTED)
+SNAPSHOT = CatalogSnapshot(CATALOG_SNAPSHOT_FILE, STARTUP_CONFIG.get('snapshot', True))
+atexit.register(SNAPSHOT.save_if_changed)
+
+def run_startup():
+    """Loads and checks the catalog in the background while the server starts listening."""
+    snapshot = {}
+    reused = read = scanned = 0
+    with STARTUP.phase('snapshot') as details:
+        snapshot = SNAPSHOT.load()
+        details['units'] = len(snapshot)
+    with STARTUP.phase('catalog') as details:
+        reused, read = CATALOG.warm(snapshot, STARTUP_CONFIG.get('workers', 4))
+        details.update(units_reused=reused, units_read=read)
+        print(f"Catalog loaded: {reused} units from snapshot, {read} read from storage")
+    if STARTUP.failed('catalog'):
+        STARTUP.mark_degraded()
+    else:
+        STARTUP.mark_ready()
+    with STARTUP.phase('integrity') as details:
+        details.update(integrity_check_title_creator(CONFIG.get('integrity', {}).get('auto_fix_title_creator', False)))
+        scanned = details['files_scanned']
+    with STARTUP.phase('save_snapshot') as details:
+        # Checking units doesn't bump the revision, so save_if_changed() can't tell
+        if read or scanned or reused != len(snapshot):
+            details['units'] = SNAPSHOT.save()
+        else:
+            SNAPSHOT.saved_revision = CATALOG.revision
+    if WATCHER.enabled:
+        with STARTUP.phase('watcher'):
+            WATCHER.start()
+
+# Run setup (skipped when a spawned thumbnail worker re-imports this module)
+if __name__ != '__mp_main__':
+    STARTUP.record('import', time.perf_counter() - IMPORT_STARTED)
+    with STARTUP.phase('directories'):
+        ensure_directories()
+    # Both are a single existence check once done, and must finish before the catalog loads
+    with STARTUP.phase('migration'):
+        with (interprocess.FileLock(os.path.join(LOCK_FOLDER, 'migration.lock'))
+              if MULTIPROCESS else nullcontext()):
+            migrate_legacy_db()
+            migrate_json_to_sqlite()
+    # export/import from the command line only need the catalog, which loads on first use
+    if not (__name__ == '__main__' and sys.argv[1:2] in (['export'], ['import'])):
+        threading.Thread(target=run_startup, name='startup', daemon=True).start()
+
+# --- Routes ---
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    METRICS.begin_request()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    # Label by URL rule, not path, so ids don't explode the series count
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.inc('media_http_requests_total', route=route, method=request.method, status=response.status_code)
+    METRICS.observe('media_http_request_duration_seconds', elapsed, route=route)
+    breakdown = METRICS.end_request()
+    if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+        METRICS.inc('media_http_slow_requests_total', route=route)
+        parts = {key: breakdown.get(key, 0.0) for key in ('db_read', 'db_write', 'parse', 'serialize')}
+        parts['other'] = max(elapsed - sum(parts.values()), 0.0)
+        print(f"Slow request: {request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+              f"in {elapsed * 1000:.1f} ms ("
+              + ', '.join(f"{key} {seconds * 1000:.1f} ms" for key, seconds in parts.items()) + ')')
+    return response
+
+@app.route('/')
+def index():
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            response = make_response(render_template_string(f.read(), bundle=asset_bundle()))
+    except FileNotFoundError:
+        return f"Error: index.html not found at {INDEX_FILE}."
+    # Always revalidated, so a rebuilt bundle is picked up on the next load
+    response.cache_control.no_cache = True
+    return response
+
+# Revisions restart with the process; the epoch keeps tokens from an
+# earlier run from being mistaken for current ones.
+REVISION_EPOCH = uuid.uuid4().hex[:8]
+_media_body_cache = (None, None)    # (revision, serialized /api/media body)
+
+def format_revision(revision):
+    return f"{REVISION_EPOCH}-{revision}"
+
+def parse_revision(token):
+    """Returns the revision number for a token of this process, else None."""
+    epoch, _, number = (token or '').partition('-')
+    if epoch != REVISION_EPOCH or not number.isdigit():
+        return None
+    return int(number)
+
+def revision_etag(revision):
+    """ETag for a response derived from the catalog revision and the query."""
+    query = hashlib.md5(request.query_string).hexdigest()[:8]
+    return f"{format_revision(revision)}-{query}"
+
+def not_modified(etag):
+    """Returns a 304 response if the client already holds `etag`, else None."""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def _tuplify(value):
+    """Turns JSON arrays from a decoded cursor back into comparable tuples."""
+    if isinstance(value, list):
+        return tuple(_tuplify(v) for v in value)
+    return value
+
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_key):
+    """Decodes a cursor; raises ValueError unless it is a (key, id) pair shaped like sort_key's keys."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    key = _tuplify(json.loads(base64.urlsafe_b64decode(padded.encode())))
+    if not (isinstance(key, tuple) and len(key) == 2 and isinstance(key[1], str)
+            and CURSOR_SHAPES[sort_key](key[0])):
+        raise ValueError('Cursor does not match the sort order')
+    return key
+
+def project_item(item, fields):
+    """Returns only the requested fields of an item."""
+    if not fields:
+        return item
+    return {k: item[k] for k in fields if k in item}
+
+# Numeric range filters: parameter -> (item value, lower bound?)
+RANGE_FILTERS = {
+    'min_width': (lambda item: item.get('width'), True),
+    'min_height': (lambda item: item.get('height'), True),
+    'min_duration': (lambda item: item.get('duration'), True),
+    'max_duration': (lambda item: item.get('duration'), False),
+    'min_size': (lambda item: item.get('file_size'), True),
+    'max_size': (lambda item: item.get('file_size'), False),
+}
+
+# /api/media parameters that narrow the result, see build_media_filter
+MEDIA_FILTER_PARAMS = ('title', 'category', 'type', 'folder', 'hidden', 'missing',
+                       'date_from', 'date_to', *RANGE_FILTERS)
+# Filters whose match count the catalog keeps up to date
+COUNTED_FILTERS = ('title', 'category')
+
+def build_media_filter(args):
+    """Builds an item predicate from /api/media query parameters.
+
+    Raises ValueError for malformed numeric filters.
+    """
+    title = args.get('title')
+    category = args.get('category')
+    media_type = args.get('type')
+    folder = (args.get('folder') or '').strip('/')
+    hidden = args.get('hidden')
+    hidden = None if hidden is None else hidden.lower() == 'true'
+    missing = args.get('missing')
+    missing = None if missing is None else missing.lower() == 'true'
+    # ISO dates compare correctly as text; 'date_to=2024-05' includes all of May
+    date_from = args.get('date_from')
+    date_to = args.get('date_to')
+    ranges = []
+    for param, (value_of, is_min) in RANGE_FILTERS.items():
+        if args.get(param) is not None:
+            try:
+                ranges.append((value_of, is_min, float(args[param])))
+            except ValueError:
+                raise ValueError(f'Invalid {param}') from None
+
+    def matches(item):
+        if title is not None and get_item_title(item) != title:
+            return False
+        if category is not None and item.get('category') != category:
+            return False
+        if hidden is not None and bool(item.get('hidden')) != hidden:
+            return False
+        if missing is not None and bool(item.get('missing')) != missing:
+            return False
+        if media_type is not None and item.get('type') != media_type:
+            return False
+        if folder:
+            item_folder = get_item_folder(item)
+            if item_folder != folder and not item_folder.startswith(folder + '/'):
+                return False
+        if date_from or date_to:
+            date = get_item_date(item)
+            if date is None or (date_from and date < date_from) or (date_to and date[:len(date_to)] > date_to):
+                return False
+        for value_of, is_min, bound in ranges:
+            value = value_of(item)
+            if value is None or (value < bound if is_min else value > bound):
+                return False
+        return True
+    return matches
+
+@app.route('/api/media', methods=['GET'])
+def get_media():
+    """Returns the library. Any query parameter switches to a paginated envelope.
+
+    Parameters: title, category, type, folder (path prefix below
+    /media_content/), hidden and missing (true/false), date_from/date_to, the
+    RANGE_FILTERS, sort (a SORT_KEYS name, '-' for descending), limit,
+    cursor (from a previous next_cursor), fields (comma separated) and count
+    (1 to include total where the catalog does not keep a count).
+
+    Responses carry an ETag derived from the catalog revision, so an
+    unchanged library answers conditional requests with 304, and an
+    X-Catalog-Revision header for use with /api/media/changes.
+    """
+    global _media_body_cache
+    revision = CATALOG.current_revision()
+    etag = revision_etag(revision)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    if not request.args:
+        cached_revision, body = _media_body_cache
+        if cached_revision != revision:
+            body = app.json.dumps(load_all_media())
+            _media_body_cache = (revision, body)
+        response = Response(body, mimetype='application/json')
+    else:
+        response = _media_page()
+        if isinstance(response, tuple):
+            return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Catalog-Revision'] = format_revision(revision)
+    return response
+
+def _media_page():
+    """Builds the paginated /api/media envelope for the current query."""
+    sort = request.args.get('sort', 'name')
+    descending = sort.startswith('-')
+    sort_key = sort.lstrip('-')
+    if sort_key not in SORT_KEYS:
+        return jsonify({'error': f'Unknown sort key: {sort_key}'}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 200)), 1), 5000)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor, sort_key) if cursor else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    try:
+        matches = build_media_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    keys, ordered = CATALOG.sorted_items(sort_key)
+
+    if descending:
+        start = bisect.bisect_left(keys, after) - 1 if after is not None else len(keys) - 1
+        positions = range(start, -1, -1)
+    else:
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        positions = range(start, len(keys))
+
+    page = []
+    last_key = None
+    has_more = False
+    for pos in positions:
+        item = ordered[pos]
+        if not matches(item):
+            continue
+        if len(page) == limit:
+            has_more = True
+            break
+        page.append(project_item(item, fields))
+        last_key = keys[pos]
+
+    envelope = {'items': page, 'next_cursor': encode_cursor(last_key) if has_more else None}
+    # Counting other filters walks the whole catalog, so that only happens on request
+    active = [param for param in MEDIA_FILTER_PARAMS if request.args.get(param) is not None]
+    if not active:
+        envelope['total'] = len(ordered)
+    elif len(active) == 1 and active[0] in COUNTED_FILTERS and request.args[active[0]]:
+        envelope['total'] = CATALOG.count_items(**{active[0]: request.args[active[0]]})
+    elif request.args.get('count', '').lower() in ('1', 'true'):
+        envelope['total'] = sum(1 for item in ordered if matches(item))
+    return jsonify(envelope)
+
+@app.route('/api/media/changes', methods=['GET'])
+def get_media_changes():
+    """Returns what changed in the library since a revision.
+
+    Parameters: since (the X-Catalog-Revision or revision of an earlier
+    response) and fields. If the change log no longer reaches back that far,
+    or the server restarted, the response has reset=true and the client
+    should reload /api/media.
+    """
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    since = parse_revision(request.args.get('since'))
+    result = CATALOG.changes_since(since) if since is not None else None
+    if result is None:
+        return jsonify({'revision': format_revision(CATALOG.current_revision()), 'reset': True})
+
+    revision, added, changed, removed = result
+    return jsonify({
+        'revision': format_revision(revision),
+        'reset': False,
+        'added': [project_item(item, fields) for item in added],
+        'changed': [project_item(item, fields) for item in changed],
+        'removed': removed
+    })
+
+# Item fields a folder cover needs to render its thumbnail
+TREE_COVER_FIELDS = ('id', 'type', 'path', 'filename', 'hidden')
+TREE_MAX_DEPTH = 8
+
+@app.route('/api/tree', methods=['GET'])
+def get_tree():
+    """Returns the browse folders with counts and covers, without the items.
+
+    Parameters: by ('title' or 'category'), path (repeated, one folder name
+    per level, starting with the group) and depth (levels of subfolders to
+    include, default 1). Served from the catalog's materialized tree and
+    revalidated with the same revision ETags as /api/media.
+    """
+    grouping = request.args.get('by', 'title')
+    if grouping not in FolderTree.GROUPINGS:
+        return jsonify({'error': f'Unknown grouping: {grouping}'}), 400
+    try:
+        depth = min(max(int(request.args.get('depth', 1)), 1), TREE_MAX_DEPTH)
+    except ValueError:
+        return jsonify({'error': 'Invalid depth'}), 400
+    path = request.args.getlist('path')
+
+    revision = CATALOG.current_revision()
+    etag = revision_etag(revision)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    revision, folders = CATALOG.folder_tree(grouping, path, depth,
+                                            lambda item: project_item(item, TREE_COVER_FIELDS))
+    if folders is None:
+        return jsonify({'error': 'Folder not found'}), 404
+    response = jsonify({'by': grouping, 'path': path, 'folders': folders})
+    response.set_etag(revision_etag(revision))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Catalog-Revision'] = format_revision(revision)
+    return response
+
+@app.route('/api/export', methods=['GET'])
+def export_media():
+    """Streams the library as NDJSON, one item per line.
+
+    Accepts the /api/media filters, and gzip=true for a gzipped file. The
+    body is generated from the catalog as it is sent, a unit at a time.
+    """
+    try:
+        matches = build_media_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    compress = request.args.get('gzip', 'false').lower() == 'true'
+    revision = CATALOG.current_revision()
+    filename = 'library.ndjson.gz' if compress else 'library.ndjson'
+    return Response(export_lines(matches, compress),
+                    mimetype='application/gzip' if compress else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'Cache-Control': 'no-store',
+                             'X-Catalog-Revision': format_revision(revision)})
+
+@app.route('/api/import', methods=['POST'])
+def import_media():
+    """Upserts items from an NDJSON request body, gzipped or not.
+
+    Items match existing ones by id, then by path. The body is read a line
+    at a time and committed in batches; malformed lines are reported by
+    line number and skipped.
+    """
+    request.max_content_length = MAX_IMPORT_BYTES
+    started = time.perf_counter()
+    summary = new_import_summary()
+    try:
+        import_records(ndjson_stream.read_records(request.stream, IMPORT_MAX_LINE_BYTES), summary=summary)
+    except (OSError, EOFError, zlib.error, RequestEntityTooLarge) as e:
+        # Batches already committed stay in; report them with the error
+        summary['error'] = f'Could not read import: {e}'
+        summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return jsonify(summary), 413 if isinstance(e, RequestEntityTooLarge) else 400
+    summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return jsonify(summary)
+
+@app.route('/api/search', methods=['GET'])
+def search_media():
+    """Ranked search over names, tags, title and category.
+
+    Parameters: q, tag (restrict to items carrying this tag), include_hidden,
+    limit, offset and fields. Facets count tags across all matching items.
+    """
+    query = request.args.get('q', '')
+    tag = request.args.get('tag')
+    include_hidden = request.args.get('include_hidden', 'false').lower() == 'true'
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 5000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+
+    results = []
+    tag_counts = Counter()
+    for score, item in CATALOG.search_items(query):
+        if item.get('hidden') and not include_hidden:
+            continue
+        tags = [t for t in (item.get('tags') or []) if t != '_cover']
+        if tag is not None and tag not in tags:
+            continue
+        tag_counts.update(set(tags))
+        results.append((score, item))
+
+    page = results[offset:offset + limit]
+    return jsonify({
+        'items': [dict(project_item(item, fields), score=round(score, 3)) for score, item in page],
+        'total': len(results),
+        'next_offset': offset + limit if offset + limit < len(results) else None,
+        'facets': {'tags': dict(tag_counts.most_common(50))}
+    })
+
+@app.route('/api/scan', methods=['POST'])
+def scan_media():
+    """Starts a background scan that adds new files to the correct title DBs.
+
+    Pass ?mode=full to ignore the directory journal and list every folder,
+    or ?mode=reconcile to check items for missing files instead, with
+    action=flag or prune. If a scan is already running, its job is
+    returned instead of a new one.
+    """
+    scan_config = CONFIG.get('scan', {})
+    default_mode = 'incremental' if scan_config.get('incremental', True) else 'full'
+    mode = request.args.get('mode', default_mode)
+    if mode not in SCAN_MODES:
+        return jsonify({'error': f'Unknown mode: {mode}'}), 400
+    reconcile = None
+    if mode == 'reconcile':
+        reconcile = request.args.get('action', scan_config.get('missing_action', 'flag'))
+        if reconcile not in MISSING_ACTIONS:
+            return jsonify({'error': f'Unknown action: {reconcile}'}), 400
+    job, joined = start_scan_job(incremental=(mode != 'full'), reconcile=reconcile)
+    status = job.to_dict()
+    status['joined'] = joined
+    status['message'] = 'Joined running scan.' if joined else 'Scan started.'
+    return jsonify(status), 202
+
+@app.route('/api/scan/<job_id>', methods=['GET'])
+def scan_status(job_id):
+    status = find_scan_job(job_id)
+    if status is None:
+        return jsonify({'error': 'Scan job not found'}), 404
+    return jsonify(status)
+
+@app.route('/api/scan/<job_id>/events', methods=['GET'])
+def scan_events(job_id):
+    """Server-Sent Events stream of a scan job's progress."""
+    job = SCAN_JOBS.get(job_id)
+    if job is None and find_scan_job(job_id) is None:
+        return jsonify({'error': 'Scan job not found'}), 404
+
+    def stream_published():
+        # Another worker runs the job: follow its published status
+        last, quiet = None, 0.0
+        while True:
+            status = find_scan_job(job_id)
+            if status is None:
+                return
+            if status != last:
+                last, quiet = status, 0.0
+                event = 'progress' if status['status'] == 'running' else 'done'
+                yield f"event: {event}\ndata: {json.dumps(status)}\n\n"
+                if event == 'done':
+                    return
+            elif quiet >= 15:
+                quiet = 0.0
+                yield ': keep-alive\n\n'
+            time.sleep(SCAN_JOB_PUBLISH_SECONDS)
+            quiet += SCAN_JOB_PUBLISH_SECONDS
+
+    def stream():
+        seen = -1
+        while True:
+            with job.changed:
+                if job.version == seen and job.status == 'running':
+                    job.changed.wait(timeout=15)
+                idle = job.version == seen and job.status == 'running'
+                seen = job.version
+            # Yield outside the lock: a slow client must not block job.advance()
+            if idle:
+                yield ': keep-alive\n\n'
+                continue
+            status = job.to_dict()
+            event = 'progress' if status['status'] == 'running' else 'done'
+            yield f"event: {event}\ndata: {json.dumps(status)}\n\n"
+            if event == 'done':
+                return
+            # Coalesce bursts of progress into a few events per second
+            time.sleep(0.25)
+
+    return Response(stream() if job is not None else stream_published(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    file = request.files['file']
+    title = request.form.get('title', 'Unknown')
+    category = request.form.get('category', 'Uncategorized')
+    tags = request.form.get('tags', '')
+    is_hidden = request.form.get('is_hidden') == 'true'
+    
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file:
+        save_path, new_entry = build_upload_entry(file.filename, title, category, tags, is_hidden)
+        # Save physically
+        if not os.path.exists(save_path): os.makedirs(save_path)
+        file.save(os.path.join(save_path, new_entry['filename']))
+        if METADATA.enabled:
+            METADATA.fill(new_entry)
+
+        CATALOG.upsert([new_entry])
+
+        return jsonify(new_entry), 201
+
+def upload_error(e):
+    return jsonify({'error': str(e), **e.details}), e.status
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Starts a resumable upload.
+
+    Body: {filename, size, title, category, tags, is_hidden, sha256 (optional,
+    checked at finalize)}. Returns the upload_id and the suggested chunk size.
+    """
+    try:
+        session = UPLOADS.create(request.json or {})
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(session.status()), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Returns the confirmed offset, where a resumed upload continues from."""
+    try:
+        return jsonify(UPLOADS.get(upload_id).status())
+    except UploadError as e:
+        return upload_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Appends the request body at ?offset=N, streaming it to disk.
+
+    An optional X-Chunk-SHA256 header is verified before the chunk is
+    accepted. On a 409 the response carries the offset to resume from.
+    """
+    try:
+        session = UPLOADS.get(upload_id)
+        offset = int(request.args.get('offset', session.record['offset']))
+        new_offset = session.write_chunk(offset, request.stream, request.content_length,
+                                         request.headers.get('X-Chunk-SHA256'))
+        return jsonify(session.status() | {'offset': new_offset})
+    except ValueError:
+        return jsonify({'error': 'Invalid offset'}), 400
+    except UploadError as e:
+        return upload_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    if not UPLOADS.cancel(upload_id):
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify({'message': 'Upload cancelled'})
+
+@app.route('/api/uploads/finalize', methods=['POST'])
+def finalize_uploads():
+    """Adds completed uploads to the library: {"upload_ids": [...]}.
+
+    Uploads that are incomplete or fail their checksum are reported in
+    `errors` and can be resumed; the rest are added in one catalog write.
+    """
+    upload_ids = (request.json or {}).get('upload_ids') or []
+    if not upload_ids:
+        return jsonify({'error': 'No uploads'}), 400
+    items, errors = UPLOADS.finalize(upload_ids)
+    return jsonify({'items': items, 'errors': errors}), 201 if items else 409
+
+@app.route('/api/update/<media_id>', methods=['POST'])
+def update_media(media_id):
+    """Updates an item under its title lock. Handles title moves."""
+    data = request.json
+    moved = []
+
+    def apply(item):
+        # Check if Creator Changed (requires moving between titles)
+        new_title = data.get('title') or data.get('creator')
+        old_title = get_item_title(item)
+
+        if new_title and new_title != old_title:
+            # Update fields; the catalog moves it to the new title's unit
+            item.update({k: v for k, v in data.items() if k in item})
+            set_item_title(item, new_title)
+            moved.append(item['id'])
+            return item
+
+        # Simple update in place
+        # Process tags carefully
+        if 'tags' in data:
+            tags_input = data['tags']
+            if isinstance(tags_input, str):
+                item['tags'] = [t.strip() for t in tags_input.split(',') if t.strip()]
+            else:
+                item['tags'] = tags_input
+
+        # Update other scalar fields
+        for field in ['custom_title', 'hidden', 'category']:
+            if field in data:
+                item[field] = data[field]
+        if 'title' in data or 'creator' in data:
+            set_item_title(item, new_title)
+        return item
+
+    items, _units = CATALOG.modify([media_id], apply)
+    if not items:
+        return jsonify({'error': 'Item not found'}), 404
+    if moved:
+        return jsonify({'message': 'Updated and moved successfully'})
+    return jsonify({'message': 'Updated successfully'})
+
+@app.route('/api/batch_update', methods=['POST'])
+def batch_update():
+    """Applies many updates in one pass, writing each touched title once.
+
+    Ids are resolved to their titles through the catalog index, every
+    source title is rewritten once and every destination title is appended
+    to once, so a bulk rename costs O(titles touched) writes.
+    """
+    started = time.perf_counter()
+    data = request.json
+    updates = data.get('updates', [])
+    if not updates: return jsonify({'message': 'No updates'}), 400
+
+    # Group updates by ID for fast lookup
+    updates_by_id = {u['id']: u for u in updates if u.get('id')}
+    # id -> (old title, new title); keyed so a retried pass does not double count
+    outcomes = {}
+
+    def apply(item):
+        change = updates_by_id[item['id']]
+
+        # Handle Creator Change (Move)
+        new_title = change.get('title') or change.get('creator')
+        old_title = get_item_title(item)
+        if new_title and new_title != old_title:
+            set_item_title(item, new_title)
+        else:
+            # In-place update
+            item.update({k: v for k, v in change.items() if k in item})
+            if 'title' in change or 'creator' in change:
+                set_item_title(item, new_title)
+        outcomes[item['id']] = (old_title, get_item_title(item))
+        return item
+
+    try:
+        items, units = CATALOG.modify(list(updates_by_id), apply)
+    except Exception as e:
+        print(f"Batch error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    per_title = {}
+    for old_title, new_title in outcomes.values():
+        for title in (old_title, new_title):
+            per_title.setdefault(title, {'updated': 0, 'moved_in': 0, 'moved_out': 0})
+        if old_title == new_title:
+            per_title[old_title]['updated'] += 1
+        else:
+            per_title[old_title]['moved_out'] += 1
+            per_title[new_title]['moved_in'] += 1
+
+    found = {item['id'] for item in items}
+    return jsonify({
+        'message': 'Batch update complete',
+        'updated_count': len(items),
+        'missing_ids': [media_id for media_id in updates_by_id if media_id not in found],
+        'titles': per_title,
+        'units_written': len(units),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.route('/media_content/<path:subpath>')
+def serve_media(subpath):
+    return serve_file(MEDIA_FOLDER, subpath, HTTP_CONFIG.get('media_max_age', 86400),
+                      HTTP_CONFIG.get('accel_media_prefix', '/protected_media'))
+
+@app.route('/api/thumb/<media_id>')
+def get_thumbnail(media_id):
+    """Serves a cached thumbnail, rendering it on first request.
+
+    ?size= picks the smallest configured size that covers it. Without Pillow
+    images redirect to the original; videos without ffmpeg get a placeholder.
+    """
+    item = CATALOG.get(media_id)
+    if item is None:
+        return jsonify({'error': 'Item not found'}), 404
+
+    size = THUMBNAILS.pick_size(request.args.get('size', type=int))
+    try:
+        path = THUMBNAILS.ensure(item, size)
+    except FileNotFoundError:
+        return jsonify({'error': 'Media file not found'}), 404
+    except Exception as e:
+        print(f"Thumbnail error for {media_id}: {e}")
+        path = None
+
+    if path:
+        # The cache key already covers the source's size and mtime
+        etag = os.path.splitext(os.path.basename(path))[0]
+        return send_file(path, mimetype='image/jpeg', etag=etag, max_age=3600)
+    if item.get('type') == 'video':
+        response = Response(thumbnails.PLACEHOLDER_SVG, mimetype='image/svg+xml')
+        response.cache_control.max_age = 3600
+        return response
+    return redirect(item['path'])
+
+@app.route('/api/duplicates', methods=['GET'])
+def get_duplicates():
+    """Groups items whose files have identical content.
+
+    Hashes are filled in by the hashing stage of a scan. Groups are sorted
+    by the bytes that removing all but one copy would free. Parameters:
+    limit (groups, default 100) and fields.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 5000)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+
+    groups = {}
+    for item in CATALOG.load_all():
+        if item.get('content_hash'):
+            groups.setdefault(item['content_hash'], []).append(item)
+    duplicates = []
+    for content_hash, items in groups.items():
+        if len(items) < 2:
+            continue
+        size = items[0].get('file_size') or 0
+        duplicates.append({
+            'content_hash': content_hash,
+            'file_size': size,
+            'count': len(items),
+            'reclaimable_bytes': size * (len(items) - 1),
+            'items': [project_item(item, fields) for item in items]
+        })
+    duplicates.sort(key=lambda group: group['reclaimable_bytes'], reverse=True)
+
+    return jsonify({
+        'groups': duplicates[:limit],
+        'total_groups': len(duplicates),
+        'duplicate_items': sum(group['count'] - 1 for group in duplicates),
+        'reclaimable_bytes': sum(group['reclaimable_bytes'] for group in duplicates)
+    })
+
+@app.route('/api/titles', methods=['GET'])
+def get_titles():
+    """Returns list of all unique titles."""
+    return jsonify(CATALOG.titles())
+
+@app.route('/api/categories', methods=['GET'])
+def get_categories():
+    """Returns list of all unique categories."""
+    return jsonify(CATALOG.categories())
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Returns storage write coalescing and title lock statistics."""
+    return jsonify({
+        'storage': dict(STORAGE.stats(), backend=STORAGE.name),
+        'title_locks': CATALOG.title_locks.stats(),
+        'thumbnails': THUMBNAILS.stats(),
+        'watcher': WATCHER.stats(),
+        'metadata': METADATA.stats(),
+        'hashing': HASHER.stats(),
+        'uploads': UPLOADS.stats(),
+        'startup': STARTUP.to_dict(),
+        'process': {'pid': os.getpid(), 'multiprocess': MULTIPROCESS, 'generation': CATALOG.generation}
+    })
+
+@app.route('/api/ready', methods=['GET'])
+def get_readiness():
+    """Readiness probe: 200 once the catalog is loaded, 503 before or if it failed, with startup phase timings."""
+    return jsonify(STARTUP.to_dict()), 200 if STARTUP.ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, storage, serialization and scan metrics in the Prometheus text format."""
+    METRICS.set('media_catalog_items', len(CATALOG.load_all()))
+    METRICS.set('media_catalog_revision', CATALOG.revision)
+    watcher = WATCHER.stats()
+    METRICS.set('media_watch_queue_depth', watcher['queue_depth'])
+    METRICS.set('media_watch_lag_seconds', watcher['lag_ms'] / 1000)
+    METRICS.set('media_uploads_active', UPLOADS.stats()['active'])
+    METRICS.set('media_thumbnail_cache_bytes', THUMBNAILS.cache.stats()['bytes'])
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/config', methods=['GET'])
+def get_public_config():
+    """Returns branding and other frontend-safe configuration."""
+    return jsonify({
+        'branding': CONFIG.get('branding', {}),
+        'appearance': CONFIG.get('appearance', {}),
+        'supported_formats': CONFIG.get('supported_formats', {})
+    })
+
+@app.route('/assets/<path:filename>')
+def serve_assets(filename):
+    """Serve CSS, JS, and other static assets from the assets folder.
+
+    Built bundle files under dist/ have content-hashed names, so they are
+    cached as immutable and sent precompressed when possible.
+    """
+    bundled = filename.startswith('dist/') and filename != 'dist/manifest.json'
+    return serve_file(ASSETS_FOLDER, filename, HTTP_CONFIG.get('assets_max_age', 0),
+                      HTTP_CONFIG.get('accel_assets_prefix', '/protected_assets'),
+                      precompressed=bundled, immutable=bundled)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] in (['export'], ['import']):
+        sys.exit(run_cli(sys.argv[1:]))
 
-if __name__ == '__main__':
     host = CONFIG['server']['host']
     port = CONFIG['server']['port']
     debug = CONFIG['server']['debug']
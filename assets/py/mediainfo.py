@@ -0,0 +1,316 @@
+"""Header-only metadata extraction for media_server.py.
+
+Reads just enough of a file to find its dimensions, duration and capture
+date: JPEG/PNG/GIF/WebP images and MP4/MOV, WebM/MKV and AVI videos. Pure
+Python with no import-time side effects, so it is safe to call from
+worker threads.
+"""
+import os
+import re
+import struct
+from datetime import datetime, timedelta
+
+# How much of a Matroska/WebM file is read looking for its Info and Tracks
+EBML_HEAD_BYTES = 1024 * 1024
+
+class _Reader:
+    """File wrapper that counts the bytes actually read."""
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+
+    def read(self, n):
+        data = self.f.read(n)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+def _iso_since(epoch, **offset):
+    """Returns epoch + offset as an ISO date, or None if it is out of range."""
+    try:
+        return _iso(epoch + timedelta(**offset))
+    except OverflowError:
+        return None
+
+# --- Images ---
+
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_EXIF_DATE = re.compile(r'^(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})')
+
+def _exif_date(value):
+    match = _EXIF_DATE.match(value)
+    if not match or match.group(1) == '0000':
+        return None
+    return '{}-{}-{}T{}:{}:{}'.format(*match.groups())
+
+def _parse_exif(tiff):
+    """Returns (orientation, capture date) from a TIFF-structured EXIF block."""
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None, None
+
+    def entries(offset):
+        if offset + 2 > len(tiff):
+            return
+        count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+        for i in range(count):
+            pos = offset + 2 + 12 * i
+            if pos + 12 > len(tiff):
+                return
+            tag, kind, n = struct.unpack_from(endian + 'HHI', tiff, pos)
+            yield tag, kind, n, pos + 8
+
+    def ascii_value(n, pos):
+        if n > 4:
+            pos = struct.unpack_from(endian + 'I', tiff, pos)[0]
+        return tiff[pos:pos + n].split(b'\0', 1)[0].decode('ascii', 'replace')
+
+    orientation = date = original = None
+    exif_ifd = None
+    for tag, kind, n, pos in entries(struct.unpack_from(endian + 'I', tiff, 4)[0]):
+        if tag == 0x0112:
+            orientation = struct.unpack_from(endian + 'H', tiff, pos)[0]
+        elif tag == 0x0132:
+            date = _exif_date(ascii_value(n, pos))
+        elif tag == 0x8769:
+            exif_ifd = struct.unpack_from(endian + 'I', tiff, pos)[0]
+    if exif_ifd:
+        for tag, kind, n, pos in entries(exif_ifd):
+            if tag == 0x9003:
+                original = _exif_date(ascii_value(n, pos))
+    return orientation, original or date
+
+def _jpeg(f):
+    info = {}
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            break
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue
+        if marker in (0xD9, 0xDA):
+            break
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker == 0xE1 and 'taken_at' not in info:
+            data = f.read(length - 2)
+            if data.startswith(b'Exif\0\0'):
+                try:
+                    orientation, taken_at = _parse_exif(data[6:])
+                except struct.error:
+                    orientation, taken_at = None, None
+                if taken_at:
+                    info['taken_at'] = taken_at
+                info['_orientation'] = orientation
+        elif marker in _SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            info['width'], info['height'] = width, height
+            break
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+    # EXIF orientations 5-8 are rotated by 90 degrees
+    if (info.pop('_orientation', None) or 0) >= 5 and 'width' in info:
+        info['width'], info['height'] = info['height'], info['width']
+    return info
+
+def _png(head):
+    width, height = struct.unpack('>II', head[16:24])
+    return {'width': width, 'height': height}
+
+def _gif(head):
+    width, height = struct.unpack('<HH', head[6:10])
+    return {'width': width, 'height': height}
+
+def _webp(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        return {'width': width & 0x3FFF, 'height': height & 0x3FFF}
+    if chunk == b'VP8L' and head[20] == 0x2F:
+        bits = struct.unpack('<I', head[21:25])[0]
+        return {'width': (bits & 0x3FFF) + 1, 'height': ((bits >> 14) & 0x3FFF) + 1}
+    if chunk == b'VP8X':
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return {'width': width, 'height': height}
+    return {}
+
+# --- Videos ---
+
+def _boxes(f, start, end):
+    """Yields (type, data start, box end) for the ISO BMFF boxes in [start, end)."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            return
+        yield kind, pos + header_size, pos + size
+        pos += size
+
+def _mp4(f, file_size):
+    info = {}
+    for kind, start, end in _boxes(f, 0, file_size):
+        if kind != b'moov':
+            continue
+        for child, cstart, cend in _boxes(f, start, end):
+            if child == b'mvhd':
+                f.seek(cstart)
+                data = f.read(32)
+                if data[0] == 1:
+                    created, _, timescale, duration = struct.unpack('>QQIQ', data[4:32])
+                else:
+                    created, _, timescale, duration = struct.unpack('>IIII', data[4:20])
+                if timescale:
+                    info['duration'] = round(duration / timescale, 3)
+                # Seconds since 1904-01-01; zero means the muxer did not set it
+                taken_at = _iso_since(datetime(1904, 1, 1), seconds=created) if created else None
+                if taken_at:
+                    info['taken_at'] = taken_at
+            elif child == b'trak' and 'width' not in info:
+                for grandchild, gstart, gend in _boxes(f, cstart, cend):
+                    if grandchild != b'tkhd':
+                        continue
+                    f.seek(gstart)
+                    data = f.read(96)
+                    matrix = 52 if data[0] == 1 else 40
+                    a, b = struct.unpack('>ii', data[matrix:matrix + 8])
+                    width, height = struct.unpack('>II', data[matrix + 36:matrix + 44])
+                    width, height = width >> 16, height >> 16
+                    if width and height:
+                        # A rotation matrix of 90 or 270 degrees swaps the displayed size
+                        if a == 0 and b != 0:
+                            width, height = height, width
+                        info['width'], info['height'] = width, height
+        break
+    return info
+
+_EBML_MASTERS = {0x18538067, 0x1549A966, 0x1654AE6B, 0xAE, 0xE0}
+_EBML_CLUSTER = 0x1F43B675
+
+def _vint(buf, pos, keep_marker):
+    first = buf[pos]
+    length = 8 - first.bit_length() + 1
+    if length > 8 or pos + length > len(buf):
+        raise ValueError('bad EBML variable-length integer')
+    value = first if keep_marker else first & ((1 << (8 - length)) - 1)
+    for byte in buf[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, pos + length, unknown
+
+def _ebml(buf):
+    info = {}
+    scale = 1000000
+    duration = None
+
+    def walk(pos, end, parent):
+        nonlocal scale, duration
+        while pos < end:
+            element, pos, _ = _vint(buf, pos, True)
+            size, pos, unknown = _vint(buf, pos, False)
+            data_end = len(buf) if unknown else min(pos + size, len(buf))
+            if element == _EBML_CLUSTER:
+                return True
+            if element in _EBML_MASTERS:
+                if walk(pos, data_end, element):
+                    return True
+            elif parent == 0x1549A966:
+                data = buf[pos:data_end]
+                if element == 0x2AD7B1:
+                    scale = int.from_bytes(data, 'big')
+                elif element == 0x4489 and len(data) in (4, 8):
+                    duration = struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+                elif element == 0x4461 and len(data) == 8:
+                    ns = int.from_bytes(data, 'big', signed=True)
+                    taken_at = _iso_since(datetime(2001, 1, 1), microseconds=ns // 1000)
+                    if taken_at:
+                        info['taken_at'] = taken_at
+            elif parent == 0xE0:
+                # The first video track wins
+                if element == 0xB0:
+                    info.setdefault('width', int.from_bytes(buf[pos:data_end], 'big'))
+                elif element == 0xBA:
+                    info.setdefault('height', int.from_bytes(buf[pos:data_end], 'big'))
+            pos = data_end
+        return False
+
+    # Skip the EBML header, then walk the segment
+    _, pos, _ = _vint(buf, 0, True)
+    size, pos, _ = _vint(buf, pos, False)
+    try:
+        walk(pos + size, len(buf), None)
+    except (ValueError, IndexError):
+        pass
+    if duration is not None:
+        info['duration'] = round(duration * scale / 1e9, 3)
+    return info
+
+def _avi(head):
+    if head[12:16] != b'LIST' or head[20:24] != b'hdrl' or head[24:28] != b'avih':
+        return {}
+    usec_per_frame, _, _, _, frames, _, _, _, width, height = struct.unpack('<10I', head[32:72])
+    info = {'width': width, 'height': height}
+    if usec_per_frame and frames:
+        info['duration'] = round(usec_per_frame * frames / 1e6, 3)
+    return info
+
+# --- Entry point ---
+
+def probe(path):
+    """Returns ({width, height, duration, taken_at} where known, bytes read).
+
+    Unknown or damaged files yield an empty dict rather than an error;
+    OSError from opening or reading the file propagates.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        f = _Reader(raw)
+        head = f.read(96)
+        try:
+            if head.startswith(b'\xff\xd8'):
+                info = _jpeg(f)
+            elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+                info = _png(head)
+            elif head[:6] in (b'GIF87a', b'GIF89a'):
+                info = _gif(head)
+            elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                info = _webp(head)
+            elif head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+                info = _avi(head)
+            elif head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'):
+                info = _mp4(f, file_size)
+            elif head[:4] == b'\x1a\x45\xdf\xa3':
+                f.seek(0)
+                info = _ebml(f.read(EBML_HEAD_BYTES))
+            else:
+                info = {}
+        except (struct.error, ValueError, IndexError, OverflowError):
+            info = {}
+        return info, f.bytes_read
@@ -0,0 +1,96 @@
+"""Streaming NDJSON (one JSON object per line) for media_server.py's export and import.
+
+encode_lines() turns an item iterator into byte chunks, optionally
+gzipped, without building the whole document. read_records() parses a
+binary stream line by line, gunzipping it when it starts with the gzip
+magic, so memory stays bounded by the longest accepted line. Nothing
+happens at import time.
+"""
+import gzip
+import io
+import json
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 64 * 1024
+
+def encode_lines(items, compress=False):
+    """Yields NDJSON bytes for items in chunks of about CHUNK_SIZE."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for item in items:
+        line = json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+class _Prefixed(io.RawIOBase):
+    """A raw stream that replays bytes already read from another stream."""
+
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._head:
+            n = min(len(buffer), len(self._head))
+            buffer[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def open_stream(stream):
+    """Wraps a binary stream for line reading, gunzipping it if needed."""
+    head = stream.read(2)
+    reader = io.BufferedReader(_Prefixed(head, stream), CHUNK_SIZE)
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=reader, mode='rb')
+    return reader
+
+def read_records(stream, max_line=1024 * 1024):
+    """Yields (line number, object, error) for every non-blank line.
+
+    Exactly one of object and error is set. Lines longer than max_line
+    bytes are skipped without being held in memory; so are lines that are
+    not a JSON object.
+    """
+    reader = open_stream(stream)
+    number = 0
+    while True:
+        line = reader.readline(max_line + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_line and not line.endswith(b'\n'):
+            # Drain the rest of the oversized line
+            while line and not line.endswith(b'\n'):
+                line = reader.readline(max_line + 1)
+            yield number, None, f'Line longer than {max_line} bytes'
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Not a JSON object'
+            continue
+        yield number, record, None
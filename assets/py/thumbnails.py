@@ -0,0 +1,80 @@
+"""Thumbnail rendering for media_server.py.
+
+The functions here run inside a process pool. This module has no
+import-time side effects, so worker processes can import it cheaply on
+platforms that spawn rather than fork.
+"""
+import os
+import subprocess
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; image thumbnails are disabled without it
+    Image = None
+    ImageOps = None
+
+PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 160 160">'
+    '<rect width="160" height="160" fill="#1f2937"/>'
+    '<circle cx="80" cy="80" r="34" fill="none" stroke="#9ca3af" stroke-width="6"/>'
+    '<path d="M70 62 L100 80 L70 98 Z" fill="#9ca3af"/>'
+    '</svg>'
+)
+
+def can_render_images():
+    return Image is not None
+
+def _replace(tmp_path, dest):
+    os.replace(tmp_path, dest)
+    return os.path.getsize(dest)
+
+def _discard(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+def render_image(src, dest, size, quality=80):
+    """Downscales an image to fit size x size and saves it as JPEG."""
+    tmp_path = f"{dest}.{os.getpid()}.tmp"
+    try:
+        with Image.open(src) as im:
+            # Let the JPEG decoder downscale while decoding instead of afterwards
+            im.draft('RGB', (size, size))
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((size, size))
+            if im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+            im.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+        return _replace(tmp_path, dest)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+def render_video(src, dest, size, quality=80, ffmpeg='ffmpeg'):
+    """Grabs an early frame of a video with ffmpeg and saves it as JPEG."""
+    tmp_path = f"{dest}.{os.getpid()}.tmp.jpg"
+    qscale = str(max(2, min(31, round((100 - quality) / 3))))
+    scale = f"scale={size}:{size}:force_original_aspect_ratio=decrease"
+    try:
+        # Seek a second in to skip black lead-in frames; retry from the start for short clips
+        for offset in ('1', '0'):
+            subprocess.run(
+                [ffmpeg, '-v', 'error', '-ss', offset, '-i', src, '-frames:v', '1',
+                 '-vf', scale, '-q:v', qscale, '-y', tmp_path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60, check=False)
+            if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                return _replace(tmp_path, dest)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    # ffmpeg may leave an empty file behind
+    _discard(tmp_path)
+    raise RuntimeError(f"ffmpeg could not extract a frame from {src}")
+
+def render(src, dest, size, kind, quality=80, ffmpeg=None):
+    """Renders one thumbnail and returns its size in bytes."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if kind == 'video':
+        return render_video(src, dest, size, quality, ffmpeg or 'ffmpeg')
+    return render_image(src, dest, size, quality)
@@ -0,0 +1,15 @@
+"""WSGI entry point for serving media_server.py with several worker processes.
+
+    gunicorn --workers 4 --bind 0.0.0.0:5000 --chdir assets/py wsgi:app
+
+Workers share the database: title writes are locked across processes and
+every worker's catalog picks up the titles the others changed. Don't use
+--preload; each worker must start its own background threads.
+"""
+import os
+
+os.environ.setdefault('MEDIA_SERVER_MULTIPROCESS', '1')
+
+from media_server import app  # noqa: E402
+
+application = app